@@ -0,0 +1,256 @@
+# benchmarks for tellTello, by Martin Piehslinger
+
+'''
+Reproducible benchmarks for tellTello, no Tello needed. The results are written as json, so that
+releases can be compared:
+
+    python benchTello.py -o bench-1.4.json
+    python benchTello.py --bench parse rc idle
+
+parse     ... state frames per second decoded by interpreteState, for some watch sets, compared with the V 1.3 parser
+rc        ... rc commands per second created by rcCommand
+watch     ... watch rows per second stored by watchState, state keys compared with expressions of them
+roundtrip ... command round trip times (percentiles) against telloSim.py on a loopback address
+idle      ... cpu time used by the timer of both engines while nothing happens (a polling timer shows up here)
+memory    ... memory growth over a simulated watch session (default 30 minutes at 10 frames per second)
+'''
+
+import tellTello
+import threading
+import socket
+import subprocess
+import sys
+import os
+import time
+import json
+import platform
+import asyncio
+import tracemalloc
+import argparse
+
+#-----------------------------------------------------------------------------------
+def legacyState (StateString, StateDict):
+	''' the state parser of tellTello V 1.3, for comparison: split the whole string into a dict of strings '''
+	StateSplitted = StateString.split(';')
+	while (StateSplitted):
+		Pair = StateSplitted.pop(0)
+		if (':' in Pair):
+			PairSplitted = Pair.split (':')
+			StateDict[PairSplitted[0]] = PairSplitted[1]
+	return (int(StateDict["bat"]), round((int(StateDict["temph"]) + int(StateDict["templ"])) / 2))
+#-----------------------------------------------------------------------------------
+def rate (Function, Seconds):
+	''' call Function repeatedly for about Seconds, return calls per second '''
+	Count = 0
+	Batch = 1000
+	Start = time.perf_counter()
+	End = Start + Seconds
+	while (True):
+		for Loop in range (0, Batch):
+			Function()
+		Count = Count + Batch
+		Now = time.perf_counter()
+		if (Now >= End):
+			return (round (Count / (Now - Start)))
+#-----------------------------------------------------------------------------------
+def percentiles (Values):
+	''' the usual percentiles of Values, in ms '''
+	Values = sorted (Values)
+	Result = {"count": len(Values)}
+	if (len(Values) > 0):
+		for Name, Fraction in [("p50", 0.5), ("p90", 0.9), ("p99", 0.99)]:
+			Result[Name] = round (Values[min (len(Values) - 1, int (Fraction * len(Values)))] * 1000, 3)
+		Result["max"] = round (Values[-1] * 1000, 3)
+	return (Result)
+#-----------------------------------------------------------------------------------
+def benchParse (Seconds):
+	''' state frames per second, for the keys tellTello always needs, 3 watched keys and all keys '''
+	Result = {}
+	Length = tellTello.stateLoad (tellTello.StateDummy)
+	WatchSets = {"always": [], "watch3": ["h", "bat", "baro"], "all": list(tellTello.StateDict)}
+	for Name, WhichWatch in WatchSets.items():
+		tellTello.WhichWatch = WhichWatch
+		tellTello.stateKeys()
+		Result[Name] = rate (lambda: tellTello.interpreteState (Length), Seconds)
+	tellTello.WhichWatch = []
+	tellTello.stateKeys()
+
+	StateDict = dict(tellTello.StateDict)
+	Result["legacy"] = rate (lambda: legacyState (tellTello.StateDummy, StateDict), Seconds)
+	return (Result)
+#-----------------------------------------------------------------------------------
+def benchRc (Seconds):
+	''' rc commands per second, with one value to be limited '''
+	return ({"rc": rate (lambda: tellTello.rcCommand ([50, -50, 120, 0]), Seconds)})
+#-----------------------------------------------------------------------------------
+def benchWatch (Seconds):
+	''' watch rows per second, for 3 state keys and for 3 expressions (compiled once by watchItem) '''
+	Result = {}
+	tellTello.interpreteState (tellTello.stateLoad (tellTello.StateDummy))
+	tellTello.WatchEcho = False
+	WatchSets = {"keys": ["h", "vgx", "agz"], "expressions": ["speed=sqrt(vgx**2+vgy**2)", "temp=(temph+templ)/2", "g=sqrt(agx**2+agy**2+agz**2)"]}
+	for Name, WhichWatch in WatchSets.items():
+		tellTello.WhichWatch = WhichWatch
+		tellTello.stateKeys()
+		tellTello.watchSet()
+		tellTello.OldWhichWatch = tellTello.WhichWatch		# no header on the console
+		Result[Name] = rate (lambda: tellTello.watchState (0), Seconds)
+	tellTello.WhichWatch = []
+	tellTello.stateKeys()
+	tellTello.WatchEcho = True
+	return (Result)
+#-----------------------------------------------------------------------------------
+def benchRoundTrip (Count, IpAddress, SimArgs):
+	''' round trip times of commands sent by sendCommand and answered by telloSim, answers decoded by interpreteAnswer '''
+	Simulator = subprocess.Popen ([sys.executable, os.path.join (os.path.dirname (os.path.abspath (__file__)), "telloSim.py"),
+		"--ip", IpAddress, "-d", "0", "--delay", "0"] + SimArgs)
+	time.sleep (1)						# let telloSim bind its socket
+	Result = {}
+	try:
+		tellTello.SockBasic = tellTello.udpSocket (('', 0))
+		tellTello.SockBasic.settimeout (1)
+		tellTello.tello_address = (IpAddress, 8889)
+		tellTello.Offline = False
+		Times = []
+		Lost = 0
+		for Loop in range (0, Count):
+			Command = ["battery?", "sdk?", "wifi?", "command"][Loop % 4]
+			tellTello.LastCommand = Command
+			Start = time.perf_counter()
+			tellTello.sendCommand (Command)
+			try:
+				Data, Address = tellTello.SockBasic.recvfrom (1518)
+			except socket.timeout:
+				Lost = Lost + 1
+				continue
+			tellTello.interpreteAnswer (Data.decode (encoding="utf-8"))
+			Times.append (time.perf_counter() - Start)
+		Result = percentiles (Times)
+		Result["lost"] = Lost
+	finally:
+		tellTello.Offline = True
+		tellTello.SockBasic.close()
+		tellTello.SockBasic = None
+		Simulator.terminate()
+		Simulator.wait()
+	return (Result)
+#-----------------------------------------------------------------------------------
+def benchIdle (Seconds):
+	''' cpu time (percent of one core) used by the timer of the threaded and the asyncio engine while waiting for the keepalive '''
+	Result = {}
+
+	tellTello.Running = True
+	Thread = threading.Thread(target=tellTello.timerFunc)
+	Cpu = time.process_time()
+	Thread.start()
+	time.sleep (Seconds)
+	Cpu = time.process_time() - Cpu
+	tellTello.Running = False
+	tellTello.timerWake()
+	Thread.join()
+	Result["threads"] = round (Cpu / Seconds * 100, 3)
+
+	async def idle():
+		tellTello.AsyncLoop = asyncio.get_running_loop()
+		tellTello.AsyncTimerEvent = asyncio.Event()
+		tellTello.AsyncMainEvent = asyncio.Event()
+		Task = asyncio.ensure_future (tellTello.timerTask())
+		Cpu = time.process_time()
+		await asyncio.sleep (Seconds)
+		Cpu = time.process_time() - Cpu
+		tellTello.Running = False
+		tellTello.timerWake()
+		await Task
+		return (Cpu)
+
+	tellTello.Running = True
+	Cpu = asyncio.run (idle())
+	tellTello.AsyncLoop = None
+	Result["asyncio"] = round (Cpu / Seconds * 100, 3)
+	return (Result)
+#-----------------------------------------------------------------------------------
+def benchMemory (Minutes, FramesPerSecond):
+	''' memory growth while watching 3 keys for Minutes, frames are fed with simulated time stamps as fast as possible. rows is what the ring holds at the end '''
+	Frames = int (Minutes * 60 * FramesPerSecond)
+	tellTello.WatchEcho = False
+	tellTello.WhichWatch = ["h", "bat", "baro"]
+	tellTello.stateKeys()
+	tellTello.watchSet()
+	tellTello.OldWhichWatch = tellTello.WhichWatch		# no header on the console
+	Start = time.time()
+
+	def feed (First, Last):
+		for Frame in range (First, Last):
+			State = tellTello.StateDummy.replace ("h:0;", "h:" + str(Frame % 200) + ";")
+			Time = Start + Frame / FramesPerSecond
+			if (Frame % (10 * FramesPerSecond) == 0):
+				tellTello.commandLog ("wifi?", Time)
+			tellTello.stateReceived (tellTello.stateLoad (State), Time, Watch = True)
+
+	WarmUp = min (Frames, 60 * FramesPerSecond)
+	tracemalloc.start()
+	feed (0, WarmUp)							# the first minute allocates what is needed anyway
+	Before = tracemalloc.get_traced_memory()[0]
+	Elapsed = time.perf_counter()
+	feed (WarmUp, Frames)
+	Elapsed = time.perf_counter() - Elapsed
+	After, Peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+
+	tellTello.WhichWatch = []
+	tellTello.stateKeys()
+	return ({"frames": Frames, "growth_bytes": After - Before, "peak_bytes": Peak, "rows": tellTello.WatchCount, "capacity": tellTello.WatchCapacity,
+		"frames_per_second": round ((Frames - WarmUp) / Elapsed) if (Elapsed > 0) else 0})
+#-----------------------------------------------------------------------------------
+def version ():
+	''' the newest version in the history of tellTello '''
+	for Line in tellTello.__doc__.splitlines():
+		if (Line.startswith ("## V")):
+			return (Line[3:].strip())
+	return ("")
+
+#-----------------------------------------------------------------------------------
+def main():
+	''' the main program of benchTello '''
+	Benches = ["parse", "rc", "watch", "roundtrip", "idle", "memory"]
+	Parser = argparse.ArgumentParser(description = "benchTello - benchmarks for tellTello, results in json format")
+	Parser.add_argument("-b", "--bench", type=str, nargs='+', choices=Benches, default=Benches, help="benchmarks to run, default=all")
+	Parser.add_argument("-o", "--output", type=str, default='', help="write the results to this file instead of the console")
+	Parser.add_argument("--seconds", type=float, default=2, help="duration of the parse, rc, watch and idle benchmarks, default=2")
+	Parser.add_argument("--count", type=int, default=1000, help="number of commands for the round trip benchmark, default=1000")
+	Parser.add_argument("--ip", type=str, default='127.0.0.2', help="address of telloSim for the round trip benchmark, default=127.0.0.2")
+	Parser.add_argument("--sim", type=str, default='', help="more options for telloSim, e.g. \"--latency 0.01 --loss 0.01\"")
+	Parser.add_argument("--minutes", type=float, default=30, help="duration of the simulated watch session, default=30")
+	Parser.add_argument("--rate", type=int, default=10, help="state frames per second of the simulated watch session, default=10")
+	args = Parser.parse_args()
+
+	tellTello.DebugLevel = 0
+	tellTello.watchInit (tellTello.WatchCapacity)
+	tellTello.stateKeys()
+
+	Results = {"tellTello": version(), "python": platform.python_version(), "platform": platform.platform(),
+		"time": time.strftime ("%Y-%m-%d %H:%M:%S")}
+	if ("parse" in args.bench):
+		Results["parse"] = benchParse (args.seconds)
+	if ("rc" in args.bench):
+		Results["rc"] = benchRc (args.seconds)
+	if ("watch" in args.bench):
+		Results["watch"] = benchWatch (args.seconds)
+	if ("roundtrip" in args.bench):
+		Results["roundtrip"] = benchRoundTrip (args.count, args.ip, args.sim.split())
+	if ("idle" in args.bench):
+		Results["idle"] = benchIdle (args.seconds)
+	if ("memory" in args.bench):
+		Results["memory"] = benchMemory (args.minutes, args.rate)
+
+	Output = json.dumps (Results, indent = 2)
+	if (args.output != ''):
+		with open (args.output, "w") as File:
+			File.write (Output + "\n")
+	else:
+		print (Output)
+
+#--------------------------------------------------------------------------
+
+if __name__ == '__main__':
+	main()
@@ -3,6 +3,36 @@
 '''
 # history:
 
+## V 1.4
+timer task sleeps until the next event (keepalive, watch, sleep) instead of polling the clock
+optional asyncio engine (--engine asyncio): sockets, timer and console input on one event loop
+state frames are received into a preallocated buffer, only the watched keys are decoded (to numbers)
+watch values are kept in a ring of typed columns (--watchsize), csv lines are formatted for ww and at the end only
+new command: log - write the watch rows to a csv file in the background (--log, with rotation and csv format options)
+new command: record - binary flight recorder for state frames, commands and answers (--record), recorderRead opens recordings as numpy arrays
+new command: replay - feed recorded state frames through watch and log, --replay for batch runs with frames/s report
+the --watch option is used now
+telloSim.py simulates Tellos on loopback addresses (--ip 127.0.0.2), sockets are bound with SO_REUSEADDR for that
+benchTello.py: benchmarks for parsing, rc commands, round trips, idle cpu and memory, results in json format
+answers are matched to the commands waiting for them, with timeouts and retries (queries and settings only), new command: rtt
+command queue with lanes: emergency and stop preempt everything, rc is latest-wins, typed queries and the keepalive have low priority, scripts stay in order. New command: queue
+joy mode sends the sticks as a fixed-rate rc stream (--rcrate, new command rcrate), which coalesces key repeats and keeps the link alive
+swarm mode (--swarm ip,ip,...): several Tellos on one event loop, @n and @all commands, scripts in lockstep, new command: swarm
+new command: stats - frame rate, inter-arrival histogram and jitter, gaps, rtt percentiles, queues, udp counters, cpu time per thread (--stats n for a periodic dump)
+new command: profile start|stop|dump - cProfile per thread, switched on and off while flying, merged into one pstats file (--profile)
+scripts are checked (commands, number of arguments, ranges) before they run, in the same pass which compiles them. New in scripts: set, $variables, repeat n ... endrepeat, include
+keys and keywords are dispatched by tables instead of if/elif chains, keys can be bound in a file (--keys, new command keys), shift keys double dist/angle, input latency per source in stats
+key and joy mode on Linux terminals (termios): the main loop waits for keys and events instead of polling, arrow and function keys are decoded from escape sequences, ctrl-C ends tellTello cleanly
+video is received by tellTello (port 11111) into a ring of NALs, which are handed to the player (ffplay, stdin), the recorder (raw .h264) and other subscribers without copies. Bitrate, keyframe interval and estimated loss in stats and video stats
+video recordings get a keyframe index (.idx, receive times on the clock of the state frames), videoCut.py cuts time windows and snapshots with it
+new command: hold - altitude hold in joy mode, baro, tof and h in a complementary filter, PID on the vertical stick at a fixed rate, latency and jitter in stats
+new commands: expo, rate - joystick curves per axis (lookup tables), ramp, decay - the sticks move to the keys and back to the center on a fixed tick
+watch expressions like speed=sqrt(vgx**2+vgy**2): checked and compiled once when the watch set changes, stored in the ring like state values
+new command: when - rules on the state frames (when bat<20 once do land), indexed by key and threshold, with hysteresis, one-shot or repeating
+queries (battery?, temp?, height? ...) are answered from the state frames or from answers within their TTL, health shows the ages. The keepalive is only sent when nothing else has been sent for 10 s, also while a script sleeps
+recordings keep commands and answers which are longer than a record whole (RecordMore records)
+testTello.py: checks without a Tello (rules without console input, profiling, recordings, queries, watch names), with telloSim where needed
+
 ## V 1.3
 new commands: wp, wc, ww for csv-formatted watch 
 print csv when ending tellTello
@@ -21,13 +51,13 @@ joystick mode - simulate a joystick (controller) with the keyboard
 
 
 # todo:
-shift-w/a/s/d/left/..... do double dist/angle 
-issue: Ctrl-C in key or joy mode causes program to hang 
-user-definable function keys while usung key mode 
-joystick mode: expo 
-altitude stabilisation with baro sensor 
 
 # done:
+joystick mode: expo 
+altitude stabilisation with baro sensor 
+issue: Ctrl-C in key or joy mode causes program to hang 
+shift-w/a/s/d/left/..... do double dist/angle 
+user-definable function keys while usung key mode 
 scripting feature 
 commands are not interpreted immediately but inserted into the commands array 
 timer task .... keepalive and regular status updates 
@@ -51,15 +81,41 @@ import socket
 import sys
 import os
 import time
+import heapq
 from pythonping import ping
-import msvcrt					# works for windows only. Linux users, import getch instead (not tested)
 import argparse
+import asyncio
+import array
+import math
+import struct
+import json
+import zlib
+import mmap
+import queue
+import operator
+import collections
+import bisect
+import ast
+import cProfile
+import pstats
+import selectors
+import subprocess
+try:
+	import msvcrt				# Windows console
+	import ctypes				# the state of the shift key, which msvcrt.getch doesn't tell for arrow keys
+except ImportError:
+	msvcrt = None				# Linux and other POSIX terminals: raw keys via termios, see keyboardStart
+	import termios
+try:
+	import numpy
+except ImportError:
+	numpy = None				# only needed to read recordings, see recorderRead
 
 #-----------------------------------------------------------------------------------
 def help (parser):
 	'''print help message. +++ variaous topics +++ information like battery, temperature '''
 	
-	print ("# tellTello.py V 1.3")
+	print ("# tellTello.py V 1.4")
 	print ("# ******************")
 	print ("")
 	print ("A console-based frontend to the SDK of the Ryze Tello Quadrocopter")
@@ -80,18 +136,36 @@ def help (parser):
 	print ("* joy     ... enter joystick mode")
 	print ("* debug n ... set debug level to n. Default = 1")
 	print ("* ready   ... start motors and enter joystick mode")
+	print ("* hold on [cm] ... altitude hold (baro, tof and h) in joystick mode: w/s move its target by 10 cm, the other sticks stay with the pilot. hold off, hold pid kp ki kd, hold shows the state")
 	print ("* watch a b c d ... select which values to extrace from state string, like \"watch bat baro agx\". \"watch\" without parameters will reset to non-interpreted state.")
+	print ("  expressions without spaces are watched like values: \"watch h speed=sqrt(vgx**2+vgy**2) temp=(temph+templ)/2\"")
+	print ("* when cond [hyst h] [once] do cmd ... queue cmd when cond (like bat<20 or h>300) becomes true, like \"when bat<15 once do land\". when off n|all, when lists the rules")
 	print ("* wp n or watchperiod n ... every n seconds, a state frame will be printed. n=-1 turns off the state strings. ")
 	print ("  wp or watchperiod without parameter: toggle watch on/off")
 	print ("* ww      ... watch write")
 	print ("* wc      ... watch clear")
+	print ("* record f [z] ... record all state frames, commands and answers to binary file f (z = compressed). \"record off\" closes the file")
+	print ("* replay f [n] ... feed the state frames of a recording or csv log f through watch and log, n times faster (0 = as fast as possible), offline only")
+	print ("* log f   ... write the watch rows to csv file f while flying. \"log off\" closes the file, \"log\" shows the current file")
 	print ("* state n ... output n lines of status strings")
-	print ("* health  ... print some status values (Caution, values may be stale)")
+	print ("* health  ... print some status values and the cached answers of queries, with their ages")
+	print ("* rtt     ... round trip times, timeouts and retries per command")
+	print ("* queue   ... depth and waiting times of the command queue (emergency, rc, normal and low priority lane)")
+	print ("* profile start|stop|dump [f] ... profile every thread (receivers, timer, writers, main loop), dump them to pstats file f (default tellTello.prof)")
+	print ("* stats [n] ... frame rate, jitter, gaps, round trip times, queues, udp counters and cpu time per thread. Every n seconds with n, stats 0 to stop")
+	print ("* rcrate n ... send the joystick n times per second in joy mode (0 = at every key)")
+	print ("* expo e [axis], rate r [axis] ... joystick curves: expo 0 (linear) .. 1, rate = rc value at full stick (10 .. 100). axis = roll, pitch, throttle or yaw, default all")
+	print ("* ramp n, decay n ... the sticks move n % per second to where the keys put them (0 = at once), and back to the center (0 = they stay). ramp shows the curves")
+	print ("* @n cmd  ... swarm mode: send cmd to Tello n only (@1,3 cmd to Tellos 1 and 3, @all cmd or just cmd to all of them)")
+	print ("* swarm   ... status of the Tellos in swarm mode. \"swarm watch n\" watches, logs and records Tello n")
 	print ("* dist  n ... set the distance for move commands (to be given in key mode, such as \"w\", which will make Tello go up n centimeters)")
 	print ("* ang   n ... set the angle for rotate commands (to be given in key mode, such as \"a\", which will make Tello turn left n degrees)")
 	print ("* oscommand ... invoke an operating system command (like \"dir\") in an new window")
-	print ("* vido      ... turn video stream on and open an external video player (ffmpeg) in a new window")
+	print ("* video     ... turn video stream on, receive it and pipe it into a player (ffplay)")
+	print ("  video on|off, video play [program], video record f|off, video stats ... receive without player, stop, other player, record raw h264 to f, bitrate and loss")
+	print ("* keys [f] ... show the key bindings, or add the bindings of file f (lines like \"f5 flip f\" or \"W move up 2\", see README)")
 	print ("* script file... opens file which contains commands to execute ")
+	print ("  in scripts: set name value, $name, repeat n [name] ... endrepeat, include file, # comments")
 	print ("* sleep n ... pause for n seconds (fractons of seconds are allowed) ")
 	print ("* end     ... end tellTello")
 	print ("")
@@ -105,8 +179,10 @@ def help (parser):
 	print ("* j  ... enter joystick mode")
 	print ("* k  ... enter key mode")
 	print ("* h,H,5,space ... stop current movement and hover")
+	print ("* W/A/S/D, shift + arrow keys ... like w/a/s/d and arrow keys, but double dist, ang or stick")
 	print ("* v  ... start video")
 	print ("* ESC... return to string-based input")
+	print ("* ctrl-C ... end tellTello")
 	print ("#### Motion keys in key mode: ")
 	print ("* w or 8 ... go up dist centimeters      (see \"dist\" command)")
 	print ("* a or 4 ... turn left (ccw) ang degrees (see \"ang\"  command)")
@@ -144,20 +220,13 @@ def debug (Level, Message, end = '\n'):
 #-----------------------------------------------------------------------------------
 def recvBasic():
 	''' receive responds to commands (such as "ok") '''
-	global TimeSent
-	global TelloReady
 	global Running
-	# global DataDecoded
 	global SockBasic
-	global LastCommand
-	global TelloInfo
 	
 	debug (3, "Tello recvBasic task started")
 	count = 0
 	while Running: 
 		RecvError = False
-		# data = "---"
-		# data = data.encode(encoding="utf-8")
 		DataDecoded = ''
 		try:
 			data, server = SockBasic.recvfrom(1518)
@@ -170,41 +239,101 @@ def recvBasic():
 				debug (1, '\n------------------- Exception: ' + str(e) + '\n')
 				break
 		if (not RecvError):
-			# Time = (time.time() - TimeSent)
+			StatsCount[StatAnswers] += 1
+			StatsCount[StatAnswerBytes] += len(data)
 			try:
 				DataDecoded = data.decode(encoding="utf-8")
 			except Exception as e:
 				debug (1, str(e))
-			debug(2, DataDecoded)
-			TelloReady = True
-			
-			if (DataDecoded != 'ok'):
-				if (LastCommand == 'wifi?'):
-					try: 
-						TelloInfo["wifi"] = int(DataDecoded)
-					except Exception:
-						TelloInfo["wifi"] = -1
-					debug (3, "wifi signal noise ratio " + str(TelloInfo["wifi"]))
-				elif (LastCommand == 'sdk?'):
-					if (DataDecoded == 'unknown command'):
-						TelloInfo["sdk"] = 10    # assume that we are on SDK 1.x 
-					else:
-						try: 
-							TelloInfo["sdk"] = int(DataDecoded)
-						except Exception:
-							TelloInfo["sdk"] = -1
-					debug (3, "SDK version " + str(TelloInfo["sdk"]))
-				elif (LastCommand == 'battery?'):
-					try: 
-						TelloInfo["bat"] = int(DataDecoded)
-					except Exception:
-						TelloInfo["bat"] = -1
-					debug (3, "Battery " + str(TelloInfo["bat"]))
-	
-
+			interpreteAnswer (DataDecoded)
+		ThreadCpu["recvBasic"] = time.thread_time()
+		profileCheck ("recvBasic")
 
+	profileEnd ("recvBasic")
 	debug (3, "recvBasic ended")
 #-----------------------------------------------------------------------------------
+def interpreteAnswer (DataDecoded):
+	''' interprete Tello's answer to the command it belongs to, see commandAnswered. Called by recvBasic or by the asyncio engine '''
+	global TelloInfo
+	global MoveSpeed
+	
+	debug(2, DataDecoded)
+	if (Recording):
+		recorderAdd (RecordAnswer, time.time(), DataDecoded)
+	Command = commandAnswered (DataDecoded)
+	if (Command.endswith ('?') and (not DataDecoded.startswith ('error')) and (DataDecoded != 'unknown command')):
+		QueryCache[Command] = (DataDecoded, time.perf_counter())
+	if ((Command.startswith ('speed ') and (DataDecoded == 'ok')) or (Command == 'speed?')):		# for the timeouts of moves
+		try:
+			MoveSpeed = max (10, float (Command.split()[1] if (DataDecoded == 'ok') else DataDecoded))
+		except (ValueError, IndexError):
+			pass
+	
+	if (DataDecoded != 'ok'):
+		if (Command == 'wifi?'):
+			try: 
+				TelloInfo["wifi"] = int(DataDecoded)
+			except Exception:
+				TelloInfo["wifi"] = -1
+			debug (3, "wifi signal noise ratio " + str(TelloInfo["wifi"]))
+		elif (Command == 'sdk?'):
+			if (DataDecoded == 'unknown command'):
+				TelloInfo["sdk"] = 10    # assume that we are on SDK 1.x 
+			else:
+				try: 
+					TelloInfo["sdk"] = int(DataDecoded)
+				except Exception:
+					TelloInfo["sdk"] = -1
+			debug (3, "SDK version " + str(TelloInfo["sdk"]))
+		elif (Command == 'battery?'):
+			try: 
+				TelloInfo["bat"] = int(DataDecoded)
+			except Exception:
+				TelloInfo["bat"] = -1
+			debug (3, "Battery " + str(TelloInfo["bat"]))
+#-----------------------------------------------------------------------------------
+def queryAnswer (Query):
+	''' the answer to Query (like battery?) without asking Tello: made from the last state frame (see QueryState) or an answer younger than 
+	its TTL (see QueryTtl). Returns (answer, age in seconds), None if there is no fresh one '''
+	Ttl = QueryTtl.get (Query, 0)
+	Now = time.perf_counter()
+	Fed = QueryState.get (Query)
+	if ((Fed is not None) and (Now - StatsArrival[0] <= Ttl) and all ([Key in StateDecoded for Key in Fed[0]])):
+		try:
+			Values = [StateDict[Key] for Key in Fed[0]]
+			return ((Fed[1] (*Values) if callable (Fed[1]) else Fed[1].format (*Values), Now - StatsArrival[0]))
+		except (KeyError, TypeError, ValueError):
+			pass
+	Entry = QueryCache.get (Query)
+	if ((Entry is not None) and (Now - Entry[1] <= Ttl)):
+		return ((Entry[0], Now - Entry[1]))
+	return (None)
+#-----------------------------------------------------------------------------------
+def queryServe (msg):
+	''' answer the query msg from the cache instead of sending it (not in swarm mode). Returns True if it has been answered '''
+	global QueryServed
+	
+	if ((len(Swarm) > 0) or (not msg.endswith ('?'))):
+		return (False)
+	Cached = queryAnswer (msg.strip())
+	if (Cached is None):
+		return (False)
+	QueryServed = QueryServed + 1
+	debug (2, Cached[0] + "\t(" + msg.strip() + " cached, " + str(round (Cached[1], 1)) + " s old)")
+	return (True)
+#-----------------------------------------------------------------------------------
+def healthLines ():
+	''' the values of TelloInfo and the cached answers with their ages, the time since the last command '''
+	Now = time.perf_counter()
+	Age = lambda Time: str(round (Now - Time, 1)) + " s ago"
+	Lines = ["bat " + str(TelloInfo["bat"]) + " %, temp " + str(TelloInfo["temp"]) + " C: " + 
+		(("state frame " + Age (StatsArrival[0])) if (StatsArrival[0] > 0) else "no state frame yet")]
+	for Query, (Answer, Time) in sorted (QueryCache.items()):
+		Lines.append (Query + " " + Answer + ": answer " + Age (Time) + ("" if (Now - Time <= QueryTtl.get (Query, 0)) else ", stale"))
+	if (LastSent > 0):
+		Lines.append ("last command " + Age (LastSent) + ", " + str(QueryServed) + " queries answered from the cache")
+	return (Lines)
+#-----------------------------------------------------------------------------------
 def recvBasicDummy():
 	''' for offline testing '''
 	global Running
@@ -215,22 +344,23 @@ def recvBasicDummy():
 	while (Running):
 		time.sleep (1)
 		TelloReady = True
+		wakeMain()
+		profileCheck ("recvBasic")
+	profileEnd ("recvBasic")
 	debug (3, "recvBasic ended")
 #-----------------------------------------------------------------------------------
 def recvState():
-	''' receive the Tello's state, print it as is or call interpreteState ''' 
+	''' receive the Tello's state straight into StateBuffer and hand it over to stateReceived ''' 
 	global Running
 	global SockState
-	global NumFrames
-	global WhichWatch 
 	
-	StateDecoded = ''
 	debug (4, "Tello recvState task started")
 	count = 0
+	StateInto = StateView[1:]				# keep the leading separator of StateBuffer
 	while Running: 
 		RecvError = False
 		try:
-			data, server = SockState.recvfrom(1518)  
+			Length = SockState.recv_into(StateInto)  
 		except Exception as e:
 			RecvError = True
 			if (str(e) == 'timed out'):
@@ -240,293 +370,3439 @@ def recvState():
 				debug (1, '\n------------------- Exception: ' + str(e) + '\n')
 				break
 		if (not RecvError):
-			StateDecoded = data.decode(encoding="utf-8")
-			if (NumFrames > 0):
-				interpreteState (StateDecoded)
-				if (len(WhichWatch) == 0): 
-					print(StateDecoded)
-				NumFrames = NumFrames - 1
-
+			stateReceived (Length + 1)
+		ThreadCpu["recvState"] = time.thread_time()
+		profileCheck ("recvState")
 
+	profileEnd ("recvState")
 	debug (4, "recvState ended")
 
 #-----------------------------------------------------------------------------------
+def stateLoad (Data):
+	''' copy a state frame (bytes or string) into StateBuffer, for sources which do not use recv_into. Returns the length for stateReceived '''
+	if (isinstance (Data, str)):
+		Data = Data.encode(encoding="utf-8")
+	Length = min (len(Data), len(StateBuffer) - 1)
+	StateBuffer[1:Length + 1] = Data[:Length]
+	return (Length + 1)
+
+#-----------------------------------------------------------------------------------
+def stateReceived (Length, Time = None, Watch = False):
+	''' handle the state frame in StateBuffer[:Length], received at Time (default: now). Called by recvState, recvStateDummy, recvStateReplay or by the asyncio engine. 
+	Watch = True: store the watched values even if no frame is requested by NumFrames '''
+	global NumFrames
+	
+	if (Time is None):
+		Time = time.time()
+	interpreteState (Length)
+	statsFrame (Length - 1)
+	if (len(WhenIndex) > 0):
+		whenFrame ()
+	if (Recording):
+		recorderAdd (RecordState, Time, None)
+	if ((not RcConfirmed) and InputModeJoy):
+		rcEcho ()
+	if (Hold):
+		holdFrame ()
+	if (Watch and (len(WhichWatch) > 0)):
+		watchState (Time)
+	elif (NumFrames > 0):
+		if (len(WhichWatch) == 0): 
+			print(StateBuffer[1:Length].decode(encoding="utf-8"))
+		else:
+			watchState (Time)
+		NumFrames = NumFrames - 1
+
+#-----------------------------------------------------------------------------------
+def statsFrame (Length):
+	''' count a state frame of Length bytes: inter-arrival histogram and jitter, gaps and late frames by the time field. No locks, only recvState writes these '''
+	Now = time.perf_counter()
+	StatsCount[StatFrames] += 1
+	StatsCount[StatFrameBytes] += Length
+	if (StatsArrival[0] > 0):
+		Interval = Now - StatsArrival[0]
+		StatsHistogram[bisect.bisect_left (StatsBuckets, Interval * 1000)] += 1
+		StatsArrival[2] += (abs (Interval - StatsArrival[1]) - StatsArrival[2]) / 16		# running jitter as in RFC 3550
+		StatsArrival[1] = Interval
+	StatsArrival[0] = Now
+	MotorTime = StateDict["time"]				# seconds, counts while the motors run
+	if (isinstance (MotorTime, int)):
+		if (StatsArrival[3] < 0):
+			pass
+		elif (MotorTime < StatsArrival[3]):
+			StatsCount[StatLate] += 1
+		elif (MotorTime > StatsArrival[3] + 1):
+			StatsCount[StatGaps] += 1				# no frame for more than a second
+		StatsArrival[3] = MotorTime
+#-----------------------------------------------------------------------------------
+def statsPercentile (Values, Fraction):
+	''' the Fraction percentile of the sorted list Values, in ms '''
+	if (len(Values) == 0):
+		return (0)
+	return (round (Values[min (len(Values) - 1, int (Fraction * len(Values)))] * 1000, 3))
+#-----------------------------------------------------------------------------------
+def inputLatencyLines ():
+	''' the latency from a key or a string input to UDP send, one line per source '''
+	return (["input latency " + Source + ": " + str(Stats[0]) + " commands, mean " + str(round (Stats[1] / Stats[0] * 1000, 3)) + " ms, max " + 
+		str(round (Stats[2] * 1000, 3)) + " ms" for Source, Stats in InputLatency.items() if (Stats[0] > 0)])
+#-----------------------------------------------------------------------------------
+def statsPrint ():
+	''' print frame rate, jitter, gaps, round trip times, queue depths, udp counters and cpu times. Rates are since the last statsPrint '''
+	Now = time.perf_counter()
+	Elapsed = Now - StatsLast[0]
+	Fps = (StatsCount[StatFrames] - StatsLast[1]) / Elapsed if (Elapsed > 0) else 0
+	StatsLast[0] = Now
+	StatsLast[1] = StatsCount[StatFrames]
+	
+	debug (1, "state frames: " + str(StatsCount[StatFrames]) + ", " + str(round (Fps, 1)) + "/s, jitter " + str(round (StatsArrival[2] * 1000, 3)) + " ms, " + 
+		str(StatsCount[StatGaps]) + " gaps, " + str(StatsCount[StatLate]) + " late")
+	Line = "inter-arrival ms:"
+	for Bucket in range (0, len(StatsHistogram)):
+		if (StatsHistogram[Bucket] > 0):
+			Line = Line + " " + (("<" + str(StatsBuckets[Bucket])) if (Bucket < len(StatsBuckets)) else (">" + str(StatsBuckets[-1]))) + ": " + str(StatsHistogram[Bucket])
+	debug (1, Line)
+	Rtts = sorted (RttRecent[:min (RttTotal, len(RttRecent))])
+	debug (1, "rtt ms: p50 " + str(statsPercentile (Rtts, 0.5)) + ", p95 " + str(statsPercentile (Rtts, 0.95)) + ", p99 " + str(statsPercentile (Rtts, 0.99)) + 
+		" (last " + str(len(Rtts)) + " answers)")
+	for Drone in Swarm:						# the percentiles mix all Tellos, their means and maxima tell them apart
+		Stats = Drone["rtt"]
+		debug (1, "rtt ms @" + str(Drone["number"]) + ": mean " + str(round (Stats[1] / Stats[0] * 1000 if (Stats[0] > 0) else 0, 3)) + ", max " + 
+			str(round (Stats[2] * 1000, 3)) + " (" + str(Stats[0]) + " answers, " + str(Stats[3]) + " timeouts, " + str(Stats[4]) + " retries)")
+	debug (1, "queue: " + ", ".join ([Lane + " " + str(len(CommandLanes[Lane])) for Lane in CommandLanes]) + ", rc " + str(int (CommandRc is not None)) + 
+		", waiting for " + str(len(InFlight) + sum ([len(Drone["inflight"]) for Drone in Swarm])) + " answers")
+	debug (1, "udp: sent " + str(StatsCount[StatSent]) + " commands (" + str(StatsCount[StatSentBytes]) + " bytes), received " + str(StatsCount[StatAnswers]) + " answers (" + 
+		str(StatsCount[StatAnswerBytes]) + " bytes) and " + str(StatsCount[StatFrames]) + " state frames (" + str(StatsCount[StatFrameBytes]) + " bytes)")
+	for Line in inputLatencyLines ():
+		debug (1, Line)
+	if (StatsCount[StatVideoPackets] > 0):
+		for Line in videoLines ():
+			debug (1, Line)
+	if (HoldStats[6] > 0):
+		for Line in holdLines ():
+			debug (1, Line)
+	if (len(WhenRules) > 0):
+		debug (1, whenLines ()[-1])
+	debug (1, "cpu s: " + ", ".join ([Name + " " + str(round (Cpu, 3)) for Name, Cpu in sorted (ThreadCpu.items())]) + ", process " + str(round (time.process_time(), 3)))
+#-----------------------------------------------------------------------------------
+def statsTick ():
+	''' timer event: print the statistics every StatsPeriod seconds '''
+	if (StatsPeriod > 0):
+		statsPrint ()
+		timerSchedule ("stats", StatsPeriod, statsTick)
+#-----------------------------------------------------------------------------------
+def profileCheck (Name):
+	''' called in every loop of the threads: start or stop the profiler of thread Name after profile start or stop. Costs a dict lookup when nothing changes '''
+	if (ProfileSeen.get (Name) == ProfileGeneration):
+		return
+	Profiler = Profilers.get (Name)
+	if (ProfileOn):
+		if (Profiler is None):
+			Profiler = cProfile.Profile()
+			Profilers[Name] = Profiler
+		try:
+			Profiler.enable()
+		except ValueError:					# python 3.12+: only one profiler at a time, the one which is already running sees all threads
+			pass
+	elif (Profiler is not None):
+		Profiler.disable()
+	ProfileSeen[Name] = ProfileGeneration
+#-----------------------------------------------------------------------------------
+def profileEnd (Name):
+	''' called by thread Name when it ends: only the thread itself can take its profiler out, one which is left installed complains at exit '''
+	Profiler = Profilers.get (Name)
+	if (Profiler is not None):
+		Profiler.disable()
+	ProfileSeen[Name] = ProfileGeneration
+#-----------------------------------------------------------------------------------
+def profileSet (On):
+	''' start or stop profiling. The threads follow when they come by profileCheck '''
+	global ProfileOn
+	global ProfileGeneration
+	
+	ProfileOn = On
+	ProfileGeneration = ProfileGeneration + 1
+	timerWake()
+	profileCheck ("main")
+#-----------------------------------------------------------------------------------
+def profileDump (FileName):
+	''' write the merged profiles of all threads to FileName (pstats format, e.g. for snakeviz). Profiling is paused while the threads hand them over '''
+	WasOn = ProfileOn
+	if (WasOn):
+		profileSet (False)
+	Deadline = time.monotonic() + 2				# recvBasic and recvState come by at least once a second, ended threads don't
+	while (Running and (time.monotonic() < Deadline) and any ([ProfileSeen.get (Name) != ProfileGeneration for Name in Profilers])):
+		time.sleep (0.01)
+	Merged = None
+	for Name, Profiler in Profilers.items():
+		try:
+			if (Merged is None):
+				Merged = pstats.Stats (Profiler)
+			else:
+				Merged.add (Profiler)
+		except TypeError:						# no data (yet)
+			pass
+	if (Merged is None):
+		debug (1, "nothing profiled yet, see profile start")
+	else:
+		try:
+			Merged.dump_stats (FileName)
+			debug (1, "profile of " + ", ".join (Profilers) + " written to " + FileName)
+		except Exception as e:
+			debug (1, str(e))
+	if (WasOn and Running):					# not while shutting down, see profileEnd
+		profileSet (True)
+#-----------------------------------------------------------------------------------
 def recvStateDummy():
 	''' for offline testing '''
 	global Running
-	global NumFrames
 	
 	debug (3, "recvState started")
-	StateDecoded = ''
 	
 	while (Running):
-		StateDecoded = "mid:-1;x:0;y:0;z:0;mpry:0,0,0;pitch:-1;roll:0;yaw:0;vgx:0;vgy:0;vgz:0;templ:51;temph:54;tof:10;h:0;bat:88;baro:38.28;time:0;agx:-13.00;agy:-5.00;agz:-998.00;"
-		if (NumFrames > 0):
-			interpreteState (StateDecoded)
-			if (len(WhichWatch) == 0): 
-				print(StateDecoded)
-			NumFrames = NumFrames - 1
-
+		if (not Replaying):
+			stateReceived (stateLoad (StateDummy))
 		time.sleep (1)
+		profileCheck ("recvState")
 		
+	profileEnd ("recvState")
 	debug (3, "recvState ended")
 #-----------------------------------------------------------------------------------
-def interpreteState (StateString):
-	''' split the state string into keyword/value pairs and print selected values in csv format '''
+def stateKeys ():
+	''' choose the keys which interpreteState has to decode: the watched ones and those needed for TelloInfo. Call whenever WhichWatch changes '''
+	global StateParse
+	global StateWanted
+	global StateDecoded
+	global StateLayout
+	
+	Order = list(StateDict)					# the order of the keys in the state string
+	Keys = []
+	Recorded = RecorderFields if Recording else []
+	Echo = RcEchoKeys if (InputModeJoy and (RcRate > 0)) else []
+	Held = HoldKeys if Hold else []
+	for Key in StateAlways + watchKeys () + Recorded + Echo + Held + list(WhenIndex):
+		if (Key not in Keys):
+			Keys.append (Key)
+	Keys.sort (key = lambda Key: Order.index (Key) if (Key in Order) else len(Order))
+	StateParse = [(Key, (';' + Key + ':').encode(encoding="utf-8"), StateTypes.get (Key, int)) for Key in Keys]
+	StateWanted = {Key.encode(encoding="utf-8"): (Key, StateTypes.get (Key, int)) for Key in Keys}
+	StateDecoded = set (Keys)
+	StateLayout = (None, [])					# learned from the next frame
+#-----------------------------------------------------------------------------------
+def stateText (Value):
+	''' a value of the state string which is not a number, like mpry '''
+	return (str (Value, "utf-8"))
+#-----------------------------------------------------------------------------------
+def stateValue (Value):
+	''' convert a value of the state string (bytes) whose type is not known: int, float or string '''
+	try:
+		return (int (Value))
+	except ValueError:
+		try:
+			return (float (Value))
+		except ValueError:
+			return (stateText (Value))
+#-----------------------------------------------------------------------------------
+class StateNumbers (dict):
+	''' bytes: int, for the values of the state frames. Most values repeat, a lookup is cheaper than int() '''
+	def __missing__ (self, Value):
+		Number = int (Value)
+		self[Value] = Number
+		return (Number)
+#-----------------------------------------------------------------------------------
+def stateLayout (Items):
+	''' learn the layout of a split state frame (Items = key, value, key, value ...) for interpreteState: per type, the names of the wanted keys 
+	and a function which picks their values out of Items. Tello sends the keys in the same order, so this is done once per watch set '''
+	global StateLayout
+	
+	Groups = {}
+	for Position, Key in enumerate (Items[0::2]):
+		Wanted = StateWanted.get (Key)
+		if ((Wanted is not None) and (2 * Position + 1 < len(Items))):
+			Convert = StateInts.__getitem__ if (Wanted[1] is int) else Wanted[1]
+			Group = Groups.setdefault (Convert, ([], []))
+			Group[0].append (Wanted[0])
+			Group[1].append (2 * Position + 1)
+	Layout = []
+	for Convert, (Names, Positions) in Groups.items():
+		if (len(Positions) > 1):
+			Values = operator.itemgetter (*Positions)
+		else:
+			Values = lambda Items, Position = Positions[0]: (Items[Position],)
+		Layout.append ((Names, Values, Convert))
+	StateLayout = (Items[0::2], Layout)
+#-----------------------------------------------------------------------------------
+def interpreteState (Length):
+	''' decode the keys selected by stateKeys from the state frame in StateBuffer[:Length] into typed values in StateDict '''
 	global StateDict
-	global Command
-	global WhichWatch
-	global OldWhichWatch
-	global LastCommand
 	global TelloInfo
-	global Watchlist
 
+	if (len(StateParse) > StateScanMax):		# many keys: splitting the whole frame once is cheaper than searching every key
+		Items = bytes(StateView[1:Length]).replace(b':', b';').split(b';')		# key, value, key, value ...
+		if (Items[0::2] != StateLayout[0]):
+			stateLayout (Items)
+		if (len(StateInts) > StateIntsMax):
+			StateInts.clear()
+		try:
+			for Names, Values, Convert in StateLayout[1]:
+				StateDict.update (zip (Names, map (Convert, Values (Items))))
+		except ValueError:						# not the expected type, see stateValue
+			for Pair in bytes(StateView[1:Length]).split(b';'):
+				Key, Separator, Value = Pair.partition(b':')
+				Wanted = StateWanted.get (Key)
+				if (Wanted is not None):
+					try:
+						StateDict[Wanted[0]] = Wanted[1] (Value)
+					except ValueError:
+						StateDict[Wanted[0]] = stateValue (Value)
+		Parse = []
+	else:
+		Parse = StateParse
+	
+	Position = 0
+	for Key, Needle, Convert in Parse:
+		Start = StateBuffer.find (Needle, Position, Length)		# keys are sorted, so usually the next key follows the last one
+		if (Start < 0):
+			Start = StateBuffer.find (Needle, 0, Length)
+			if (Start < 0):
+				continue
+		Start = Start + len(Needle)
+		End = StateBuffer.find (b';', Start, Length)
+		if (End < 0):
+			End = Length
+		Position = End
+		try:
+			StateDict[Key] = Convert (StateBuffer[Start:End])
+		except ValueError:					# not the expected type, e.g. a key which is unknown to StateTypes
+			StateDict[Key] = stateValue (StateBuffer[Start:End])
+		if (DebugLevel >= 6):					# don't build the message for every frame
+			debug (6, "keyword = " + Key + " value= " + str(StateDict[Key]))
 
-	StateSplitted = StateString.split(';')
-	while (StateSplitted):
-		Pair = StateSplitted.pop(0)
-		if (':' in Pair):
-			PairSplitted = Pair.split (':')
-			keyword = PairSplitted[0]
-			value = PairSplitted[1]
-			debug (6, "keyword = " + keyword + " value= " + value)
-			StateDict[keyword] = value
+	TelloInfo["bat"] = StateDict["bat"]
+	TelloInfo["temp"] = round((StateDict["temph"] + StateDict["templ"]) / 2)
+#-----------------------------------------------------------------------------------
+def watchState (Time):
+	''' print the watched values of the last state frame (received at Time) and store them in the telemetry ring '''
+	global OldWhichWatch
+	global WatchSetId
+	global WatchStore
+	global WatchTotal
+	global WatchCount
 
 	if (len(WhichWatch)>0):
-		if (OldWhichWatch != WhichWatch):		# new watch set, we'll write a header for the CVS
-			OutString = "watch;time;"
+		if (OldWhichWatch != WhichWatch):		# new watch set, the csv will get a new header
+			watchSet ()
 			OutPrint  = ""
-			for Key in WhichWatch:
-				OutString = OutString + Key + ';'
+			for Key, Column, Derived in WatchStore:
 				OutPrint  = OutPrint  + Key + '\t'
-			OutString = OutString + "LastCommand" + ';'
-			Watchlist = Watchlist + [OutString]
 			print (OutPrint)
 			OldWhichWatch = WhichWatch
 		
-		OutString = "watch;" + str(time.time()) + ';'
-		OutPrint  = ""
-		for Key in WhichWatch:
+		Index = WatchTotal % WatchCapacity
+		WatchTime[Index] = Time
+		WatchSetOfRow[Index] = WatchSetId
+		WatchCommand[Index] = CommandCount
+		for Key, Column, Derived in WatchStore:
 			try:
-				Value = StateDict[Key]
-			except Exception:
-				Value = 'error'
-			OutString = OutString + Value + ';'
-			OutPrint  = OutPrint  + Value + '\t'
-		OutString = OutString + LastCommand + ';'
-		OutString = OutString.replace ('.',',') # +++ add an arg to decide whether or not to replace
-		print (OutPrint)
-		Watchlist = Watchlist + [OutString]
-
-
-		
-	TelloInfo["bat"] = int(StateDict["bat"])
-	TelloInfo["temp"] = round((int(StateDict["temph"]) + int(StateDict["templ"])) / 2)
-#--------------------------------------------------------------------------
-def timerFunc():
-	''' schedule keepalive and watch '''
-	global Running
-	# global Commands
-	global TimeKeepalive
-	global NumFrames
-	global TimeState
-	global WatchPeriod
-	global SleepTime
-	global TelloInfo
+				if (Derived is None):
+					Column[Index] = StateDict[Key]
+				else:
+					Column[Index] = Derived[0] (*[StateDict[Arg] for Arg in Derived[1]])
+			except (KeyError, TypeError, ValueError, ArithmeticError):		# not in the state string, not a number, or the expression can't be computed
+				Column[Index] = WatchMissing[Column.__class__]
+		if (WatchEcho):
+			OutPrint  = ""
+			for Key, Column, Derived in WatchStore:
+				OutPrint  = OutPrint  + watchFormat (Key, Column[Index]) + '\t'
+			print (OutPrint)
+		WatchTotal = WatchTotal + 1
+		if (WatchCount < WatchCapacity):
+			WatchCount = WatchCount + 1
+#-----------------------------------------------------------------------------------
+def watchInit (Capacity):
+	''' allocate the telemetry ring for Capacity watch rows. Memory does not grow while watching '''
+	global WatchCapacity
+	global WatchTime
+	global WatchSetOfRow
+	global WatchCommand
+	global WatchColumns
+	global WatchSets
+	global WatchSetId
+	global WatchStore
+	global WatchCount
+	global OldWhichWatch
+	global CommandLog
 	
-	debug (3, "Timer task started")
-	Time = time.time()
-	TimeKeepalive = Time + 10
+	WatchCapacity = Capacity
+	WatchTime     = array.array ('d', [0]) * Capacity
+	WatchSetOfRow = array.array ('I', [0]) * Capacity		# index into WatchSets
+	WatchCommand  = array.array ('L', [0]) * Capacity		# CommandCount when the row was stored, see watchCommand
+	WatchColumns  = {}										# key: array of doubles (or list for text values), allocated on the first watch of the key
+	WatchSets     = []										# the watch sets (tuples of keys) used so far
+	WatchSetId    = 0
+	WatchStore    = []										# (key, column) of the current watch set
+	WatchCount    = 0
+	OldWhichWatch = []
+	CommandLog    = [''] * Capacity
+#-----------------------------------------------------------------------------------
+def watchSet ():
+	''' register the current WhichWatch as watch set and prepare the columns where watchState stores its values '''
+	global WatchSetId
+	global WatchStore
 	
-	while (Running):
-		Time = time.time()
-		
-		if ((Time > TimeState) and (WatchPeriod > 0)):
-			NumFrames = 1
-			TimeState = Time + WatchPeriod
+	Items = [watchItem (Item) for Item in WhichWatch]
+	Keys = tuple([Key for Key, Derived in Items])
+	if (Keys in WatchSets):
+		WatchSetId = WatchSets.index (Keys)
+	else:
+		WatchSets.append (Keys)
+		WatchSetId = len(WatchSets) - 1
+	
+	WatchStore = []
+	for Key, Derived in Items:
+		if (Key not in WatchColumns):
+			if ((Derived is None) and (StateTypes.get (Key) == stateText)):
+				WatchColumns[Key] = [None] * WatchCapacity
+			else:
+				WatchColumns[Key] = array.array ('d', [math.nan]) * WatchCapacity
+		WatchStore.append ((Key, WatchColumns[Key], Derived))
+#-----------------------------------------------------------------------------------
+def watchItem (Item):
+	''' the column name of a watch item and how to get its value: (key, None) for a state key like "h", (name, (function, keys)) for an expression 
+	like "speed=sqrt(vgx**2+vgy**2)" (no spaces, "name=" is optional, it must not be a state key). An expression is checked and compiled once, 
+	into a function of the state keys it uses. Raises ValueError if it is not valid '''
+	Known = WatchDerived.get (Item)
+	if (Known is not None):
+		return (Known)
+	if (Item.isidentifier()):
+		Known = (Item, None)
+	else:
+		Name, Text = watchSplit (Item)
+		if (Name in StateDict):						# its column would be the one of the state key, see WatchColumns
+			raise ValueError (Name + " is a state key, choose another name for " + Text)
+		try:
+			Tree = ast.parse (Text, mode = "eval")
+		except SyntaxError:
+			raise ValueError ("syntax error in " + Text)
+		Keys = []
+		for Node in ast.walk (Tree):
+			if ((not isinstance (Node, WatchNodes)) or isinstance (Node, ast.MatMult) or 
+				(isinstance (Node, ast.Constant) and not isinstance (Node.value, (int, float)))):
+				raise ValueError ("not allowed in a watch expression: " + (ast.get_source_segment (Text, Node) or Node.__class__.__name__))
+			if (isinstance (Node, ast.Call) and ((not isinstance (Node.func, ast.Name)) or (Node.func.id not in WatchFunctions) or (len(Node.keywords) > 0))):
+				raise ValueError ("unknown function in " + Text + ", known are " + ", ".join (WatchFunctions))
+			if (isinstance (Node, ast.Name) and (Node.id not in WatchFunctions) and (Node.id not in Keys)):
+				if (Node.id not in StateDict):
+					raise ValueError ("unknown state key " + Node.id + " in " + Text)
+				Keys.append (Node.id)
+		Globals = dict (WatchFunctions)
+		Globals["__builtins__"] = {}
+		Known = (Name, (eval ("lambda " + ", ".join (Keys) + ": " + Text, Globals), Keys))
+	WatchDerived[Item] = Known
+	return (Known)
+#-----------------------------------------------------------------------------------
+def watchSplit (Item):
+	''' name and expression of a watch item like "speed=sqrt(vgx**2+vgy**2)". Without "name=", the expression is the name '''
+	Name, Equal, Text = Item.partition ('=')
+	if ((Equal == '') or (not Name.isidentifier()) or Text.startswith ('=')):
+		return (Item, Item)
+	return (Name, Text)
+#-----------------------------------------------------------------------------------
+def watchCheck (Items):
+	''' compile the watch items (see watchItem). Returns an error message, '' if all of them are fine '''
+	for Item in Items:
+		try:
+			watchItem (Item)
+		except ValueError as e:
+			return (str(e))
+	return ('')
+#-----------------------------------------------------------------------------------
+def watchKeys ():
+	''' the state keys the current watch set needs, for stateKeys '''
+	Keys = []
+	for Item in WhichWatch:
+		try:
+			Key, Derived = watchItem (Item)
+		except ValueError:
+			continue
+		Keys = Keys + ([Key] if (Derived is None) else Derived[1])
+	return (Keys)
+#-----------------------------------------------------------------------------------
+def whenAdd (Words):
+	''' when cond [hyst h] [once] do command: add a rule which queues command when cond (a watch expression, see watchItem) becomes true. 
+	It fires again after cond has been false, with hyst h: after the value has gone back by h. Returns an error message, '' if fine '''
+	global WhenNext
 	
-		if ((SleepTime > 0) and (Time > SleepTime)):
-			SleepTime = -1
-			debug (4, str(Time) + ", time to wake up")
+	if ("do" not in Words):
+		return ("when: do missing")
+	Do = Words.index ("do")
+	Options = Words[1:Do]
+	Action = " ".join (Words[Do + 1:])
+	if (len(Options) == 0):
+		return ("when: condition missing")
+	if (len(Action) == 0):
+		return ("when: command missing")
+	Error = scriptCheck (Action.split())
+	if (Error != ''):
+		return (Error)
+	Hysteresis = 0
+	Once = False
+	Position = 1
+	while (Position < len(Options)):
+		if (Options[Position] == "once"):
+			Once = True
+			Position = Position + 1
+		elif ((Options[Position] == "hyst") and (Position + 1 < len(Options))):
+			try:
+				Hysteresis = abs (float (Options[Position + 1]))
+			except ValueError:
+				return ("when: hyst " + Options[Position + 1] + " is not a number")
+			Position = Position + 2
+		else:
+			return ("when: unknown option " + Options[Position])
 	
-		if (Time > TimeKeepalive):
-			sendCommand ("wifi?")
+	try:
+		Name, Derived = watchItem (Options[0])
+	except ValueError as e:
+		return (str(e))
+	if (Derived is None):
+		if (Name not in StateDict):
+			return ("unknown state key " + Name)
+		Test = bool
+		Keys = [Name]
+	else:
+		Test, Keys = Derived
+	Rearm = None
+	Bounds = []
+	Simple = whenSimple (watchSplit (Options[0])[1])
+	if (Simple is not None):						# key < number and the like: indexed by the number, see whenFrame
+		Key, Operator, Threshold = Simple
+		Bounds = [Threshold]
+		if (Hysteresis > 0):
+			if (Operator in ["<", "<="]):
+				Release = Threshold + Hysteresis
+			elif (Operator in [">", ">="]):
+				Release = Threshold - Hysteresis
+			else:
+				return ("when: hyst needs <, <=, > or >=")
+			Bounds.append (Release)
+			Loose = watchItem (Key + Operator + repr (Release))[1][0]
+			Rearm = lambda Value: not Loose (Value)
+	elif (Hysteresis > 0):
+		return ("when: hyst needs a condition like bat<20")
+	if (Rearm is None):
+		Rearm = lambda *Values: not Test (*Values)
 	
-	debug (3, "Timer task ended")
-#--------------------------------------------------------------------------
-def scriptRead (FileName, WhereToAdd): 
-	''' read a script from a file and add the commands to an existing list of Commands. Filename = file to read, WhereToInsert = i for insert, a for append '''
-	global Commands
+	Rule = {"id": WhenNext, "name": Name, "text": " ".join (Words[1:]), "keys": Keys, "test": Test, "rearm": Rearm, "once": Once, 
+		"action": Action, "armed": True, "fired": 0, "bounds": Bounds}
+	WhenNext = WhenNext + 1
+	with WhenLock:
+		WhenRules.append (Rule)
+		WhenPending.append (Rule)
+		whenIndex ()
+	stateKeys ()
+	debug (3, "rule " + str(Rule["id"]) + ": when " + Rule["text"])
+	return ('')
+#-----------------------------------------------------------------------------------
+def whenSimple (Text):
+	''' (key, operator, number) if the condition Text compares a key with a number, like bat<20 or 100<=h, else None '''
+	Tree = ast.parse (Text, mode = "eval").body
+	if ((not isinstance (Tree, ast.Compare)) or (len(Tree.ops) != 1)):
+		return (None)
+	Operator = WhenOperators.get (Tree.ops[0].__class__)
+	Left = Tree.left
+	Right = Tree.comparators[0]
+	if (isinstance (Left, ast.Constant) and isinstance (Right, ast.Name)):		# 20>bat is bat<20
+		Left, Right = Right, Left
+		Operator = WhenMirrored.get (Operator, Operator)
+	if ((Operator is None) or (not isinstance (Left, ast.Name)) or (not isinstance (Right, ast.Constant)) or 
+		(not isinstance (Right.value, (int, float)))):
+		return (None)
+	return (Left.id, Operator, Right.value)
+#-----------------------------------------------------------------------------------
+def whenIndex ():
+	''' rebuild WhenIndex from WhenRules. Call with WhenLock held '''
+	global WhenIndex
 	
+	Index = {}
+	for Rule in WhenRules:
+		for Key in Rule["keys"]:
+			Entry = Index.setdefault (Key, ([], []))
+			if (len(Rule["bounds"]) > 0):
+				Entry[0].extend ([(Bound, Rule["id"], Rule) for Bound in Rule["bounds"]])
+			else:
+				Entry[1].append (Rule)
+	for Key, (Bounded, Others) in Index.items():
+		Bounded.sort (key = lambda Entry: Entry[:2])
+		Index[Key] = ([Entry[0] for Entry in Bounded], [Entry[2] for Entry in Bounded], Others)
+	WhenIndex = Index							# whenFrame may still use the old index, it is not changed
+#-----------------------------------------------------------------------------------
+def whenFrame ():
+	''' called for every state frame while there are rules: check the rules whose keys have changed. Rules like bat<20 are only checked 
+	when the value has crossed their number (or the number of their hyst), found by bisection, so many rules on a key cost little '''
+	global WhenPending
+	
+	Index = WhenIndex
+	Due = {}
+	if (len(WhenPending) > 0):					# new rules are checked once, even if their keys don't change
+		with WhenLock:							# whenAdd appends from the main thread
+			Pending, WhenPending = WhenPending, []
+		for Rule in Pending:
+			Due[Rule["id"]] = Rule
+	for Key, (Bounds, BoundRules, Others) in Index.items():
+		Value = StateDict.get (Key)
+		Old = WhenLast.get (Key)
+		if (Value == Old):
+			continue
+		WhenLast[Key] = Value
+		try:
+			Crossed = BoundRules[bisect.bisect_left (Bounds, min (Old, Value)) : bisect.bisect_right (Bounds, max (Old, Value))]
+		except TypeError:						# first value or not a number
+			Crossed = BoundRules
+		for Rule in Crossed + Others:
+			Due[Rule["id"]] = Rule
+	WhenStats[0] += 1
+	WhenStats[1] += len(Due)
+	for Rule in Due.values():
+		whenCheck (Rule)
+#-----------------------------------------------------------------------------------
+def whenCheck (Rule):
+	''' fire an armed Rule if its condition is true, re-arm it when its condition has gone '''
+	try:
+		Values = [StateDict[Key] for Key in Rule["keys"]]
+		if (Rule["armed"]):
+			if (Rule["test"] (*Values)):
+				whenFire (Rule)
+		elif (Rule["rearm"] (*Values)):
+			Rule["armed"] = True
+	except (KeyError, TypeError, ValueError, ArithmeticError):
+		pass
+#-----------------------------------------------------------------------------------
+def whenFire (Rule):
+	''' queue the command of Rule in front of everything but emergency, stop and rc, so it is executed at once, even while a script sleeps.
+	The sleep itself goes on, the script resumes on its own schedule '''
+	Rule["armed"] = False
+	Rule["fired"] += 1
+	WhenStats[2] += 1
+	debug (2, "rule " + str(Rule["id"]) + ": when " + Rule["text"])
+	Action = Rule["action"]
+	if (Action.split()[0] in ["emergency", "stop", "rc"]):
+		commandQueue (Action)
+	else:
+		with CommandLock:
+			WhenActions.append ((Action, time.perf_counter()))
+	wakeMain ()
+	if (Rule["once"]):
+		whenRemove (str(Rule["id"]))
+#-----------------------------------------------------------------------------------
+def whenRemove (Which):
+	''' remove the rule with number or name Which, or all rules. Returns the number of rules removed '''
+	global WhenRules
+	
+	with WhenLock:
+		Kept = [Rule for Rule in WhenRules if not ((Which == "all") or (str(Rule["id"]) == Which) or (Rule["name"] == Which))]
+		Removed = len(WhenRules) - len(Kept)
+		WhenRules = Kept
+		whenIndex ()
+	stateKeys ()
+	return (Removed)
+#-----------------------------------------------------------------------------------
+def whenLines ():
+	''' the rules, and how many of them have been checked per state frame '''
+	Lines = [str(Rule["id"]) + ": when " + Rule["text"] + " (" + ("armed" if Rule["armed"] else "fired, waiting to re-arm") + ", fired " + 
+		str(Rule["fired"]) + " times)" for Rule in WhenRules]
+	Lines.append ("rules: " + str(len(WhenRules)) + " on " + str(len(WhenIndex)) + " keys, " + str(WhenStats[1]) + " checks in " + str(WhenStats[0]) + 
+		" frames (" + str(round (WhenStats[1] / WhenStats[0], 3) if (WhenStats[0] > 0) else 0) + " per frame), fired " + str(WhenStats[2]) + " times")
+	return (Lines)
+#-----------------------------------------------------------------------------------
+def watchCommand (Id):
+	''' the text of the command number Id (see CommandCount), if it is still in CommandLog '''
+	if (Id == 0):
+		return ('')
+	if (Id <= CommandCount - len(CommandLog)):
+		return ('?')
+	return (CommandLog[Id % len(CommandLog)])
+#-----------------------------------------------------------------------------------
+def watchFormat (Key, Value):
+	''' format a value from the telemetry ring like it appears in the state string '''
+	if ((Value is None) or (Value != Value)):			# None or NaN: the key was missing
+		return ('error')
+	if (Key not in StateDict):						# an expression
+		return (str(round (Value, 3)))
+	if ((StateTypes.get (Key, int) == int) and Value.is_integer()):
+		return (str(int(Value)))
+	return (str(Value))
+#-----------------------------------------------------------------------------------
+def watchHeader (Set, Delimiter):
+	''' csv header for the rows of the watch set number Set '''
+	return ("watch" + Delimiter + "time" + Delimiter + Delimiter.join (WatchSets[Set]) + Delimiter + "LastCommand" + Delimiter)
+#-----------------------------------------------------------------------------------
+def watchLine (Row, Delimiter):
+	''' csv line for the watch row number Row (counted by WatchTotal), with a decimal point '''
+	Index = Row % WatchCapacity
+	OutString = "watch" + Delimiter + str(WatchTime[Index]) + Delimiter
+	for Key in WatchSets[WatchSetOfRow[Index]]:
+		OutString = OutString + watchFormat (Key, WatchColumns[Key][Index]) + Delimiter
+	return (OutString + watchCommand (WatchCommand[Index]) + Delimiter)
+#-----------------------------------------------------------------------------------
+def watchLines ():
+	''' format the telemetry ring as csv lines, oldest first, with a header whenever the watch set changes '''
+	LastSet = -1
+	for Row in range (WatchTotal - WatchCount, WatchTotal):
+		Set = WatchSetOfRow[Row % WatchCapacity]
+		if (Set != LastSet):
+			yield (watchHeader (Set, CsvDelimiter))
+			LastSet = Set
+		yield (watchLine (Row, CsvDelimiter).replace ('.', CsvDecimal))
+#-----------------------------------------------------------------------------------
+def logStart (FileName):
+	''' start writing the watch rows to FileName, beginning with the oldest row in the telemetry ring '''
+	global LogFileName
+	global LogFile
+	global LogThread
+	global LogRunning
+	global LogNext
+	global LogSet
+	global LogOpened
+	
+	logStop ()
 	try:
-		FileHandle = open (FileName, "r")
+		LogFile = open (FileName, "w")
 	except Exception as e:
 		debug (1, str(e))
-		debug (1, "Errro: unable to load " + FileName)
-		return (False)
-		
-	if (FileHandle):
-		debug (2, "Reading script" + FileName)
-		NewCommands = FileHandle.readlines()
-		FileHandle.close()
-		if (WhereToAdd == 'i'):
-			Commands = NewCommands + Commands
-		elif (WhereToAdd == 'a'):
-			Commands = Commands + NewCommands
-		elif (WhereToAdd == 'r'):
-			Commands = NewCommands
-		else:
-			debug (2, "Parameter WhereToAdd=" + WhereToAdd + " in function scriptRead not recognized, must be r, i or a")
-			return (False)
-		return (True)
-		
-	else:
+		debug (1, "Error: unable to open " + FileName)
 		return (False)
-
+	
+	LogFileName = FileName
+	LogNext = WatchTotal - WatchCount
+	LogSet = -1
+	LogOpened = time.time()
+	LogRunning = True
+	LogEvent.clear()
+	LogThread = threading.Thread(target=logWriter)
+	LogThread.start()
+	debug (2, "logging to " + FileName)
+	return (True)
 #-----------------------------------------------------------------------------------
-def waitForConnection (IpAddress):
-	''' send pings to IpAddress until ping is successful. No timeout, will wait forever. '''
+def logStop ():
+	''' write the remaining watch rows and close the log file '''
+	global LogFile
+	global LogThread
+	global LogRunning
+	
+	if (LogThread is not None):
+		LogRunning = False
+		LogEvent.set()
+		LogThread.join()
+		LogThread = None
+		LogFile.close()
+		LogFile = None
+		debug (2, "log " + LogFileName + " closed")
+		if (LogLost > 0):
+			debug (1, str(LogLost) + " watch rows were overwritten before they could be logged")
+#-----------------------------------------------------------------------------------
+def logWriter ():
+	''' background task: write the new watch rows every LogFlush seconds '''
+	debug (3, "log writer started")
+	while (LogRunning):
+		LogEvent.wait (LogFlush)
+		logFlush ()
+		ThreadCpu["log"] = time.thread_time()
+		profileCheck ("log")
+	profileEnd ("log")
+	debug (3, "log writer ended")
+#-----------------------------------------------------------------------------------
+def logFlush ():
+	''' write the watch rows which have been added since the last call in one go, then rotate the file if it is due '''
+	global LogNext
+	global LogSet
+	global LogLost
+	
+	Last = WatchTotal
+	First = max (LogNext, Last - WatchCapacity)		# rows cleared by wc are still in the ring
+	LogLost = LogLost + (First - LogNext)
+	Chunks = []
+	Rows = []
+	for Row in range (First, Last):
+		Set = WatchSetOfRow[Row % WatchCapacity]
+		if (Set != LogSet):
+			if (len(Rows) > 0):
+				Chunks.append (csvDecimal ('\n'.join (Rows) + '\n'))
+				Rows = []
+			Chunks.append (watchHeader (Set, CsvDelimiter) + '\n')
+			LogSet = Set
+		Rows.append (watchLine (Row, CsvDelimiter))
+	if (len(Rows) > 0):
+		Chunks.append (csvDecimal ('\n'.join (Rows) + '\n'))
+	LogNext = Last
+	
+	if (len(Chunks) > 0):
+		LogFile.write (''.join (Chunks))
+		LogFile.flush()
+	
+	if (LogFile.tell() > 0):
+		if (((LogSize > 0) and (LogFile.tell() >= LogSize)) or ((LogTime > 0) and (time.time() - LogOpened >= LogTime))):
+			logRotate ()
+#-----------------------------------------------------------------------------------
+def csvDecimal (Text):
+	''' replace the decimal points of the values in Text (many csv lines without header) by CsvDecimal '''
+	if (CsvDecimal == '.'):
+		return (Text)
+	return (Text.replace ('.', CsvDecimal))
+#-----------------------------------------------------------------------------------
+def logRotate ():
+	''' rename the full log file (the time when it was opened is added to its name) and continue in a new one '''
+	global LogFile
+	global LogSet
+	global LogOpened
+	
+	LogFile.close()
+	Base, Extension = os.path.splitext (LogFileName)
+	OldName = Base + time.strftime ("-%Y%m%d-%H%M%S", time.localtime (LogOpened)) + Extension
 	Count = 0
-	Connected = False
-	while (not Connected):
+	while (os.path.exists (OldName)):			# more than one rotation within a second
 		Count = Count + 1
-		PingError = False
+		OldName = Base + time.strftime ("-%Y%m%d-%H%M%S", time.localtime (LogOpened)) + "-" + str(Count) + Extension
+	try:
+		os.replace (LogFileName, OldName)
+		debug (3, "log rotated to " + OldName)
+	except Exception as e:
+		debug (1, str(e))
+	LogFile = open (LogFileName, "w")
+	LogSet = -1
+	LogOpened = time.time()
+#-----------------------------------------------------------------------------------
+def recorderStart (FileName, Compress):
+	''' start recording every state frame, command and answer to the binary file FileName. Compress = True: zlib-compressed blocks '''
+	global Recording
+	global RecorderFile
+	global RecorderFileName
+	global RecorderFields
+	global RecorderGetter
+	global RecorderFormat
+	global RecorderTextFormat
+	global RecorderSize
+	global RecorderCompress
+	global RecorderBlock
+	global RecorderCount
+	global RecorderThread
+	
+	recorderStop ()
+	try:
+		RecorderFile = open (FileName, "wb")
+	except Exception as e:
+		debug (1, str(e))
+		debug (1, "Error: unable to open " + FileName)
+		return (False)
+	
+	RecorderFileName = FileName
+	RecorderFields = [Key for Key in StateDict if (StateTypes.get (Key, int) != stateText)]
+	RecorderGetter = operator.itemgetter (*RecorderFields)
+	RecorderFormat = RecorderHead + str(len(RecorderFields)) + 'f'
+	RecorderTextFormat = RecorderHead + str(4 * len(RecorderFields)) + 's'
+	RecorderSize = struct.calcsize (RecorderFormat)
+	RecorderCompress = Compress
+	Header = {"fields": RecorderFields, "format": RecorderFormat, "record": RecorderSize, 
+		"block": RecorderBlockSize if Compress else 0, "compression": "zlib" if Compress else "none", 
+		"types": {str(RecordState): "state", str(RecordCommand): "command", str(RecordAnswer): "answer", str(RecordMore): "more"}, "started": time.time()}
+	Header = json.dumps (Header).encode(encoding="utf-8")
+	Header = Header + b' ' * (-(len(RecorderMagic) + 4 + len(Header)) % 8)		# records start 8-byte aligned
+	RecorderFile.write (RecorderMagic + struct.pack ('<I', len(Header)) + Header)
+	
+	RecorderBlock = bytearray (RecorderBlockSize * RecorderSize)
+	RecorderCount = 0
+	RecorderThread = threading.Thread(target=recorderWriter)
+	RecorderThread.start()
+	Recording = True
+	stateKeys ()							# all fields have to be decoded now
+	debug (2, "recording to " + FileName)
+	return (True)
+#-----------------------------------------------------------------------------------
+def recorderStop ():
+	''' write the last block and close the recording '''
+	global Recording
+	global RecorderFile
+	global RecorderThread
+	
+	if (RecorderThread is not None):
+		with RecorderLock:
+			Recording = False
+			recorderHandOver ()
+		RecorderQueue.put (None)
+		RecorderThread.join()
+		RecorderThread = None
+		RecorderFile.close()
+		RecorderFile = None
+		stateKeys ()
+		debug (2, "recording " + RecorderFileName + " closed")
+#-----------------------------------------------------------------------------------
+def recorderAdd (Type, Time, Text):
+	''' add a record: a state frame (values from StateDict) or a command or answer (Text) '''
+	with RecorderLock:
+		if (not Recording):
+			return
+		Offset = RecorderCount * RecorderSize
+		if (Type == RecordState):
+			try:
+				struct.pack_into (RecorderFormat, RecorderBlock, Offset, Time, Type, 0, *RecorderGetter (StateDict))
+			except struct.error:					# a value which is not a number, skip the frame
+				return
+		else:
+			Text = Text.encode(encoding="utf-8")
+			Slot = 4 * len(RecorderFields)
+			struct.pack_into (RecorderTextFormat, RecorderBlock, Offset, Time, Type, len(Text), Text)
+			for Start in range (Slot, len(Text), Slot):		# the rest of a text which is longer than a record follows in RecordMore records
+				recorderNext ()
+				struct.pack_into (RecorderTextFormat, RecorderBlock, RecorderCount * RecorderSize, Time, RecordMore, len(Text) - Start, Text[Start:])
+		recorderNext ()
+#-----------------------------------------------------------------------------------
+def recorderNext ():
+	''' count the record which has just been written, hand the block over when it is full. Call with RecorderLock held '''
+	global RecorderCount
+	
+	RecorderCount = RecorderCount + 1
+	if (RecorderCount == RecorderBlockSize):
+		recorderHandOver ()
+#-----------------------------------------------------------------------------------
+def recorderHandOver ():
+	''' pass the records collected so far to recorderWriter and start a new block. Call with RecorderLock held '''
+	global RecorderBlock
+	global RecorderCount
+	
+	if (RecorderCount > 0):
+		RecorderQueue.put ((RecorderBlock, RecorderCount))
+		RecorderBlock = bytearray (RecorderBlockSize * RecorderSize)
+		RecorderCount = 0
+#-----------------------------------------------------------------------------------
+def recorderWriter ():
+	''' background task: compress and write the blocks of records, so the receive threads never wait for the disk '''
+	debug (3, "recorder started")
+	while (True):
 		try:
-			PingResult = (ping(IpAddress,timeout=1,count=1))
-		except Exception as e:
-			debug (1, str(e))
-			PingError = True
-			
-		if (not PingError):
-			if ((PingResult.success())):
-				Connected = True
-			
-		if (not Connected):
-			debug (2, 'waiting for connection ' + str (Count) + ' ...')
-			time.sleep (1)
-
-
-#--------------------------------------------------------------
-def sendCommand(msg):
-	''' send a command to Tello. Wind up the keep alive time '''
-	global TelloReady
-	global SockBasic
-	global tello_address
-	global TimeKeepalive
-	global args
-	global Offline
-	global tello_address
-	global LastCommand
+			Item = RecorderQueue.get (timeout = 1)	# come by profileCheck now and then, even when nothing is recorded
+		except queue.Empty:
+			profileCheck ("recorder")
+			continue
+		if (Item is None):
+			break
+		Block, Count = Item
+		Data = memoryview (Block)[:Count * RecorderSize]
+		if (RecorderCompress):
+			Data = zlib.compress (Data)
+			RecorderFile.write (struct.pack ('<II', len(Data), Count))
+		RecorderFile.write (Data)
+		ThreadCpu["recorder"] = time.thread_time()
+		profileCheck ("recorder")
+	profileEnd ("recorder")
+	debug (3, "recorder ended")
+#-----------------------------------------------------------------------------------
+def recorderRead (FileName):
+	''' open a recording. Returns (Header, Records), Records is a numpy array with the columns received (time), type, length and one per recorded key. 
+	Uncompressed recordings are memory-mapped, so they open without being read. State frames are Records[Records["type"] == RecordState] '''
+	if (numpy is None):
+		debug (1, "Error: numpy is needed to read recordings")
+		return (None, None)
 	
+	with open (FileName, "rb") as File:
+		if (File.read (len(RecorderMagic)) != RecorderMagic):
+			debug (1, "Error: " + FileName + " is not a tellTello recording")
+			return (None, None)
+		Length = struct.unpack ('<I', File.read (4))[0]
+		Header = json.loads (File.read (Length))
+	Offset = len(RecorderMagic) + 4 + Length
+	RecordType = numpy.dtype ([("received", "<f8"), ("type", "u1"), ("pad", "V3"), ("length", "<u4")] + [(Key, "<f4") for Key in Header["fields"]])
 	
-	LastCommand = msg
-	debug (2, msg, end='')
+	if (Header["block"] == 0):
+		Count = (os.path.getsize (FileName) - Offset) // RecordType.itemsize
+		if (Count == 0):
+			return (Header, numpy.zeros (0, RecordType))
+		return (Header, numpy.memmap (FileName, dtype = RecordType, mode = "r", offset = Offset, shape = (Count,)))
 	
-	if (not msg.startswith( 'rc')): 
-		TelloReady = False
-		
-	msg = msg.encode(encoding="utf-8") 
-	if (not Offline):
-		sent = SockBasic.sendto(msg, tello_address)
-	else:
-		sent = len(msg)
-	TimeKeepalive = time.time() + 10
-	debug (3, ': ' + str(sent) + ' bytes sent')
-
-#--------------------------------------------------------------
-def rcCommand (RcArray):
-	'''create a command like rc 100 100 100 100 from an array of 4 integers'''
-	debug (5, RcArray)
-	RcCommand = 'rc'
-	for Count in range (0,4):
-		if (RcArray[Count] > 100):
-			RcArray[Count] = 100
-		if (RcArray[Count] < -100):
-			RcArray[Count] = -100
-		RcCommand = RcCommand + ' ' + str(RcArray[Count])
+	Blocks = []
+	with open (FileName, "rb") as File:
+		with mmap.mmap (File.fileno(), 0, access = mmap.ACCESS_READ) as Map:
+			while (Offset + 8 <= len(Map)):
+				Length, Count = struct.unpack_from ('<II', Map, Offset)
+				Blocks.append (zlib.decompress (Map[Offset + 8:Offset + 8 + Length]))
+				Offset = Offset + 8 + Length
+	return (Header, numpy.frombuffer (b''.join (Blocks), dtype = RecordType))
+#-----------------------------------------------------------------------------------
+def recorderTexts (Header, Records, Type):
+	''' the commands (Type = RecordCommand) or answers (RecordAnswer) of a recording as a list of (time, text). Long texts are put together from
+	the RecordMore records which follow them, recordings made before RecordMore keep their texts cut off at the length of a record '''
+	TextType = numpy.dtype ([("received", "<f8"), ("type", "u1"), ("pad", "V3"), ("length", "<u4"), ("text", "S" + str(4 * len(Header["fields"])))])
+	Texts = Records.view (TextType)
+	Result = []
+	for First in numpy.flatnonzero (Texts["type"] == Type):
+		Length = int(Texts[First]["length"])
+		Text = bytes(Texts[First]["text"])[:Length]
+		Index = First + 1
+		while ((len(Text) < Length) and (Index < len(Texts)) and (Texts[Index]["type"] == RecordMore)):
+			Text = Text + bytes(Texts[Index]["text"])[:Length - len(Text)]
+			Index = Index + 1
+		Result.append ((float(Texts[First]["received"]), Text.decode(encoding="utf-8", errors="replace")))
+	return (Result)
+#-----------------------------------------------------------------------------------
+def replayFrames (FileName):
+	''' read state frames and commands from a recording, a csv watch log or a text file with raw state strings (one per line). 
+	Yields (RecordState, time, frame) or (RecordCommand, time, command). The time is None for raw state strings '''
+	with open (FileName, "rb") as File:
+		Binary = (File.read (len(RecorderMagic)) == RecorderMagic)
+	if (Binary):
+		yield from replayRecording (FileName)
+		return
 	
-	debug (4, RcCommand)
-	return (RcCommand)
-
+	Delimiter = CsvDelimiter
+	Keys = []
+	Command = ''
+	with open (FileName, "r") as File:
+		for Line in File:
+			Line = Line.strip()
+			if (Line.startswith ("watch" + Delimiter + "time" + Delimiter)):		# csv header
+				Keys = Line.split (Delimiter)[2:-2]
+			elif (Line.startswith ("watch" + Delimiter)):							# csv row
+				Fields = Line.split (Delimiter)
+				if (len(Fields) != len(Keys) + 4):			# e.g. the last row of a log cut off by a crash
+					debug (2, "replay: skipping a row with " + str(len(Fields)) + " fields instead of " + str(len(Keys) + 4))
+					continue
+				try:
+					Time = float (Fields[1].replace (CsvDecimal, '.'))
+				except ValueError:
+					debug (2, "replay: skipping a row without time")
+					continue
+				if (Fields[2 + len(Keys)] != Command):
+					Command = Fields[2 + len(Keys)]
+					yield (RecordCommand, Time, Command)
+				Frame = ''
+				for Key, Value in zip (Keys, Fields[2:]):
+					if (Value != 'error'):
+						if (StateTypes.get (Key, int) != stateText):
+							Value = Value.replace (CsvDecimal, '.')
+						Frame = Frame + Key + ':' + Value + ';'
+				yield (RecordState, Time, Frame)
+			elif (':' in Line):																	# raw state string
+				yield (RecordState, None, Line)
 #-----------------------------------------------------------------------------------
-
-'''global variables'''
-Running = True
-# DataDecoded = ""
-# StateDecoded = ""
-IpAddress = '192.168.10.1'
-host = ''
-SockBasic = None
-SockState = None
-TelloReady = True
-NumFrames = 0
-Commands = []
-TimeKeepalive = time.time() + 10
-TimeState = 0
-Offline = True
-StateDict = {"mid":"-1","x":"0","y":"0","z":"0","mpry":"0,0,0","pitch":"0","roll":"0","yaw":"0","vgx":"0","vgy":"0","vgz":"0","templ":"53","temph":"55","tof":"10","h":"0","bat":"72","baro":"-70.56","time":"0","agx":"-2.00","agy":"-10.00","agz":"-999.00"}
-WhichWatch = []
+def replayRecording (FileName):
+	''' read the records of a recording (see recorderStart) without numpy, for replayFrames '''
+	with open (FileName, "rb") as File:
+		File.read (len(RecorderMagic))
+		Length = struct.unpack ('<I', File.read (4))[0]
+		Header = json.loads (File.read (Length))
+		Fields = Header["fields"]
+		Size = Header["record"]
+		Format = Header["format"]
+		TextFormat = RecorderHead + str(4 * len(Fields)) + 's'
+		Command = None								# the last command, RecordMore records may follow
+		while (True):
+			if (Header["block"] == 0):
+				Data = File.read (Size * RecorderBlockSize)
+				Data = Data[:len(Data) - len(Data) % Size]
+			else:
+				BlockHeader = File.read (8)
+				if (len(BlockHeader) < 8):
+					break
+				Length, Count = struct.unpack ('<II', BlockHeader)
+				try:
+					Data = zlib.decompress (File.read (Length))
+				except zlib.error:						# the last block of a recording cut off by a crash
+					debug (1, "replay: " + FileName + " ends with a broken block")
+					break
+			if (len(Data) == 0):
+				break
+			for Offset in range (0, len(Data), Size):
+				if (Data[Offset + 8] == RecordMore):
+					if (Command is not None):			# the rest of a long command, maybe from the next block
+						Command = Command + struct.unpack_from (TextFormat, Data, Offset)[3]
+					continue
+				if (Command is not None):				# a command is complete when no RecordMore follows
+					yield (RecordCommand, CommandTime, Command[:CommandLength].decode(encoding="utf-8", errors="replace"))
+					Command = None
+				if (Data[Offset + 8] == RecordState):
+					Record = struct.unpack_from (Format, Data, Offset)
+					Frame = ''
+					for Key, Value in zip (Fields, Record[3:]):
+						if (Value == Value):			# not NaN
+							if (Value.is_integer()):
+								Frame = Frame + Key + ':' + str(int(Value)) + ';'
+							else:
+								Frame = Frame + Key + ':' + ('%.7g' % Value) + ';'		# float32 has about 7 digits
+					yield (RecordState, Record[0], Frame)
+				elif (Data[Offset + 8] == RecordCommand):
+					CommandTime, Type, CommandLength, Command = struct.unpack_from (TextFormat, Data, Offset)
+		if (Command is not None):
+			yield (RecordCommand, CommandTime, Command[:CommandLength].decode(encoding="utf-8", errors="replace"))
+#-----------------------------------------------------------------------------------
+def recvStateReplay (FileName, Speed):
+	''' feed the state frames of FileName through the state pipeline (interpreteState, watch, log) at Speed times the original pace, as fast as possible if Speed is 0. 
+	Every frame is watched, the time of the watch rows is the original one. Reports frames per second at the end '''
+	global Replaying
+	global WatchEcho
+	
+	debug (3, "replay of " + FileName + " started")
+	Replaying = True
+	if (Speed <= 0):
+		WatchEcho = False					# printing every row would be slower than the pipeline
+	Frames = 0
+	Start = time.perf_counter()
+	First = None
+	Time = time.time()
+	try:
+		for Type, FrameTime, Data in replayFrames (FileName):
+			if (not Running):
+				break
+			if (FrameTime is None):			# raw state string, assume the Tello's 10 frames per second
+				FrameTime = Time + ReplayPeriod
+			Time = FrameTime
+			if (First is None):
+				First = Time
+			if (Speed > 0):
+				Wait = Start + (Time - First) / Speed - time.perf_counter()
+				if (Wait > 0):
+					time.sleep (Wait)
+			if (Type == RecordCommand):
+				commandLog (Data, Time)
+			else:
+				stateReceived (stateLoad (Data), Time, True)
+				Frames = Frames + 1
+	except Exception as e:
+		debug (1, str(e))
+		debug (1, "Error: unable to replay " + FileName)
+	Elapsed = time.perf_counter() - Start
+	
+	WatchEcho = True
+	Replaying = False
+	if (Elapsed > 0):
+		debug (1, "replayed " + str(Frames) + " frames in " + str(round (Elapsed, 3)) + " s = " + str(round (Frames / Elapsed)) + " frames/s")
+#--------------------------------------------------------------------------
+def videoStart ():
+	''' receive the video stream (port 11111) into the NAL ring, in a thread or on the event loop of the asyncio engine '''
+	global SockVideo
+	global VideoThread
+	global VideoRing
+	global VideoView
+	
+	if (SockVideo is not None):
+		return (True)
+	try:
+		SockVideo = udpSocket (('0.0.0.0', VideoPort))
+	except OSError as e:
+		debug (1, str(e))
+		debug (1, "Error: unable to receive video on port " + str(VideoPort))
+		return (False)
+	if ((VideoRing is None) or (len(VideoRing) != VideoCapacity)):
+		VideoRing = bytearray (VideoCapacity)
+		VideoView = memoryview (VideoRing)
+	VideoStatsLast[0] = time.perf_counter()
+	if (AsyncLoop is not None):
+		SockVideo.setblocking (False)
+		AsyncLoop.add_reader (SockVideo, videoReadable)
+	else:
+		SockVideo.settimeout (1)
+		VideoThread = threading.Thread(target=recvVideo)
+		VideoThread.start()
+	debug (2, "receiving video on port " + str(VideoPort))
+	return (True)
+#--------------------------------------------------------------------------
+def videoStop ():
+	''' stop receiving video, close recorder and player '''
+	global SockVideo
+	global VideoThread
+	
+	for Name in list (VideoSinks):
+		videoSinkStop (Name)
+	if (SockVideo is None):
+		return
+	Sock = SockVideo
+	SockVideo = None						# ends recvVideo
+	if (VideoThread is not None):
+		VideoThread.join()
+		VideoThread = None
+	elif (AsyncLoop is not None):
+		AsyncLoop.remove_reader (Sock)
+	Sock.close()
+	debug (2, "video stopped")
+#--------------------------------------------------------------------------
+def recvVideo ():
+	''' receive the video stream straight into the NAL ring, see videoReceived '''
+	debug (4, "recvVideo started")
+	while (Running and (SockVideo is not None)):
+		try:
+			Length = SockVideo.recv_into (videoSpace ())
+			videoReceived (Length)
+		except socket.timeout:
+			pass
+		except Exception as e:
+			if (SockVideo is not None):
+				debug (1, '\n------------------- Exception: ' + str(e) + '\n')
+			break
+		ThreadCpu["recvVideo"] = time.thread_time()
+		profileCheck ("recvVideo")
+	profileEnd ("recvVideo")
+	debug (4, "recvVideo ended")
+#--------------------------------------------------------------------------
+def videoReadable ():
+	''' asyncio engine: video packets have arrived '''
+	while (SockVideo is not None):
+		try:
+			Length = SockVideo.recv_into (videoSpace ())
+		except (BlockingIOError, InterruptedError):
+			return
+		except OSError as e:
+			debug (1, '\n------------------- Exception: ' + str(e) + '\n')
+			return
+		videoReceived (Length)
+#--------------------------------------------------------------------------
+def videoSpace ():
+	''' the part of the ring the next packet is received into. Near the end of the ring, the incomplete NAL is moved to the start (the next lap), 
+	so that every NAL stays in one piece '''
+	global VideoWrite
+	global VideoLap
+	global VideoNalStart
+	global VideoNalType
+	global VideoSearch
+	
+	if (VideoWrite + VideoPacketMax > len(VideoRing)):
+		Keep = VideoWrite - VideoNalStart
+		if (Keep > len(VideoRing) // 2):		# no end in sight, something was lost
+			StatsCount[StatVideoLost] += 1
+			Keep = 0
+			VideoNalType = -1
+		with VideoLock:							# the sink writers must not copy what is being moved
+			VideoRing[0:Keep] = VideoView[VideoNalStart:VideoWrite].tobytes()		# a snapshot, source and destination may overlap
+			VideoWrite = Keep
+			VideoLap = VideoLap + 1
+		if (VideoNalType >= 0):
+			VideoNalType = VideoNalType - VideoNalStart
+		VideoSearch = max (0, VideoSearch - VideoNalStart)
+		VideoNalStart = 0
+	return (VideoView[VideoWrite:VideoWrite + VideoPacketMax])
+#--------------------------------------------------------------------------
+def videoReceived (Length, Time = None):
+	''' a packet of Length bytes has been received at the write position of the ring: find the start codes (00 00 01) in it and 
+	hand the completed NALs over to videoPublish. Tello ends every NAL with a short packet, so a NAL which does not start right after a 
+	short packet (or a short packet which is not followed by a NAL) means that packets were lost '''
+	global VideoWrite
+	global VideoNalStart
+	global VideoNalType
+	global VideoSearch
+	global VideoLastFull
+	
+	if (Time is None):
+		Time = time.time()
+	Start = VideoWrite
+	End = Start + Length
+	StatsCount[StatVideoPackets] += 1
+	StatsCount[StatVideoBytes] += Length
+	NalFirst = VideoRing.startswith (b"\x00\x00\x01", Start, End) or VideoRing.startswith (b"\x00\x00\x00\x01", Start, End)
+	if ((NalFirst == VideoLastFull) and (StatsCount[StatVideoPackets] > 1)):
+		StatsCount[StatVideoLost] += 1
+	VideoLastFull = (Length >= VideoPacketFull)
+	with VideoLock:
+		VideoWrite = End
+	
+	while (True):
+		Found = VideoRing.find (b"\x00\x00\x01", VideoSearch, End)
+		if (Found < 0):
+			break
+		NalEnd = Found
+		if ((Found > VideoNalStart) and (VideoRing[Found - 1] == 0)):		# 4 byte start code
+			NalEnd = Found - 1
+		if ((VideoNalType >= 0) and (NalEnd > VideoNalStart)):
+			videoPublish (VideoNalStart, NalEnd, Time)
+		VideoNalStart = NalEnd
+		VideoNalType = Found + 3
+		VideoSearch = Found + 3
+	VideoSearch = max (VideoSearch, End - 2)		# a start code may be split between two packets
+#--------------------------------------------------------------------------
+def videoPublish (Start, End, Time):
+	''' hand the NAL in VideoRing[Start:End] (with its start code) over to the subscribers, without copying it. Count frames and keyframes '''
+	Type = VideoRing[VideoNalType] & 0x1f
+	StatsCount[StatVideoNals] += 1
+	if (Type in [1, 5]):					# slice of a frame
+		StatsCount[StatVideoFrames] += 1
+	if (Type == 5):							# IDR = keyframe
+		if (StatsCount[StatVideoKeyframes] > 0):
+			VideoKeyframe[1] = VideoKeyframe[1] + (Time - VideoKeyframe[0])
+		VideoKeyframe[0] = Time
+		StatsCount[StatVideoKeyframes] += 1
+	Nal = VideoView[Start:End]
+	for Callback in VideoSubscribers:
+		Callback (Nal, Type, Time, VideoLap, Start)
+#--------------------------------------------------------------------------
+def videoSubscribe (Callback):
+	''' call Callback (Nal, Type, Time, Lap, Start) for every NAL received. Nal is a memoryview into the ring and is only valid 
+	until the ring has gone round once, see videoValid. Callbacks run in the receiving thread, so they must not block '''
+	if (Callback not in VideoSubscribers):
+		VideoSubscribers.append (Callback)
+#--------------------------------------------------------------------------
+def videoUnsubscribe (Callback):
+	''' stop calling Callback, see videoSubscribe '''
+	if (Callback in VideoSubscribers):
+		VideoSubscribers.remove (Callback)
+#--------------------------------------------------------------------------
+def videoValid (Lap, Start):
+	''' True if the NAL at Start, received in lap Lap of the ring, has not been overwritten yet. The packet room after VideoWrite counts as 
+	overwritten, a packet may be being received into it. Call with VideoLock held if the NAL is copied from the ring afterwards '''
+	return ((Lap == VideoLap) or ((Lap == VideoLap - 1) and (Start >= VideoWrite + VideoPacketMax)))
+#--------------------------------------------------------------------------
+def videoSinkStart (Name, File, Close, Index = None):
+	''' write every NAL to File (anything with write and flush) in a background thread, straight from the ring. Close is called at the end. 
+	Index: binary file for the keyframe index, see videoIndexAdd '''
+	videoSinkStop (Name)
+	Sink = {"name": Name, "file": File, "close": Close, "queue": collections.deque(), "event": threading.Event(), "running": True, 
+		"bytes": 0, "nals": 0, "lost": 0, "index": Index, "offset": 0, "previous": 0}
+	Sink["callback"] = lambda Nal, Type, Time, Lap, Start: videoSinkAdd (Sink, Lap, Start, len(Nal), Type, Time)
+	Sink["thread"] = threading.Thread(target=videoSinkWriter, args=(Sink,))
+	VideoSinks[Name] = Sink
+	Sink["thread"].start()
+	videoSubscribe (Sink["callback"])
+	return (Sink)
+#--------------------------------------------------------------------------
+def videoSinkAdd (Sink, Lap, Start, Length, Type, Time):
+	''' subscriber of a sink: remember where the NAL is, the writer picks it up '''
+	Sink["queue"].append ((Lap, Start, Start + Length, Type, Time))
+	Sink["event"].set()
+#--------------------------------------------------------------------------
+def videoSinkWriter (Sink):
+	''' background task of a sink: write the NALs from the ring. NALs which have been overwritten before they could be written are counted as lost. 
+	A NAL is copied out of the ring under VideoLock, so a slow file or player never gets one which is being overwritten '''
+	debug (3, "video " + Sink["name"] + " started")
+	Queue = Sink["queue"]
+	while (Sink["running"] or (len(Queue) > 0)):
+		Sink["event"].wait (1)
+		Sink["event"].clear()
+		try:
+			while (len(Queue) > 0):
+				Lap, Start, End, Type, Time = Queue.popleft()
+				with VideoLock:
+					Nal = VideoView[Start:End].tobytes() if (videoValid (Lap, Start)) else None
+				if (Nal is not None):
+					if (Sink["index"] is not None):
+						videoIndexAdd (Sink, Type, Time)
+					Sink["file"].write (Nal)
+					Sink["offset"] = Sink["offset"] + End - Start
+					Sink["bytes"] = Sink["bytes"] + End - Start
+					Sink["nals"] = Sink["nals"] + 1
+				else:
+					Sink["lost"] = Sink["lost"] + 1
+			Sink["file"].flush()
+			if (Sink["index"] is not None):
+				Sink["index"].flush()
+		except (OSError, ValueError) as e:			# disk full, player closed ...
+			debug (1, "video " + Sink["name"] + ": " + str(e))
+			videoUnsubscribe (Sink["callback"])
+			Sink["running"] = False
+			Queue.clear()
+		ThreadCpu["video " + Sink["name"]] = time.thread_time()
+		profileCheck ("video " + Sink["name"])
+	profileEnd ("video " + Sink["name"])
+	try:
+		Sink["close"]()
+		if (Sink["index"] is not None):
+			Sink["index"].close()
+	except Exception as e:
+		debug (3, str(e))
+	debug (3, "video " + Sink["name"] + " ended")
+#--------------------------------------------------------------------------
+def videoSinkStop (Name):
+	''' write what is left and close the sink Name '''
+	Sink = VideoSinks.pop (Name, None)
+	if (Sink is not None):
+		videoUnsubscribe (Sink["callback"])
+		Sink["running"] = False
+		Sink["event"].set()
+		Sink["thread"].join()
+		debug (2, "video " + Name + ": " + str(Sink["nals"]) + " NALs, " + str(Sink["bytes"]) + " bytes, " + str(Sink["lost"]) + " lost")
+#--------------------------------------------------------------------------
+def videoRecord (FileName):
+	''' record the raw H.264 stream to FileName, with a keyframe index in FileName + ".idx" (see videoIndexAdd) '''
+	try:
+		File = open (FileName, "wb")
+		Index = open (FileName + VideoIndexExtension, "wb")
+	except OSError as e:
+		debug (1, str(e))
+		debug (1, "Error: unable to open " + FileName)
+		return (False)
+	Header = {"video": os.path.basename (FileName), "format": VideoIndexFormat, "record": struct.calcsize (VideoIndexFormat), 
+		"clock": "time.time() when received, like the state frames", "started": time.time()}
+	Header = json.dumps (Header).encode(encoding="utf-8")
+	Header = Header + b' ' * (-(len(VideoIndexMagic) + 4 + len(Header)) % 8)		# records start 8-byte aligned
+	Index.write (VideoIndexMagic + struct.pack ('<I', len(Header)) + Header)
+	videoSinkStart ("record", File, File.close, Index)
+	debug (2, "recording video to " + FileName)
+	return (True)
+#--------------------------------------------------------------------------
+def videoIndexAdd (Sink, Type, Time):
+	''' add the position of a keyframe to the index of a recording: the SPS in front of it, or the IDR itself if there is no SPS. 
+	Time is the time the keyframe was received, on the same clock as the state frames (see stateReceived), so that flight and video can be lined up '''
+	if ((Type == 7) or ((Type == 5) and (Sink["previous"] not in [7, 8]))):
+		Sink["index"].write (struct.pack (VideoIndexFormat, Time, Sink["offset"]))
+	Sink["previous"] = Type
+#--------------------------------------------------------------------------
+def videoIndexRead (FileName):
+	''' read the keyframe index of a video recording (FileName is the video or the index). Returns (Header, list of (time, byte offset)) '''
+	if (not FileName.endswith (VideoIndexExtension)):
+		FileName = FileName + VideoIndexExtension
+	with open (FileName, "rb") as File:
+		if (File.read (len(VideoIndexMagic)) != VideoIndexMagic):
+			debug (1, "Error: " + FileName + " is not a tellTello video index")
+			return (None, None)
+		Length = struct.unpack ('<I', File.read (4))[0]
+		Header = json.loads (File.read (Length))
+		Data = File.read()
+	Size = Header["record"]
+	return (Header, list (struct.iter_unpack (Header["format"], Data[:len(Data) - len(Data) % Size])))
+#--------------------------------------------------------------------------
+def videoPlay (Command):
+	''' pipe the H.264 stream into a player program like ffplay, which reads it from stdin '''
+	try:
+		Process = subprocess.Popen (Command, stdin = subprocess.PIPE)
+	except OSError as e:
+		debug (1, str(e))
+		debug (1, "Error: unable to start " + " ".join (Command))
+		return (False)
+	videoSinkStart ("play", Process.stdin, Process.stdin.close)
+	return (True)
+#--------------------------------------------------------------------------
+def videoLines ():
+	''' bitrate, frames, keyframe interval and estimated loss of the video stream since the last call, one line per sink '''
+	Now = time.perf_counter()
+	Elapsed = Now - VideoStatsLast[0]
+	Bytes = StatsCount[StatVideoBytes] - VideoStatsLast[1]
+	Frames = StatsCount[StatVideoFrames] - VideoStatsLast[2]
+	VideoStatsLast[0] = Now
+	VideoStatsLast[1] = StatsCount[StatVideoBytes]
+	VideoStatsLast[2] = StatsCount[StatVideoFrames]
+	Keyframes = StatsCount[StatVideoKeyframes]
+	Lines = ["video: " + str(StatsCount[StatVideoPackets]) + " packets, " + str(round (Bytes * 8 / Elapsed / 1000 if (Elapsed > 0) else 0, 1)) + " kbit/s, " + 
+		str(StatsCount[StatVideoFrames]) + " frames, " + str(round (Frames / Elapsed if (Elapsed > 0) else 0, 1)) + "/s, " + str(Keyframes) + " keyframes" + 
+		((" every " + str(round (VideoKeyframe[1] / (Keyframes - 1), 3)) + " s") if (Keyframes > 1) else "") + ", " + 
+		str(StatsCount[StatVideoLost]) + " lost (estimated)"]
+	for Name, Sink in VideoSinks.items():
+		Lines.append ("video " + Name + ": " + str(Sink["nals"]) + " NALs, " + str(Sink["bytes"]) + " bytes, " + str(len(Sink["queue"])) + " waiting, " + 
+			str(Sink["lost"]) + " overwritten")
+	return (Lines)
+#--------------------------------------------------------------------------
+def timerSchedule (Name, Delay, Callback):
+	''' (re)schedule the timer event Name to call Callback in Delay seconds. A pending event of the same name is replaced. '''
+	global TimerQueue
+	global TimerEvents
+	
+	Deadline = time.monotonic() + Delay
+	with TimerCondition:
+		Pending = TimerEvents.get (Name)
+		TimerEvents[Name] = (Deadline, Callback)
+		if ((Pending is None) or (Deadline < Pending[0])):	# pushing an event back is cheap, timerFunc moves the old heap entry when it comes up
+			heapq.heappush (TimerQueue, (Deadline, Name))
+			TimerCondition.notify()
+			if (AsyncLoop is not None):
+				AsyncLoop.call_soon_threadsafe (AsyncTimerEvent.set)
+#--------------------------------------------------------------------------
+def timerCancel (Name):
+	''' remove the timer event Name, if it is pending '''
+	global TimerEvents
+	
+	with TimerCondition:
+		TimerEvents.pop (Name, None)
+#--------------------------------------------------------------------------
+def timerWake ():
+	''' wake up the timer task, e.g. to let it see that Running has been reset '''
+	with TimerCondition:
+		TimerCondition.notify()
+	if (AsyncLoop is not None):
+		AsyncLoop.call_soon_threadsafe (AsyncTimerEvent.set)
+#--------------------------------------------------------------------------
+def timerStep():
+	''' find the next due timer event. Returns (Callback, Wait): Callback is None if nothing is due, then Wait is the time to the next event (None if there is none). Call with TimerCondition held '''
+	global TimerQueue
+	global TimerEvents
+	
+	while (len(TimerQueue) > 0):
+		Deadline, Name = TimerQueue[0]
+		Event = TimerEvents.get (Name)
+		if ((Event is None) or (Event[0] < Deadline)):		# stale entry of a cancelled or rescheduled event
+			heapq.heappop (TimerQueue)
+		elif (Event[0] > Deadline):							# event has been pushed back, move its entry
+			heapq.heapreplace (TimerQueue, (Event[0], Name))
+		else:
+			Wait = Deadline - time.monotonic()
+			if (Wait > 0):
+				return (None, Wait)
+			heapq.heappop (TimerQueue)
+			del TimerEvents[Name]
+			return (Event[1], 0)
+	return (None, None)
+#--------------------------------------------------------------------------
+def timerFunc():
+	''' run the scheduled timer events (keepalive, watch, sleep). Sleeps until the next deadline instead of polling '''
+	global Running
+	
+	debug (3, "Timer task started")
+	timerSchedule ("keepalive", KeepalivePeriod, keepalive)
+	
+	while (Running):
+		with TimerCondition:
+			Callback, Wait = timerStep()
+			if (Callback is None):
+				TimerCondition.wait (Wait)
+		if (Callback is not None):
+			Callback()
+		ThreadCpu["timer"] = time.thread_time()
+		profileCheck ("timer")
+	
+	profileEnd ("timer")
+	debug (3, "Timer task ended")
+#--------------------------------------------------------------------------
+async def timerTask():
+	''' run the scheduled timer events in the asyncio engine, see timerFunc '''
+	debug (3, "Timer task started")
+	timerSchedule ("keepalive", KeepalivePeriod, keepalive)
+	
+	while (Running):
+		AsyncTimerEvent.clear()
+		with TimerCondition:
+			Callback, Wait = timerStep()
+		if (Callback is not None):
+			Callback()
+		else:
+			try:
+				await asyncio.wait_for (AsyncTimerEvent.wait(), Wait)
+			except asyncio.TimeoutError:
+				pass
+	
+	debug (3, "Timer task ended")
+#--------------------------------------------------------------------------
+def keepalive():
+	''' timer event: send something to keep Tello from landing, unless other commands (rc in joy mode, too) have done so within KeepalivePeriod. 
+	The keepalive is the query whose answer is the oldest (see keepaliveQuery). If other commands are waiting, it waits in the low priority lane, 
+	unless a script sleeps '''
+	Idle = time.perf_counter() - LastSent
+	if (Idle < KeepalivePeriod):
+		timerSchedule ("keepalive", KeepalivePeriod - Idle, keepalive)
+		return
+	timerSchedule ("keepalive", KeepalivePeriod, keepalive)
+	Query = keepaliveQuery ()
+	if (TelloReady and ((commandsWaiting () == 0) or (SleepTime >= 0))):	# while a script sleeps, nothing else would be sent
+		sendCommand (Query)
+	elif (not any ([Entry[0] in QueryKeepalive for Entry in CommandLanes["low"]])):
+		commandQueue (Query, "low")
+#--------------------------------------------------------------------------
+def keepaliveQuery ():
+	''' the query of QueryKeepalive with the oldest answer. Those made from state frames are left out while the frames come in '''
+	Best = QueryKeepalive[0]
+	Oldest = 0
+	Now = time.perf_counter()
+	for Query in QueryKeepalive:
+		if ((Query in QueryState) and (queryAnswer (Query) is not None)):
+			continue
+		Age = Now - QueryCache.get (Query, ('', 0))[1]
+		if (Age > Oldest):
+			Best = Query
+			Oldest = Age
+	return (Best)
+#--------------------------------------------------------------------------
+def watchTick():
+	''' timer event: let recvState print the next state frame, every WatchPeriod seconds '''
+	global NumFrames
+	
+	if (WatchPeriod > 0):
+		NumFrames = 1
+		timerSchedule ("watch", WatchPeriod, watchTick)
+#--------------------------------------------------------------------------
+def wakeUp():
+	''' timer event: end of the sleep command '''
+	global SleepTime
+	
+	SleepTime = -1
+	wakeMain()
+	debug (4, str(time.time()) + ", time to wake up")
+#--------------------------------------------------------------------------
+def wakeMain():
+	''' tell the main loop of the engine that TelloReady, SleepTime, Running or the command queue have changed '''
+	if (AsyncLoop is not None):
+		AsyncLoop.call_soon_threadsafe (AsyncMainEvent.set)
+	elif (WakeWriter is not None):
+		try:
+			WakeWriter.send (b'w')
+		except (BlockingIOError, OSError):		# a wake up is pending anyway
+			pass
+#--------------------------------------------------------------------------
+def commandQueue (msg, Lane = None):
+	''' put msg into a lane of the command queue. Without Lane, it is chosen by the command: emergency and stop preempt everything 
+	(emergency also drops all waiting commands), rc is latest-wins, queries have low priority, everything else is FIFO '''
+	global CommandRc
+	
+	Hash = msg.find("#")
+	if (Hash != -1):
+		msg = msg[0:Hash]
+	msg = msg.strip()
+	if (len(msg) == 0):
+		return
+	Keyword = msg.split()[0]
+	if (Keyword.startswith ('@') and (len(msg.split()) > 1)):		# swarm mode, e.g. @2 forward 50
+		Keyword = msg.split()[1]
+	if ((Lane is None) and TelloReady and (len(CommandLanes["normal"]) == 0) and queryServe (msg)):	# answered at once, nothing waiting could change it
+		wakeMain()					# the input has been used up, the main loop may ask for the next one
+		return
+	if (Lane is None):
+		if (Keyword in ['emergency', 'stop']):
+			Lane = "emergency"
+		elif (Keyword == 'rc'):
+			Lane = "rc"
+		elif (Keyword.endswith ('?')):
+			Lane = "low"
+		else:
+			Lane = "normal"
+	with CommandLock:
+		if (Lane == "rc"):
+			CommandRc = (msg, time.perf_counter() if (CommandRc is None) else CommandRc[1])	# the wait counts from the first of the values replaced
+		else:
+			if (Keyword == 'emergency'):
+				CommandLanes["normal"].clear()
+				CommandLanes["low"].clear()
+				WhenActions.clear()
+			CommandLanes[Lane].append ((msg, time.perf_counter()))
+			CommandStats[Lane][3] = max (CommandStats[Lane][3], len(CommandLanes[Lane]))
+	wakeMain()
+#--------------------------------------------------------------------------
+def commandInsert (Messages):
+	''' put Messages in front of the FIFO lane, in their order. Used by commands which expand to other commands, and by scripts '''
+	Now = time.perf_counter()
+	with CommandLock:
+		CommandLanes["normal"].extendleft ([(msg, Now) for msg in reversed (Messages)])
+		CommandStats["normal"][3] = max (CommandStats["normal"][3], len(CommandLanes["normal"]))
+#--------------------------------------------------------------------------
+def commandTake (Lane):
+	''' remove the next (message, time queued) from Lane, None if there is none. A script (iterator of its commands, see scriptRead) in the lane hands out one command at a time. Call with CommandLock held '''
+	global CommandRc
+	
+	if (Lane == "rc"):
+		Entry = CommandRc
+		CommandRc = None
+		return (Entry)
+	while (len(CommandLanes[Lane]) > 0):
+		Entry = CommandLanes[Lane][0]
+		if (isinstance (Entry[0], str)):
+			return (CommandLanes[Lane].popleft())
+		msg = next (Entry[0], None)
+		if (msg is not None):
+			return ((msg, time.perf_counter()))
+		CommandLanes[Lane].popleft()			# end of script
+	return (None)
+#--------------------------------------------------------------------------
+def commandDone (Lane, Time):
+	''' account for the waiting time of a message of Lane, which was queued at Time and has just been executed '''
+	Wait = time.perf_counter() - Time
+	with CommandLock:
+		Stats = CommandStats[Lane]
+		Stats[0] = Stats[0] + 1
+		Stats[1] = Stats[1] + Wait
+		Stats[2] = max (Stats[2], Wait)
+#--------------------------------------------------------------------------
+def commandUrgent ():
+	''' the next message which must not wait for anything (emergency, stop, rc), '' if there is none '''
+	Lane = ''
+	with CommandLock:
+		if (len(CommandLanes["emergency"]) > 0):
+			Lane = "emergency"
+		elif (CommandRc is not None):
+			Lane = "rc"
+		else:
+			return ('')
+		msg, Time = commandTake (Lane)
+	commandDone (Lane, Time)
+	return (msg)
+#--------------------------------------------------------------------------
+def commandNext ():
+	''' the next message to execute: a command of a rule, from the FIFO lane, or a query if Tello is idle. '' if there is none or if we are sleeping 
+	(commands of rules are executed anyway). 
+	processMessage calls commandDone when the message has been executed '''
+	global CommandCurrent
+	
+	with CommandLock:
+		Lane = "normal"
+		if (len(WhenActions) > 0):				# commands of rules go first, a sleep doesn't hold them back
+			Entry = WhenActions.popleft()
+		elif (SleepTime >= 0):
+			return ('')
+		else:
+			Entry = commandTake (Lane)
+		if ((Entry is None) and TelloReady):
+			Lane = "low"
+			Entry = commandTake (Lane)
+		if (Entry is None):
+			return ('')
+		msg, Time = Entry
+	CommandCurrent = (Lane, Time)
+	return (msg)
+#--------------------------------------------------------------------------
+def commandsWaiting ():
+	''' number of messages in the command queue '''
+	return (len(CommandLanes["emergency"]) + len(CommandLanes["normal"]) + len(CommandLanes["low"]) + (CommandRc is not None) + len(WhenActions))
+#--------------------------------------------------------------------------
+def queuePrint ():
+	''' print the depth of the command lanes and how long the messages have waited '''
+	debug (1, "lane\t\twaiting\tmax\ttaken\tmean ms\tmax ms")
+	with CommandLock:
+		for Lane, Stats in CommandStats.items():
+			Depth = (CommandRc is not None) if (Lane == "rc") else len(CommandLanes[Lane])
+			Mean = Stats[1] / Stats[0] * 1000 if (Stats[0] > 0) else 0
+			debug (1, Lane + "\t" + ("\t" if (len(Lane) < 8) else "") + str(int(Depth)) + "\t" + str(Stats[3]) + "\t" + str(Stats[0]) + "\t" + 
+				str(round (Mean, 3)) + "\t" + str(round (Stats[2] * 1000, 3)))
+#--------------------------------------------------------------------------
+def scriptRead (FileName, WhereToAdd): 
+	''' compile and check a script in one pass and add its commands to the FIFO lane of the command queue, from where they are taken one at a 
+	time while it runs, as they are (no second check). Filename = file to read, WhereToInsert = i for insert, a for append, r for replace '''
+	
+	if (WhereToAdd not in ['i', 'a', 'r']):
+		debug (2, "Parameter WhereToAdd=" + WhereToAdd + " in function scriptRead not recognized, must be r, i or a")
+		return (False)
+	
+	debug (2, "Checking script " + FileName)
+	Errors = 0
+	Commands = []
+	ScriptChecked.clear()
+	for Name, Number, msg, Error in scriptFile (FileName, {}, 0):
+		if (Error != ''):
+			Errors = Errors + 1
+			if (Errors <= 10):
+				debug (1, Name + ":" + str(Number) + ": " + Error)
+		else:
+			Commands.append (msg)
+	ScriptChecked.clear()
+	if (Errors > 0):
+		debug (1, str(Errors) + " error(s) in " + FileName)
+		return (False)
+	debug (2, str(len(Commands)) + " commands in " + FileName)
+	
+	Entry = (iter (Commands), time.perf_counter())
+	with CommandLock:
+		if (WhereToAdd == 'i'):
+			CommandLanes["normal"].appendleft (Entry)
+		else:
+			if (WhereToAdd == 'r'):
+				CommandLanes["normal"].clear()
+			CommandLanes["normal"].append (Entry)
+	wakeMain()
+	return (True)
+#--------------------------------------------------------------------------
+def scriptFile (FileName, Variables, Depth):
+	''' read script FileName line by line, see scriptBlock. Yields (file name, line number, command, error message) '''
+	try:
+		with open (FileName, "r") as FileHandle:
+			yield from scriptBlock (FileName, enumerate (FileHandle, 1), Variables, Depth)
+	except OSError as e:
+		yield (FileName, 0, '', str(e))
+#--------------------------------------------------------------------------
+def scriptBlock (FileName, Lines, Variables, Depth):
+	''' compile the (line number, text) of Lines into commands: remove comments, replace $variables, unroll "repeat n [variable]" ... "endrepeat", 
+	follow "include file" and check every command with scriptCheck. "set name value" sets a variable. Yields (file name, line number, command, error message) '''
+	for Number, Line in Lines:
+		Hash = Line.find ("#")
+		if (Hash != -1):
+			Line = Line[0:Hash]
+		if ('$' in Line):
+			for Name in sorted (Variables, key = len, reverse = True):		# $ab before $a
+				Line = Line.replace ('$' + Name, Variables[Name])
+		Splitted = Line.split()
+		if (len(Splitted) == 0):
+			continue
+		Keyword = Splitted[0]
+		if (Keyword == 'set'):
+			if (len(Splitted) != 3):
+				yield (FileName, Number, '', "set needs a name and a value")
+			else:
+				Variables[Splitted[1]] = Splitted[2]
+		elif (Keyword == 'repeat'):
+			try:
+				Count = int (Splitted[1])
+			except (ValueError, IndexError):
+				Count = -1
+			if ((Count < 0) or (len(Splitted) > 3)):
+				yield (FileName, Number, '', "repeat needs a number and optionally a variable")
+				Count = 1				# check the body once
+			Body = []
+			Level = 1
+			for Line2 in Lines:
+				Words = Line2[1].split ('#')[0].split()
+				if ((len(Words) > 0) and (Words[0] == 'repeat')):
+					Level = Level + 1
+				elif ((len(Words) > 0) and (Words[0] == 'endrepeat')):
+					Level = Level - 1
+					if (Level == 0):
+						break
+				Body.append (Line2)
+			else:
+				yield (FileName, Number, '', "repeat without endrepeat")
+				Count = min (Count, 1)
+			for Loop in range (1, Count + 1):
+				if (len(Splitted) > 2):
+					Variables[Splitted[2]] = str(Loop)
+				yield from scriptBlock (FileName, iter (Body), Variables, Depth)
+		elif (Keyword == 'endrepeat'):
+			yield (FileName, Number, '', "endrepeat without repeat")
+		elif (Keyword == 'include'):
+			if (len(Splitted) != 2):
+				yield (FileName, Number, '', "include needs a file name")
+			elif (Depth >= ScriptDepthMax):
+				yield (FileName, Number, '', "includes nested too deep")
+			else:
+				yield from scriptFile (os.path.join (os.path.dirname (FileName), Splitted[1]), Variables, Depth + 1)
+		else:
+			msg = ' '.join (Splitted)
+			Error = ScriptChecked.get (msg)
+			if (Error is None):					# repeat loops and scripts repeat their commands, each is checked once
+				Error = scriptCheck (Splitted)
+				ScriptChecked[msg] = Error
+			yield (FileName, Number, msg, Error)
+#--------------------------------------------------------------------------
+def scriptCheck (Splitted):
+	''' check a command (split into words) against ScriptKeywords. Returns an error message, '' if the command is fine '''
+	if (Splitted[0].startswith ('@')):			# swarm mode
+		Splitted = Splitted[1:]
+		if (len(Splitted) == 0):
+			return ("command missing after @")
+	Keyword = Splitted[0]
+	Args = Splitted[1:]
+	if (Keyword not in ScriptKeywords):
+		return ("unknown command " + Keyword)
+	MinArgs, MaxArgs, Types = ScriptKeywords[Keyword]
+	if ((len(Args) < MinArgs) or ((MaxArgs >= 0) and (len(Args) > MaxArgs))):
+		return (Keyword + ": wrong number of arguments")
+	for Arg, Type in zip (Args, Types):
+		if (Type is None):
+			continue
+		if (isinstance (Type, str)):
+			if (Arg not in Type.split ('|')):
+				return (Keyword + ": " + Arg + " is not one of " + Type)
+			continue
+		try:
+			Value = Type[0] (Arg)
+		except ValueError:
+			return (Keyword + ": " + Arg + " is not a number")
+		if ((Value < Type[1]) or (Value > Type[2])):
+			return (Keyword + ": " + Arg + " is out of range " + str(Type[1]) + " .. " + str(Type[2]))
+	return ('')
+
+#-----------------------------------------------------------------------------------
+def udpSocket (Address):
+	''' create a UDP socket bound to Address. The address may be shared, so that telloSim can run on the same computer '''
+	Sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+	Sock.setsockopt (socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+	Sock.bind (Address)
+	return (Sock)
+#-----------------------------------------------------------------------------------
+def waitForConnection (IpAddress):
+	''' send pings to IpAddress until ping is successful. No timeout, will wait forever. '''
+	Count = 0
+	Connected = False
+	while (not Connected):
+		Count = Count + 1
+		PingError = False
+		try:
+			PingResult = (ping(IpAddress,timeout=1,count=1))
+		except Exception as e:
+			debug (1, str(e))
+			PingError = True
+			
+		if (not PingError):
+			if ((PingResult.success())):
+				Connected = True
+			
+		if (not Connected):
+			debug (2, 'waiting for connection ' + str (Count) + ' ...')
+			time.sleep (1)
+
+
+#--------------------------------------------------------------
+def sendCommand(msg, Retry = False):
+	''' send a command to Tello and wait for its answer (see commandSent), Retry = True if it is sent again. Wind up the keep alive time '''
+	global TelloReady
+	global SockBasic
+	global tello_address
+	global args
+	global Offline
+	global tello_address
+	global InputTime
+	global LastSent
+	
+	commandLog (msg, time.time())
+	debug (2, msg, end='')
+	
+	if (not msg.startswith( 'rc')): 
+		TelloReady = False
+		if ((not Retry) and (not Offline) and (len(Swarm) == 0)):
+			commandSent (msg)
+		for Query in QueryChanges.get (msg.split()[0], []):		# e.g. speed 50 changes the answer to speed?
+			QueryCache.pop (Query, None)
+		
+	if ((InputTime > 0) and (not Retry)):				# latency from user input to UDP send
+		Latency = time.perf_counter() - InputTime
+		Stats = InputLatency[InputSource]
+		Stats[0] = Stats[0] + 1
+		Stats[1] = Stats[1] + Latency
+		Stats[2] = max (Stats[2], Latency)
+		InputTime = 0
+		debug (4, "input latency " + str(round (Latency * 1000, 3)) + " ms")
+		
+	msg = msg.encode(encoding="utf-8") 
+	if (Offline):
+		sent = len(msg)
+	elif (len(Swarm) > 0):
+		sent = swarmSend (msg.decode(encoding="utf-8"))
+	elif (TransportBasic is not None):
+		TransportBasic.sendto(msg, tello_address)
+		sent = len(msg)
+	else:
+		sent = SockBasic.sendto(msg, tello_address)
+	StatsCount[StatSent] += 1
+	StatsCount[StatSentBytes] += sent
+	LastSent = time.perf_counter()				# keepalive looks at it, no timer work per command
+	debug (3, ': ' + str(sent) + ' bytes sent')
+
+#--------------------------------------------------------------
+def swarmStart (IpList):
+	''' prepare swarm mode: one dict per Tello, found by its ip address when its answers and state frames arrive '''
+	for Ip in IpList:
+		Drone = {"number": len(Swarm) + 1, "ip": Ip, "address": (Ip, 8889), "inflight": [], "info": {"sdk":-1,"bat":-1,"wifi":-1},
+			"state": b'', "frames": 0, "rtt": [0, 0, 0, 0, 0]}		# rtt: answers, sum, max, timeouts, retries
+		Swarm.append (Drone)
+		SwarmIndex[Ip] = Drone
+#--------------------------------------------------------------
+def swarmTargets (msg):
+	''' split a swarm command like "@2 forward 50", "@1,3 land" or "@all land" into the Tellos and the SDK command. Without @, the command is for all '''
+	Splitted = msg.split (None, 1)
+	if ((len(Splitted) < 2) or (not Splitted[0].startswith ('@'))):
+		return (Swarm, msg)
+	if (Splitted[0] == '@all'):
+		return (Swarm, Splitted[1])
+	Targets = []
+	for Number in Splitted[0][1:].split (','):
+		try:
+			Targets.append (Swarm[int(Number) - 1])
+		except (ValueError, IndexError):
+			debug (1, "no Tello " + Number + " in the swarm")
+	return (Targets, Splitted[1])
+#--------------------------------------------------------------
+def swarmSend (msg):
+	''' send msg to the Tellos it addresses (see swarmTargets) and wait for their answers. Returns the number of bytes sent '''
+	global TelloReady
+	
+	Targets, Command = swarmTargets (msg)
+	Data = Command.encode(encoding="utf-8")
+	Keyword = Command.split()[0] if (len(Command.split()) > 0) else Command
+	Timeout, Retries = answerTime (Command)
+	Now = time.perf_counter()
+	for Drone in Targets:
+		TransportBasic.sendto (Data, Drone["address"])
+		if (Keyword != 'rc'):
+			Drone["inflight"].append ([Command, Keyword, Now, Now + Timeout, 0])
+	swarmSchedule ()
+	TelloReady = swarmReady ()
+	return (len(Data) * len(Targets))
+#--------------------------------------------------------------
+def swarmReady ():
+	''' True if all Tellos of the swarm have answered '''
+	for Drone in Swarm:
+		if (len(Drone["inflight"]) > 0):
+			return (False)
+	return (True)
+#--------------------------------------------------------------
+def swarmAnswer (Address, DataDecoded):
+	''' an answer from a Tello of the swarm: match it to its command, like commandAnswered does for a single Tello '''
+	global TelloReady
+	global RttTotal
+	
+	Drone = SwarmIndex.get (Address[0])
+	if (Drone is None):
+		debug (2, "answer from unknown address " + Address[0] + ": " + DataDecoded)
+		return
+	Name = "@" + str(Drone["number"])
+	debug (2, Name + " " + DataDecoded)
+	if (Recording):
+		recorderAdd (RecordAnswer, time.time(), Name + " " + DataDecoded)
+	Command = ''
+	for Entry in Drone["inflight"]:
+		if (answerFits (Entry[0], DataDecoded)):
+			Drone["inflight"].remove (Entry)
+			Command = Entry[0]
+			Rtt = time.perf_counter() - Entry[2]
+			for Stats in [Drone["rtt"], RttStats.setdefault (Entry[1], [0, 0, 0, 0, 0])]:		# per Tello and per command, see rttPrint
+				Stats[0] = Stats[0] + 1
+				Stats[1] = Stats[1] + Rtt
+				Stats[2] = max (Stats[2], Rtt)
+			RttRecent[RttTotal % len(RttRecent)] = Rtt
+			RttTotal = RttTotal + 1
+			break
+	for Query, Key in [('battery?', "bat"), ('sdk?', "sdk"), ('wifi?', "wifi")]:
+		if (Command == Query):
+			try: 
+				Drone["info"][Key] = int(DataDecoded)
+			except Exception:
+				Drone["info"][Key] = -1
+	swarmSchedule ()
+	TelloReady = swarmReady ()
+	wakeMain()
+#--------------------------------------------------------------
+def swarmSchedule ():
+	''' let the timer call swarmTimeout when the first command of any Tello is overdue '''
+	Deadline = None
+	for Drone in Swarm:
+		for Entry in Drone["inflight"]:
+			if ((Deadline is None) or (Entry[3] < Deadline)):
+				Deadline = Entry[3]
+	if (Deadline is None):
+		timerCancel ("swarm")
+	else:
+		timerSchedule ("swarm", Deadline - time.perf_counter(), swarmTimeout)
+#--------------------------------------------------------------
+def swarmTimeout ():
+	''' timer event: send overdue commands again to the Tellos which have not answered, or give up, see answerTimeout '''
+	global TelloReady
+	
+	Now = time.perf_counter()
+	for Drone in Swarm:
+		for Entry in list(Drone["inflight"]):
+			if (Entry[3] <= Now):
+				Timeout, Retries = answerTime (Entry[0])
+				if (Entry[4] < Retries):
+					Entry[2] = Now
+					Entry[3] = Now + Timeout
+					Entry[4] = Entry[4] + 1
+					Drone["rtt"][4] = Drone["rtt"][4] + 1
+					RttStats.setdefault (Entry[1], [0, 0, 0, 0, 0])[4] += 1
+					TransportBasic.sendto (Entry[0].encode(encoding="utf-8"), Drone["address"])
+					debug (2, "no answer from @" + str(Drone["number"]) + " to " + Entry[0] + ", sending it again")
+				else:
+					Drone["inflight"].remove (Entry)
+					Drone["rtt"][3] = Drone["rtt"][3] + 1
+					RttStats.setdefault (Entry[1], [0, 0, 0, 0, 0])[3] += 1
+					debug (1, "no answer from @" + str(Drone["number"]) + " to " + Entry[0] + ", giving up")
+	swarmSchedule ()
+	TelloReady = swarmReady ()
+	wakeMain()
+#--------------------------------------------------------------
+def swarmState (Address, Data):
+	''' a state frame from a Tello of the swarm. The frames of Tello SwarmWatch go through the usual state handling (watch, log, recorder) '''
+	Drone = SwarmIndex.get (Address[0])
+	if (Drone is None):
+		return
+	Drone["state"] = Data
+	Drone["frames"] = Drone["frames"] + 1
+	if (Drone["number"] == SwarmWatch):
+		stateReceived (stateLoad (Data))
+#--------------------------------------------------------------
+def swarmPrint ():
+	''' print the status of every Tello of the swarm '''
+	debug (1, "Tello\tip\t\twaiting\tbat\tframes\tmean ms\ttimeouts\tretries")
+	for Drone in Swarm:
+		Bat = Drone["info"]["bat"]
+		Start = Drone["state"].find (b';bat:')
+		if (Start != -1):
+			End = Drone["state"].find (b';', Start + 1)
+			Bat = Drone["state"][Start + 5:End].decode (encoding="utf-8", errors="replace")
+		Stats = Drone["rtt"]
+		Mean = Stats[1] / Stats[0] * 1000 if (Stats[0] > 0) else 0
+		debug (1, "@" + str(Drone["number"]) + ("*" if (Drone["number"] == SwarmWatch) else "") + "\t" + Drone["ip"] + "\t" + str(len(Drone["inflight"])) + "\t" + str(Bat) + "\t" + 
+			str(Drone["frames"]) + "\t" + str(round (Mean, 3)) + "\t" + str(Stats[3]) + "\t\t" + str(Stats[4]))
+#--------------------------------------------------------------
+def commandLog (msg, Time):
+	''' remember msg as the last command (sent at Time) for watch, log and recorder '''
+	global LastCommand
+	global CommandCount
+	
+	LastCommand = msg
+	if (Recording):
+		recorderAdd (RecordCommand, Time, msg)
+	CommandCount = CommandCount + 1
+	CommandLog[CommandCount % len(CommandLog)] = msg
+#-----------------------------------------------------------------------------------
+def commandSent (msg):
+	''' remember that msg waits for an answer, see commandAnswered and answerTimeout '''
+	Keyword = msg.split()[0] if (len(msg.split()) > 0) else msg
+	Timeout, Retries = answerTime (msg)
+	Now = time.perf_counter()
+	with InFlightLock:
+		InFlight.append ([msg, Keyword, Now, Now + Timeout, 0])
+		answerSchedule ()
+#-----------------------------------------------------------------------------------
+def answerTime (Command):
+	''' (seconds to wait for the answer, retries) of Command, see AnswerTimeouts. Moves are answered when they are done: their time comes from 
+	the distance (angle) and MoveSpeed (TurnSpeed), times MoveMargin, but is never shorter than AnswerTimeouts[''] '''
+	Splitted = Command.split()
+	Keyword = Splitted[0] if (len(Splitted) > 0) else Command
+	if (Keyword.endswith ('?')):
+		return (AnswerTimeouts['?'])
+	Timeout, Retries = AnswerTimeouts.get (Keyword, AnswerTimeouts[''])
+	try:
+		Values = [float (Value) for Value in Splitted[1:]]
+		if (Keyword in ['forward', 'back', 'left', 'right', 'up', 'down']):
+			Seconds = Values[0] / MoveSpeed
+		elif (Keyword in ['cw', 'ccw']):
+			Seconds = Values[0] / TurnSpeed
+		elif (Keyword == 'go'):
+			Seconds = math.dist ([0, 0, 0], Values[0:3]) / Values[3]
+		elif (Keyword == 'curve'):					# two straight lines are longer than the arc
+			Seconds = (math.dist ([0, 0, 0], Values[0:3]) + math.dist (Values[0:3], Values[3:6])) / Values[6]
+		elif (Keyword == 'jump'):
+			Seconds = math.dist ([0, 0, 0], Values[0:3]) / Values[3] + Values[4] / TurnSpeed
+		else:
+			Seconds = 0
+	except (ValueError, IndexError, ZeroDivisionError):
+		Seconds = 0
+	return ((max (Timeout, Seconds * MoveMargin), Retries))
+#-----------------------------------------------------------------------------------
+def answerFits (Command, Answer):
+	''' True if Answer may be the answer to Command: queries are answered by a value, all other commands by ok or an error '''
+	if (Command.endswith ('?')):
+		return (Answer != 'ok')
+	return ((Answer == 'ok') or Answer.startswith (('error', 'out of range', 'unknown command')))
+#-----------------------------------------------------------------------------------
+def commandAnswered (Answer):
+	''' find the command Answer belongs to: the oldest one in InFlight which expects such an answer. Record its round trip time, return the command ('' if none) '''
+	global TelloReady
+	global RttTotal
+	
+	Now = time.perf_counter()
+	Command = ''
+	with InFlightLock:
+		for Entry in InFlight:
+			if (answerFits (Entry[0], Answer)):
+				InFlight.remove (Entry)
+				Command = Entry[0]
+				Rtt = Now - Entry[2]
+				Stats = RttStats.setdefault (Entry[1], [0, 0, 0, 0, 0])
+				Stats[0] = Stats[0] + 1
+				Stats[1] = Stats[1] + Rtt
+				Stats[2] = max (Stats[2], Rtt)
+				RttRecent[RttTotal % len(RttRecent)] = Rtt
+				RttTotal = RttTotal + 1
+				debug (4, Command + " answered in " + str(round (Rtt * 1000, 3)) + " ms")
+				break
+		if (len(InFlight) == 0):
+			timerCancel ("answer")
+		else:
+			answerSchedule ()
+		if (Command == ''):
+			debug (2, "answer without command: " + Answer)
+		if (len(InFlight) == 0):
+			TelloReady = True
+	wakeMain()
+	return (Command)
+#-----------------------------------------------------------------------------------
+def answerSchedule ():
+	''' let the timer call answerTimeout when the first command in InFlight is overdue. Call with InFlightLock held '''
+	if (len(InFlight) > 0):
+		timerSchedule ("answer", min ([Entry[3] for Entry in InFlight]) - time.perf_counter(), answerTimeout)
+#-----------------------------------------------------------------------------------
+def answerTimeout ():
+	''' timer event: send the overdue commands again, if they may be repeated, or give up waiting for their answer '''
+	global TelloReady
+	
+	Now = time.perf_counter()
+	Repeat = []
+	with InFlightLock:
+		for Entry in list(InFlight):
+			if (Entry[3] <= Now):
+				Timeout, Retries = answerTime (Entry[0])
+				Stats = RttStats.setdefault (Entry[1], [0, 0, 0, 0, 0])
+				if (Entry[4] < Retries):
+					Entry[2] = Now
+					Entry[3] = Now + Timeout
+					Entry[4] = Entry[4] + 1
+					Stats[4] = Stats[4] + 1
+					Repeat.append (Entry[0])
+					debug (2, "no answer to " + Entry[0] + ", sending it again")
+				else:
+					InFlight.remove (Entry)
+					Stats[3] = Stats[3] + 1
+					debug (1, "no answer to " + Entry[0] + ", giving up")
+		answerSchedule ()
+		if (len(InFlight) == 0):
+			TelloReady = True
+	for msg in Repeat:
+		sendCommand (msg, Retry = True)
+	wakeMain()
+#-----------------------------------------------------------------------------------
+def rttPrint ():
+	''' print the round trip times, timeouts and retries per command, in swarm mode also per Tello '''
+	debug (1, "command\tanswers\tmean ms\tmax ms\ttimeouts\tretries")
+	with InFlightLock:
+		for Keyword, Stats in sorted (RttStats.items()) + [("@" + str(Drone["number"]), Drone["rtt"]) for Drone in Swarm]:
+			Mean = Stats[1] / Stats[0] * 1000 if (Stats[0] > 0) else 0
+			debug (1, Keyword + "\t" + str(Stats[0]) + "\t" + str(round (Mean, 3)) + "\t" + str(round (Stats[2] * 1000, 3)) + "\t" + str(Stats[3]) + "\t\t" + str(Stats[4]))
+		if (len(InFlight) > 0):
+			debug (1, "waiting for the answer to " + ", ".join ([Entry[0] for Entry in InFlight]))
+
+#--------------------------------------------------------------
+def rcStick ():
+	''' the simulated joystick (Rc) has moved. Returns the rc command to send, or '' if the rc stream (see rcTick) sends it '''
+	Command = rcSticks ()
+	if (RcRate <= 0):
+		return (Command)
+	timerSchedule ("rc", max (0, RcSentTime + 1 / RcRate - time.perf_counter()), rcTick)	# at once, unless this would exceed RcRate
+	return ('')
+#--------------------------------------------------------------
+def rcStart ():
+	''' start the rc stream of joy mode. What Tello has got so far counts as sent, e.g. the sticks of the ready command '''
+	global RcSent
+	global RcSentTime
+	global RcConfirmed
+	
+	stateKeys ()
+	timerCancel ("rc")
+	if (RcRate > 0):
+		RcSent = rcSticks ()
+		RcSentTime = time.perf_counter()
+		RcConfirmed = True
+		timerSchedule ("rc", RcRefresh, rcTick)
+#--------------------------------------------------------------
+def rcStop ():
+	''' stop the rc stream and the altitude hold, when joy mode ends '''
+	timerCancel ("rc")
+	if (Hold):
+		holdStop ()
+	stateKeys ()
+#--------------------------------------------------------------
+def rcTick ():
+	''' timer event: send the sticks at RcRate while in joy mode. Changes in between are coalesced. 
+	Unchanged sticks are sent until a state frame shows them (see rcEcho) or RcRepeat times, later every RcRefresh seconds, which keeps the link alive '''
+	global RcSent
+	global RcSentTime
+	global RcConfirmed
+	global RcRepeats
+	
+	if ((not InputModeJoy) or InputModeString or (RcRate <= 0)):
+		return
+	Command = rcSticks ()
+	Now = time.perf_counter()
+	if (Command != RcSent):
+		RcConfirmed = False
+		RcRepeats = 0
+	Waiting = (not RcConfirmed) and (RcRepeats < RcRepeat)
+	if (Waiting or (Now - RcSentTime >= RcRefresh)):
+		RcSent = Command
+		RcSentTime = Now
+		RcRepeats = RcRepeats + 1
+		sendCommand (Command)
+	if (Waiting):
+		timerSchedule ("rc", 1 / RcRate, rcTick)
+	else:
+		timerSchedule ("rc", RcSentTime + RcRefresh - Now, rcTick)
+#--------------------------------------------------------------
+def rcEcho ():
+	''' called for every state frame in joy mode: the sticks count as confirmed when Tello moves (or hovers) and turns (or not) as they say '''
+	global RcConfirmed
+	global RcYaw
+	
+	try:
+		Moving = max (abs (StateDict["vgx"]), abs (StateDict["vgy"]), abs (StateDict["vgz"])) > 1		# dm/s
+		Turning = (abs (StateDict["yaw"] - RcYaw) >= 1)
+		RcYaw = StateDict["yaw"]
+	except TypeError:						# not decoded
+		return
+	if ((Moving == ((RcOut[0] != 0) or (RcOut[1] != 0) or (RcOut[2] != 0))) and (Turning == (RcOut[3] != 0))):
+		RcConfirmed = True
+#--------------------------------------------------------------
+def rcCommand (RcArray):
+	'''create a command like rc 100 100 100 100 from an array of 4 integers'''
+	debug (5, RcArray)
+	RcCommand = 'rc'
+	for Count in range (0,4):
+		if (RcArray[Count] > 100):
+			RcArray[Count] = 100
+		if (RcArray[Count] < -100):
+			RcArray[Count] = -100
+		RcCommand = RcCommand + ' ' + str(RcArray[Count])
+	
+	debug (4, RcCommand)
+	return (RcCommand)
+#--------------------------------------------------------------
+def rcCurve (Expo, Rate):
+	''' the lookup table of an axis: stick position + 100 (0 .. 200): rc value Rate * (Expo * x^3 + (1 - Expo) * x), x = stick / 100. 
+	Expo 0 is linear, 1 gives fine control near the center. Rate (%) is the rc value at full stick '''
+	return ([round (Rate * (Expo * (Stick / 100) ** 3 + (1 - Expo) * Stick / 100)) for Stick in range (-100, 101)])
+#--------------------------------------------------------------
+def rcSticks ():
+	''' the rc command of the simulated joystick: the sticks (Rc) looked up in the curves of their axes. The altitude hold sets its rc value directly '''
+	for Axis in range (0, 4):
+		RcOut[Axis] = RcCurves[Axis][Rc[Axis] + 100]
+	if (Hold):
+		RcOut[2] = Rc[2]
+	return (rcCommand (RcOut))
+#--------------------------------------------------------------
+def rcCenter ():
+	''' all sticks to the center at once, no ramp '''
+	for Axis in range (0, 4):
+		Rc[Axis] = 0
+		RcTarget[Axis] = 0
+	timerCancel ("stick")
+#--------------------------------------------------------------
+def rcMove (Axis, Step):
+	''' a key moves the target of stick Axis by Step. Without ramp the stick follows at once, else stickTick moves it. Returns what rcStick returns '''
+	RcTarget[Axis] = max (-100, min (100, RcTarget[Axis] + Step))
+	if (RcRamp > 0):
+		timerSchedule ("stick", 0, stickTick)
+		return ('')
+	Rc[Axis] = RcTarget[Axis]
+	if (RcDecay > 0):
+		timerSchedule ("stick", 1 / StickRate, stickTick)
+	return (rcStick ())
+#--------------------------------------------------------------
+def stickTick ():
+	''' timer event, StickRate times per second while a stick moves: the sticks ramp to their targets (RcRamp % per second), 
+	the targets decay to the center (RcDecay % per second). Integer steps, precomputed by stickSteps '''
+	if ((not InputModeJoy) or InputModeString):
+		return
+	Moved = False
+	Busy = False
+	for Axis in range (0, 4):
+		if (Hold and (Axis == 2)):
+			continue
+		Target = RcTarget[Axis]
+		if ((StickDecayStep > 0) and (Target != 0)):
+			Target = max (0, Target - StickDecayStep) if (Target > 0) else min (0, Target + StickDecayStep)
+			RcTarget[Axis] = Target
+		Stick = Rc[Axis]
+		if (Stick != Target):
+			if (StickRampStep > 0):
+				Stick = min (Target, Stick + StickRampStep) if (Target > Stick) else max (Target, Stick - StickRampStep)
+			else:
+				Stick = Target
+			Rc[Axis] = Stick
+			Moved = True
+		Busy = Busy or (Stick != Target) or ((StickDecayStep > 0) and (Target != 0))
+	if (Moved):
+		Command = rcStick ()
+		if (len(Command) > 0):
+			sendCommand (Command)
+	if (Busy):
+		timerSchedule ("stick", 1 / StickRate, stickTick)
+#--------------------------------------------------------------
+def stickSteps ():
+	''' the steps of stickTick for RcRamp and RcDecay '''
+	global StickRampStep
+	global StickDecayStep
+	
+	StickRampStep = max (1, round (RcRamp / StickRate)) if (RcRamp > 0) else 0
+	StickDecayStep = max (1, round (RcDecay / StickRate)) if (RcDecay > 0) else 0
+#--------------------------------------------------------------
+def stickLines ():
+	''' expo, rate and the curve of each axis, ramp and decay '''
+	Lines = []
+	for Axis, Name in enumerate (RcAxes):
+		Lines.append (Name + ":\texpo " + str(RcExpo[Axis]) + ", rate " + str(RcRates[Axis]) + " %, stick 25/50/75/100 % -> rc " + 
+			"/".join ([str(RcCurves[Axis][Stick + 100]) for Stick in [25, 50, 75, 100]]))
+	Lines.append ("ramp " + (str(RcRamp) + " %/s" if (RcRamp > 0) else "off") + ", decay " + (str(RcDecay) + " %/s" if (RcDecay > 0) else "off"))
+	return (Lines)
+#--------------------------------------------------------------
+def holdStart (Target):
+	''' altitude hold: the vertical stick is controlled by holdTick, the pilot has the other three. Target in cm, None = the height when the first frame comes in '''
+	global Hold
+	global HoldTarget
+	global HoldFrame
+	global HoldIntegral
+	global HoldDeadline
+	
+	HoldTarget = -1 if (Target is None) else Target
+	HoldFrame = 0						# the filter starts again with the next frame, see holdFrame
+	HoldIntegral = 0
+	Hold = True
+	stateKeys ()
+	HoldDeadline = time.perf_counter()
+	timerSchedule ("hold", 0, holdTick)
+#--------------------------------------------------------------
+def holdStop ():
+	''' end the altitude hold, the vertical stick is centered '''
+	global Hold
+	
+	Hold = False
+	timerCancel ("hold")
+	Rc[2] = 0
+	RcTarget[2] = 0
+	stateKeys ()
+#--------------------------------------------------------------
+def holdFrame ():
+	''' called for every state frame while holding: update the height estimate. Complementary filter: the change of baro follows fast movements, 
+	h and tof (while it is in range) pull the estimate to the right height, which the drifting baro can't do '''
+	global HoldEstimate
+	global HoldSpeed
+	global HoldBaro
+	global HoldFrame
+	global HoldTarget
+	
+	Now = time.perf_counter()
+	try:
+		Baro = StateDict["baro"] * 100				# cm
+		Reference = float (StateDict["h"])
+		if (HoldTofGround < StateDict["tof"] < HoldTofMax):
+			Reference = (Reference + StateDict["tof"] - HoldTofGround) / 2
+	except TypeError:							# not decoded (yet)
+		return
+	if (HoldFrame == 0):
+		Estimate = Reference
+		HoldSpeed = 0
+		if (HoldTarget < 0):
+			HoldTarget = round (Reference)
+			debug (2, "hold at " + str(HoldTarget) + " cm")
+	else:
+		Estimate = HoldAlpha * (HoldEstimate + Baro - HoldBaro) + (1 - HoldAlpha) * Reference
+		if (Now > HoldFrame):
+			HoldSpeed = HoldSpeed + ((Estimate - HoldEstimate) / (Now - HoldFrame) - HoldSpeed) / 2
+	HoldEstimate = Estimate
+	HoldBaro = Baro
+	HoldFrame = Now
+#--------------------------------------------------------------
+def holdTick ():
+	''' timer event: the PID controller of the altitude hold, HoldRate times per second on a fixed grid (a late tick doesn't shift the next one). 
+	The grid is locked to just after the state frames, so the estimate is fresh. Sends the sticks at once and measures the latency from the 
+	state frame used to the rc command. A stale estimate centers the vertical stick '''
+	global HoldDeadline
+	global HoldIntegral
+	global HoldUsed
+	global RcSent
+	global RcSentTime
+	
+	if ((not Hold) or (not InputModeJoy) or InputModeString):
+		return
+	Now = time.perf_counter()
+	Period = 1 / HoldRate
+	Late = Now - HoldDeadline
+	Frame = HoldFrame
+	HoldDeadline = HoldDeadline + Period
+	if ((Frame > HoldUsed) and (Period / 2 < Now - Frame < Period)):		# the grid has drifted away from the frames, move it to just after them
+		HoldDeadline = Frame + Period + HoldPhase
+	if (HoldDeadline <= Now):					# more than a period late, skip the ticks missed
+		HoldDeadline = Now + Period
+	timerSchedule ("hold", HoldDeadline - Now, holdTick)
+	HoldUsed = Frame
+	
+	if ((Frame == 0) or (HoldTarget < 0) or (Now - Frame > HoldStale)):
+		HoldStats[5] += 1
+		HoldIntegral = 0
+		Output = 0
+	else:
+		Kp, Ki, Kd = HoldGains
+		Error = HoldTarget - HoldEstimate
+		if (Ki > 0):							# anti-windup: the integral alone never asks for more than HoldMax
+			HoldIntegral = max (-HoldMax / Ki, min (HoldMax / Ki, HoldIntegral + Error * Period))
+		Output = Kp * Error + Ki * HoldIntegral - Kd * HoldSpeed
+	Rc[2] = round (max (-HoldMax, min (HoldMax, Output)))
+	Command = rcSticks ()
+	sendCommand (Command)
+	RcSent = Command							# the rc stream only sends what the pilot changes in between
+	RcSentTime = time.perf_counter()
+	
+	if (Frame > 0):
+		Latency = RcSentTime - Frame
+		HoldStats[0] += 1
+		HoldStats[1] += Latency
+		HoldStats[2] = max (HoldStats[2], Latency)
+	HoldStats[3] += abs (Late)
+	HoldStats[4] = max (HoldStats[4], abs (Late))
+	HoldStats[6] += 1
+#--------------------------------------------------------------
+def holdLines ():
+	''' state of the altitude hold, latency from state frame to rc command and jitter of the control loop '''
+	Lines = ["hold " + ("on" if Hold else "off") + ": target " + str(HoldTarget) + " cm, estimate " + str(round (HoldEstimate, 1)) + " cm, speed " + 
+		str(round (HoldSpeed, 1)) + " cm/s, stick " + str(Rc[2]) + ", pid " + " ".join ([str(Gain) for Gain in HoldGains])]
+	if (HoldStats[6] > 0):
+		Lines.append ("hold loop: " + str(HoldStats[6]) + " ticks at " + str(HoldRate) + " Hz, jitter mean " + str(round (HoldStats[3] / HoldStats[6] * 1000, 3)) + 
+			" ms, max " + str(round (HoldStats[4] * 1000, 3)) + " ms, " + str(HoldStats[5]) + " without a fresh estimate")
+	if (HoldStats[0] > 0):
+		Lines.append ("hold latency state frame to rc: mean " + str(round (HoldStats[1] / HoldStats[0] * 1000, 3)) + " ms, max " + 
+			str(round (HoldStats[2] * 1000, 3)) + " ms")
+	return (Lines)
+
+#-----------------------------------------------------------------------------------
+
+'''global variables'''
+Running = True
+# DataDecoded = ""
+# StateDecoded = ""
+IpAddress = '192.168.10.1'
+host = ''
+SockBasic = None
+SockState = None
+SockVideo = None				# video stream, see videoStart
+VideoPort = 11111
+VideoThread = None
+VideoCapacity = 4 * 1024 * 1024	# bytes of the NAL ring (--videobuffer)
+VideoRing = None				# bytearray, packets are received into it, NALs are handed out as memoryviews of it, see videoReceived
+VideoView = None
+VideoWrite = 0					# where the next packet is received to
+VideoLap = 0					# counts how often VideoWrite has gone back to the start of the ring, see videoValid
+VideoLock = threading.Lock()	# VideoWrite and VideoLap change, or the ring is compacted, see videoSpace and videoSinkWriter
+VideoNalStart = 0				# start of the NAL which is being received
+VideoNalType = -1				# where its type is, -1 = no start code found yet
+VideoSearch = 0					# where to look for the next start code
+VideoPacketMax = 2048			# room for one packet
+VideoPacketFull = 1460			# the size of all but the last packet of a NAL
+VideoLastFull = False
+VideoSubscribers = []			# callbacks, see videoSubscribe
+VideoSinks = {}					# name: writer of the stream ("record" and "play"), see videoSinkStart
+VideoIndexMagic = b'TELLVIX1'	# the keyframe index of a video recording starts with this, followed by the length of a json header (uint32)
+VideoIndexFormat = '<dQ'		# a record of the index: time received, byte offset of the keyframe in the video file
+VideoIndexExtension = '.idx'	# flight.h264 -> flight.h264.idx
+VideoKeyframe = [0, 0]			# time of the last keyframe, sum of the intervals
+VideoStatsLast = [0, 0, 0]		# time, bytes and frames of the last videoLines
+VideoPlayer = ["ffplay", "-loglevel", "error", "-fflags", "nobuffer", "-flags", "low_delay", "-framedrop", "-window_title", "tellTello Video Window", 
+	"-f", "h264", "-i", "-"]	# default player of the video command
+TransportBasic = None		# replaces SockBasic in the asyncio engine
+Swarm = []					# one dict per Tello in swarm mode, see swarmStart
+SwarmIndex = {}				# ip address: Tello of the swarm
+SwarmWatch = 1				# number of the Tello whose state frames are watched, logged and recorded
+TelloReady = True
+NumFrames = 0
+CommandLanes = {"emergency": collections.deque(), "normal": collections.deque(), "low": collections.deque()}	# lanes of the command queue, entries are (message, time queued), see commandQueue
+CommandRc = None				# (rc command, time queued) of the rc lane, which has room for the latest one only
+CommandStats = {"emergency": [0, 0, 0, 0], "rc": [0, 0, 0, 0], "normal": [0, 0, 0, 0], "low": [0, 0, 0, 0]}		# lane: [taken, sum of waiting times, max waiting time, max depth]
+CommandLock = threading.Lock()
+CommandCurrent = None			# (lane, time queued) of the message processMessage is working on
+KeepalivePeriod = 10			# Tello lands after 15 seconds without a command
+LastSent = 0					# time.perf_counter() when the last command was sent
+QueryTtl = {"battery?": 10, "temp?": 10, "time?": 1, "height?": 1, "tof?": 1, "baro?": 1, "attitude?": 1, "acceleration?": 1, 
+	"wifi?": 10, "speed?": 3600, "sdk?": 86400, "sn?": 86400}	# seconds an answer is used instead of asking Tello, see queryAnswer
+QueryState = {"battery?": (["bat"], "{}"), "temp?": (["templ", "temph"], "{}~{}C"), "time?": (["time"], "{}s"), "height?": (["h"], lambda Height: str(int(Height / 10)) + "dm"), 
+	"tof?": (["tof"], lambda Tof: str(int(Tof * 10)) + "mm"), "baro?": (["baro"], "{}"), "attitude?": (["pitch", "roll", "yaw"], "pitch:{};roll:{};yaw:{};"), 
+	"acceleration?": (["agx", "agy", "agz"], "agx:{};agy:{};agz:{};")}	# query: (state keys, format of the answer or a function of the values), answered from the state frames.
+								# Tello answers in its own units: height? in dm, tof? in mm, while the state frames have cm
+QueryCache = {}					# query: (answer, time.perf_counter()) of Tello's last answer
+QueryChanges = {"speed": ["speed?"], "wifi": ["wifi?"], "ap": ["wifi?"]}	# commands which change the answers of queries
+QueryKeepalive = ["wifi?", "battery?", "temp?"]		# queries the keepalive chooses from, see keepaliveQuery
+QueryServed = 0					# queries answered from the cache
+TimerQueue = []				# heap of (deadline, name), see timerSchedule
+TimerEvents = {}			# name: (deadline, callback) of the pending timer events
+TimerCondition = threading.Condition()
+AsyncLoop = None			# event loop of the asyncio engine, None for the threaded engine
+AsyncTimerEvent = None		# set when the timer heap has changed
+AsyncMainEvent = None		# set when mainAsync has something to do
+MainSelector = None			# the threaded engine's main loop waits on it for keys and wakeMain, see mainWait
+WakeReader = None			# socket pair, wakeMain writes a byte to wake up the threaded engine
+WakeWriter = None
+Offline = True
+StateDict = {"mid":-1,"x":0,"y":0,"z":0,"mpry":"0,0,0","pitch":0,"roll":0,"yaw":0,"vgx":0,"vgy":0,"vgz":0,"templ":53,"temph":55,"tof":10,"h":0,"bat":72,"baro":-70.56,"time":0,"agx":-2.00,"agy":-10.00,"agz":-999.00}
+StateTypes = {"mpry":stateText,"baro":float,"agx":float,"agy":float,"agz":float}		# type of the values in the state string, int if not listed
+StateAlways = ["bat", "temph", "templ", "time"]		# keys which are decoded even if they are not watched
+StateParse = []					# (key, b';key:', type) of the keys to decode, see stateKeys
+StateWanted = {}				# b'key': (key, type), the same for decoding by splitting
+StateDecoded = set()			# the keys which are decoded
+StateLayout = (None, [])		# (keys of the frame, [(names, picker, type)]) for decoding all keys, see stateLayout
+StateInts = StateNumbers()		# bytes: int, the values seen so far
+StateIntsMax = 10000			# StateInts is emptied when it gets bigger
+StateScanMax = 8				# up to this number of keys, interpreteState searches them instead of splitting the frame
+StateBuffer = bytearray(b';' + bytes(1518))	# the leading separator lets interpreteState search for b';key:' even for the first key
+StateView = memoryview(StateBuffer)
+StateDummy = "mid:-1;x:0;y:0;z:0;mpry:0,0,0;pitch:-1;roll:0;yaw:0;vgx:0;vgy:0;vgz:0;templ:51;temph:54;tof:10;h:0;bat:88;baro:38.28;time:0;agx:-13.00;agy:-5.00;agz:-998.00;"
+WhichWatch = []
 OldWhichWatch = []
+WatchFunctions = {"sqrt": math.sqrt, "hypot": math.hypot, "atan2": math.atan2, "degrees": math.degrees, "radians": math.radians, "sin": math.sin, 
+	"cos": math.cos, "exp": math.exp, "log": math.log, "abs": abs, "min": min, "max": max, "round": round, "pi": math.pi}	# what watch expressions may use besides state keys
+WatchNodes = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.IfExp, ast.Call, ast.Name, ast.Constant, ast.Load, 
+	ast.operator, ast.unaryop, ast.boolop, ast.cmpop)		# the syntax of watch expressions: arithmetic, comparisons, calls of WatchFunctions
+WatchDerived = {}				# watch item: (column name, None or (function, keys)), see watchItem
+WhenRules = []					# rules of the when command, see whenAdd
+WhenIndex = {}					# state key: (sorted numbers of the rules like bat<20, these rules, other rules using the key), see whenIndex
+WhenPending = []				# rules which have not been checked yet
+WhenActions = collections.deque()	# (command, time fired) of rules, taken before the FIFO lane, also while sleeping
+WhenLast = {}					# state key: its value when whenFrame has seen it last
+WhenLock = threading.Lock()
+WhenNext = 1					# number of the next rule
+WhenStats = [0, 0, 0]			# frames, rules checked, rules fired
+WhenOperators = {ast.Lt: "<", ast.LtE: "<=", ast.Gt: ">", ast.GtE: ">=", ast.Eq: "==", ast.NotEq: "!="}
+WhenMirrored = {"<": ">", "<=": ">=", ">": "<", ">=": "<="}
+WatchCapacity = 36000			# rows of the telemetry ring, one hour at 10 frames per second. The ring is allocated by watchInit
+WatchMissing = {array.array: math.nan, list: None}		# stored by watchState when a watched key is missing
+WatchTotal = 0					# number of watch rows stored so far, row n is at index n % WatchCapacity
+CsvDelimiter = ';'
+CsvDecimal = ','
+LogFileName = ''				# see logStart
+LogFile = None
+LogThread = None
+LogRunning = False
+LogEvent = threading.Event()	# wakes logWriter before LogFlush has expired
+LogFlush = 1					# seconds between two writes to the log file
+LogSize = 0						# rotate the log when it has grown to this number of bytes, 0 = never
+LogTime = 0						# rotate the log after this number of seconds, 0 = never
+LogNext = 0						# number of the next watch row to write
+LogSet = -1						# watch set of the last row written, a new one needs a header
+LogOpened = 0
+LogLost = 0						# rows which were overwritten in the ring before logWriter got them
+Replaying = False				# see recvStateReplay
+ReplayPeriod = 0.1				# time between raw state strings
+WatchEcho = True				# print the watched values to the console
+Recording = False				# see recorderStart
+RecorderMagic = b'TELLREC1'		# a recording starts with this, followed by the length of a json header (uint32)
+RecorderHead = '<dB3xI'			# a record: time, type, length of the text, then one float per field (or the text)
+RecordState = 0					# types of records
+RecordCommand = 1
+RecordAnswer = 2
+RecordMore = 3					# the rest of a command or answer which is longer than the floats of a record
+RecorderBlockSize = 1024		# records per block, i.e. per write and per compressed unit
+RecorderFileName = ''
+RecorderFile = None
+RecorderFields = []				# the keys of StateDict which are recorded
+RecorderGetter = None
+RecorderFormat = ''
+RecorderTextFormat = ''
+RecorderSize = 0
+RecorderCompress = False
+RecorderBlock = None
+RecorderCount = 0				# records in RecorderBlock
+RecorderLock = threading.Lock()
+RecorderQueue = queue.Queue()	# full blocks for recorderWriter
+RecorderThread = None
+CommandCount = 0				# number of commands sent so far
+CommandLog = ['']				# the last commands, CommandLog[CommandCount % len(CommandLog)] is the last one
+InFlight = []					# [command, keyword, time sent, deadline, retries] of the commands waiting for an answer, oldest first
+InFlightLock = threading.Lock()
+AnswerTimeouts = {"?": (1, 2), "command": (2, 2), "speed": (2, 2), "streamon": (2, 2), "streamoff": (2, 2), "mon": (2, 2), "moff": (2, 2),
+	"emergency": (1, 3), "stop": (2, 2), "takeoff": (20, 0), "land": (20, 0), "": (15, 0)}	# keyword: (seconds to wait for the answer, retries). "?" = all queries, "" = all others. Moves are never repeated
+MoveSpeed = 100					# cm/s of forward, up ..., set by speed and speed?, see answerTime
+TurnSpeed = 30					# degrees/s of cw and ccw, slower than Tello turns
+MoveMargin = 2					# a move may take this many times as long as it should before its answer is given up
+RttStats = {}					# keyword: [answers, sum of the round trip times, max, timeouts, retries]
+RttRecent = array.array ('d', [0]) * 1000		# the last round trip times, RttRecent[RttTotal % 1000] is the next one
+RttTotal = 0
+StatFrames = 0					# indexes of StatsCount
+StatFrameBytes = 1
+StatAnswers = 2
+StatAnswerBytes = 3
+StatSent = 4
+StatSentBytes = 5
+StatGaps = 6
+StatLate = 7
+StatVideoPackets = 8
+StatVideoBytes = 9
+StatVideoNals = 10
+StatVideoFrames = 11
+StatVideoKeyframes = 12
+StatVideoLost = 13
+StatsCount = array.array ('Q', [0]) * 14	# counters, each one is written by one thread only (except the sent ones), so they need no lock
+StatsBuckets = [5, 10, 20, 50, 90, 110, 150, 250, 500, 1000]	# ms, upper limits of the buckets of the inter-arrival histogram
+StatsHistogram = array.array ('Q', [0]) * (len(StatsBuckets) + 1)
+StatsArrival = [0, 0, 0, -1]		# time.perf_counter() of the last frame, last inter-arrival time, jitter (s), last value of the time field
+StatsLast = [time.perf_counter(), 0]	# time and frame count of the last statsPrint
+StatsPeriod = 0					# print the statistics every StatsPeriod seconds, 0 = never
+ThreadCpu = {}					# thread name: cpu time in seconds, written by each thread
+Profilers = {}					# thread name: cProfile.Profile, see profileCheck
+ProfileOn = False
+ProfileGeneration = 0			# counts profile start and stop, so the threads see that they have to follow
+ProfileSeen = {}				# thread name: the generation the thread has followed
+ProfileFile = 'tellTello.prof'	# default file for profile dump and --profile
 WatchPeriod = -1
 DebugLevel = 3
 tello_address = ('', 0)
 LastCommand = ""
 SleepTime = -1
 TelloInfo = {"sdk":-1,"bat":-1,"temp":-1,"wifi":-1}
-Watchlist = []
+Rc = [0,0,0,0]				# simulated joystick in joy mode: stick positions -100 .. 100
+RcTarget = [0,0,0,0]		# where the keys have put the sticks, Rc ramps to it (see stickTick)
+RcOut = [0,0,0,0]			# the rc values sent, from the curves (see rcSticks)
+RcAxes = ["roll", "pitch", "throttle", "yaw"]	# names of the axes, in the order of the rc command
+RcExpo = [0, 0, 0, 0]		# expo of each axis, 0 = linear .. 1 = cubic
+RcRates = [100, 100, 100, 100]	# rc value at full stick, per axis
+RcCurves = [rcCurve (0, 100) for Axis in RcAxes]	# lookup tables: stick + 100: rc value, see rcCurve
+RcRamp = 0					# % per second the sticks move towards their targets, 0 = at once
+RcDecay = 0					# % per second the sticks return to the center, 0 = they stay
+StickRate = 50				# stickTick runs this often while a stick ramps or decays
+StickRampStep = 0			# RcRamp and RcDecay per tick, see stickSteps
+StickDecayStep = 0
+RcRate = 20					# rc commands per second in joy mode, 0 = send each change at once
+RcRefresh = 1				# seconds between two rc commands if the sticks don't move
+RcRepeat = 10				# unchanged sticks are sent this often, unless a state frame shows them earlier
+RcSent = ''					# the last rc command of the rc stream
+RcSentTime = 0				# time.perf_counter() when it was sent
+RcConfirmed = True			# Tello does what RcSent says, see rcEcho
+RcRepeats = 0
+RcYaw = 0
+RcEchoKeys = ["vgx", "vgy", "vgz", "yaw"]	# state keys rcEcho needs
+Hold = False				# altitude hold in joy mode, see holdTick
+HoldTarget = -1				# cm, -1 = the height when the hold starts
+HoldRate = 10				# PID steps (and rc commands) per second while holding
+HoldGains = [0.8, 0.1, 0.5]	# PID gains: stick % per cm, per cm*s, per cm/s
+HoldMax = 60				# the hold uses at most this much of the vertical stick
+HoldAlpha = 0.8				# weight of the baro in the height estimate, see holdFrame
+HoldTofGround = 10			# tof on the ground (cm)
+HoldTofMax = 300			# tof above this is not trusted
+HoldStale = 0.5				# seconds: an older estimate is not used, the vertical stick is centered
+HoldKeys = ["baro", "tof", "h"]	# state keys holdFrame needs
+HoldEstimate = 0			# height in cm
+HoldSpeed = 0				# cm/s, up is positive
+HoldBaro = 0				# baro of the last frame, cm
+HoldFrame = 0				# time.perf_counter() of the last frame, 0 = none yet
+HoldIntegral = 0
+HoldDeadline = 0			# time.perf_counter() when holdTick is due
+HoldPhase = 0.005			# seconds between a state frame and the tick after it
+HoldUsed = 0				# HoldFrame of the last tick
+HoldStats = [0, 0, 0, 0, 0, 0, 0]	# ticks with a frame, sum and max of their latency, sum and max of the jitter, ticks without a fresh estimate, all ticks
+InputModeString = True
+InputModeJoy    = False
+Dist = 40
+Angle = 90
+Parser = None
+InputTime = 0				# time.perf_counter() of the last user input which has not been sent yet
+InputSource = "string"		# where it came from: "string" or "key"
+InputLines = collections.deque()	# lines read by inputReader for the threaded engine
+InputLatency = {"string": [0, 0, 0], "key": [0, 0, 0]}	# source: count, sum and max of the latency from user input to UDP send
+KeyMoves = {"up": (2, 1, "dist"), "down": (2, -1, "dist"), "forward": (1, 1, "dist"), "back": (1, -1, "dist"), 
+	"left": (0, -1, "dist"), "right": (0, 1, "dist"), "cw": (3, 1, "ang"), "ccw": (3, -1, "ang")}		# direction: (rc stick, sign, dist or ang), see keyMove
+KeyNames = {3: "ctrl-c", 8: "backspace", 9: "tab", 10: "enter", 13: "enter", 27: "esc", 32: "space", 127: "backspace",		# key code or (prefix, key code) as returned by msvcrt.getch: name, see keyName
+	(224, 72): "up", (224, 80): "down", (224, 75): "left", (224, 77): "right", (224, 71): "home", (224, 79): "end", (224, 73): "pgup", (224, 81): "pgdn", 
+	(224, 82): "insert", (224, 83): "delete", (224, 133): "f11", (224, 134): "f12", (224, 135): "shift-f11", (224, 136): "shift-f12",
+	(224, 141): "ctrl-up", (224, 145): "ctrl-down", (224, 115): "ctrl-left", (224, 116): "ctrl-right"}
+KeyShifted = ["up", "down", "left", "right"]	# keys whose shift- names keyName finds by the state of the shift key (Windows)
+for Number in range (0, 10):
+	KeyNames[(0, 59 + Number)] = "f" + str(Number + 1)
+	KeyNames[(0, 84 + Number)] = "shift-f" + str(Number + 1)
+KeySequences = {b"\x1bOP": "f1", b"\x1bOQ": "f2", b"\x1bOR": "f3", b"\x1bOS": "f4", b"\x1b[11~": "f1", b"\x1b[12~": "f2", b"\x1b[13~": "f3", b"\x1b[14~": "f4",
+	b"\x1b[H": "home", b"\x1b[F": "end", b"\x1bOH": "home", b"\x1bOF": "end", b"\x1b[1~": "home", b"\x1b[4~": "end", b"\x1b[2~": "insert", b"\x1b[3~": "delete", 
+	b"\x1b[5~": "pgup", b"\x1b[6~": "pgdn", b"\x1b[[A": "f1", b"\x1b[[B": "f2", b"\x1b[[C": "f3", b"\x1b[[D": "f4", b"\x1b[[E": "f5"}	# escape sequence of a terminal: key name, see keysDecode
+for Letter, Name in [("A", "up"), ("B", "down"), ("C", "right"), ("D", "left")]:
+	KeySequences[b"\x1b[" + Letter.encode()] = Name
+	KeySequences[b"\x1bO" + Letter.encode()] = Name
+	KeySequences[b"\x1b[1;2" + Letter.encode()] = "shift-" + Name
+	KeySequences[b"\x1b[1;5" + Letter.encode()] = "ctrl-" + Name
+for Number, Code in enumerate ([15, 17, 18, 19, 20, 21, 23, 24]):
+	KeySequences[b"\x1b[" + str(Code).encode() + b"~"] = "f" + str(Number + 5)
+	KeySequences[b"\x1b[" + str(Code).encode() + b";2~"] = "shift-f" + str(Number + 5)
+for Number, Letter in enumerate ("PQRS"):
+	KeySequences[b"\x1b[1;2" + Letter.encode()] = "shift-f" + str(Number + 1)
+KeySequenceMax = max ([len(Sequence) for Sequence in KeySequences])
+KeyboardFd = -1				# file descriptor of the terminal while it is in key mode (not on Windows), see keyboardStart
+KeyboardSaved = None		# terminal settings to restore
+KeyBindingsDefault = """
+c command
+t takeoff
+l land
+p emergency			# the PANIC! button ... the emergency lane sends it immediately (doesn't wait for TelloReady)
+w move up
+8 move up
+s move down
+2 move down
+a move ccw
+4 move ccw
+d move cw
+6 move cw
+up move forward
+down move back
+left move left
+right move right
+W move up 2			# shift: double dist or angle, 20% stick in joy mode
+S move down 2
+A move ccw 2
+D move cw 2
+shift-up move forward 2
+shift-down move back 2
+shift-left move left 2
+shift-right move right 2
+5 halt
+h halt
+H halt
+space halt
+- scale dist 0.5
++ scale dist 2
+/ scale ang 0.5
+* scale ang 2
+? help
+f1 help
+f2 state 1
+ctrl-c end			# end tellTello cleanly, also in key and joy mode
+v video
+j mode joy
+k mode key
+esc mode string
+"""
+KeyTable = {}					# key name: (function, arguments), see keyBind
+KeyPollPeriod = 0.01		# the Windows console is checked this often in key or joy mode
+
+#--------------------------------------------------------------------------
+Cm = (int, 20, 500)				# argument types for ScriptKeywords
+Xyz = (int, -500, 500)
+Stick = (int, -100, 100)
+ScriptKeywords = {				# keyword: (min number of arguments, max number (-1 = any), types of the arguments), see scriptCheck
+	"command": (0, 0, []), "takeoff": (0, 0, []), "land": (0, 0, []), "streamon": (0, 0, []), "streamoff": (0, 0, []), 
+	"emergency": (0, 0, []), "stop": (0, 0, []), "mon": (0, 0, []), "moff": (0, 0, []),
+	"up": (1, 1, [Cm]), "down": (1, 1, [Cm]), "left": (1, 1, [Cm]), "right": (1, 1, [Cm]), "forward": (1, 1, [Cm]), "back": (1, 1, [Cm]), 
+	"cw": (1, 1, [(int, 1, 3600)]), "ccw": (1, 1, [(int, 1, 3600)]), "flip": (1, 1, ["l|r|f|b"]), 
+	"go": (4, 5, [Xyz, Xyz, Xyz, (int, 10, 100), None]), "curve": (7, 8, [Xyz, Xyz, Xyz, Xyz, Xyz, Xyz, (int, 10, 60), None]),
+	"jump": (7, 7, [Xyz, Xyz, Xyz, (int, 10, 100), (int, 0, 360), None, None]),
+	"speed": (1, 1, [(int, 10, 100)]), "rc": (4, 4, [Stick, Stick, Stick, Stick]), "wifi": (2, 2, []), "ap": (2, 2, []), "mdirection": (1, 1, [(int, 0, 2)]),
+	"speed?": (0, 0, []), "battery?": (0, 0, []), "time?": (0, 0, []), "wifi?": (0, 0, []), "sdk?": (0, 0, []), "sn?": (0, 0, []), "height?": (0, 0, []), 
+	"temp?": (0, 0, []), "attitude?": (0, 0, []), "baro?": (0, 0, []), "acceleration?": (0, 0, []), "tof?": (0, 0, []),
+	"end": (0, 0, []), "help": (0, 0, []), "h": (0, 0, []), "?": (0, 0, []), "e": (0, 0, []), "health": (0, 0, []), "rtt": (0, 0, []), "queue": (0, 0, []), 
+	"profile": (0, 2, ["start|stop|dump", None]), "stats": (0, 1, [(float, 0, 86400)]), "swarm": (0, 2, ["watch", (int, 1, 1000)]), "rcrate": (0, 1, [(float, 0, 1000)]),
+	"expo": (1, 2, [(float, 0, 1), "|".join (RcAxes)]), "rate": (1, 2, [(float, 10, 100), "|".join (RcAxes)]), "ramp": (0, 1, [(float, 0, 10000)]), "decay": (0, 1, [(float, 0, 10000)]),
+	"state": (0, 1, [(int, 0, 1000000)]), "dist": (1, 1, [Cm]), "ang": (1, 1, [(int, 1, 3600)]), "key": (0, 0, []), "joy": (0, 0, []), "ready": (0, 0, []),
+	"hold": (0, 4, ["on|off|pid", (float, 0, 500), (float, 0, 500), (float, 0, 500)]),
+	"watch": (0, -1, []), "when": (0, -1, []), "watchperiod": (0, 1, [(float, -1, 86400)]), "wp": (0, 1, [(float, -1, 86400)]), "ww": (0, 0, []), "wc": (0, 0, []), 
+	"record": (0, 2, [None, "z"]), "replay": (1, 2, [None, (float, 0, 1000)]), "log": (0, 1, []), "sleep": (1, 1, [(float, 0, 86400)]), 
+	"debug": (0, 1, [(int, 0, 10)]), "oscommand": (1, -1, []), "video": (0, -1, ["on|off|play|record|stats"]), "script": (1, 1, []), "keys": (0, 1, []),
+	}
+ScriptDepthMax = 8				# includes in includes ...
+ScriptChecked = {}				# command: error message of scriptCheck, while scriptRead compiles a script
 
 #--------------------------------------------------------------
-def main():
-	''' the main program of tellTello '''
+def keyName (Char1, Char2):
+	''' the name of a key (as returned by msvcrt.getch) like "w", "W", "up", "shift-up", "f1" or "esc", see KeyNames '''
+	if (Char1[0] in [0, 224]):				# arrow keys, function keys ...
+		Name = KeyNames.get ((Char1[0], Char2[0] if (len(Char2) > 0) else -1), '')
+		if ((Name in KeyShifted) and (ctypes.windll.user32.GetKeyState (0x10) < 0)):		# VK_SHIFT is down, getch gives the same code as without
+			Name = "shift-" + Name
+		return (Name)
+	return (KeyNames.get (Char1[0], chr(Char1[0])))
+#--------------------------------------------------------------
+def keyCommand (Name):
+	''' translate a key (see keyName and keysDecode) into a message, see KeyTable. Returns an empty message if there is nothing to do '''
+	Binding = KeyTable.get (Name)
+	if (Binding is None):
+		debug (3, "key " + Name + " is not bound")
+		return ('')
+	msg = Binding[0] (*Binding[1])
+	debug (4, "---" + msg)
+	return (msg)
+#--------------------------------------------------------------
+def keysDecode (Data):
+	''' the names of the keys in Data, as read from a terminal: escape sequences of arrow and function keys or single characters. 
+	An ESC which does not start a known sequence is the ESC key '''
+	Names = []
+	Position = 0
+	while (Position < len(Data)):
+		Name = ''
+		if ((Data[Position] == 27) and (Position + 1 < len(Data))):
+			for Length in range (min (KeySequenceMax, len(Data) - Position), 1, -1):
+				Name = KeySequences.get (Data[Position:Position + Length], '')
+				if (Name != ''):
+					Position = Position + Length
+					break
+			if ((Name == '') and (Data[Position + 1] in b"[O")):		# unknown sequence, skip it up to its final character
+				End = Position + 2
+				while ((End < len(Data)) and not (0x40 <= Data[End] <= 0x7e)):
+					End = End + 1
+				debug (3, "unknown key " + repr (Data[Position:End + 1]))
+				Position = End + 1
+				continue
+		if (Name == ''):
+			Name = KeyNames.get (Data[Position], chr(Data[Position]))
+			Position = Position + 1
+		Names.append (Name)
+	return (Names)
+#--------------------------------------------------------------
+def keysInput (Names):
+	''' put the commands of the keys Names into the command queue '''
+	global InputTime
+	global InputSource
+	for Name in Names:
+		InputTime = time.perf_counter()
+		InputSource = "key"
+		commandQueue (keyCommand (Name))
+#--------------------------------------------------------------
+def keyboardStart ():
+	''' key and joy mode on a terminal (not on Windows): switch off line buffering, echo and ctrl-C (it is a key now), let the main loop wait for keys '''
+	global KeyboardFd
+	global KeyboardSaved
+	
+	KeyboardFd = sys.stdin.fileno()
+	if (os.isatty (KeyboardFd)):
+		KeyboardSaved = termios.tcgetattr (KeyboardFd)
+		Settings = termios.tcgetattr (KeyboardFd)
+		Settings[3] = Settings[3] & ~(termios.ICANON | termios.ECHO | termios.ISIG)
+		Settings[6][termios.VMIN] = 1
+		Settings[6][termios.VTIME] = 0
+		termios.tcsetattr (KeyboardFd, termios.TCSANOW, Settings)
+	if (AsyncLoop is not None):
+		AsyncLoop.add_reader (KeyboardFd, keyboardReady)
+	elif (MainSelector is not None):
+		MainSelector.register (KeyboardFd, selectors.EVENT_READ, keyboardReady)
+#--------------------------------------------------------------
+def keyboardStop ():
+	''' back to string input: restore the terminal settings '''
+	global KeyboardFd
+	global KeyboardSaved
+	
+	if (KeyboardFd < 0):
+		return
+	if (AsyncLoop is not None):
+		AsyncLoop.remove_reader (KeyboardFd)
+	elif (MainSelector is not None):
+		MainSelector.unregister (KeyboardFd)
+	if (KeyboardSaved is not None):
+		termios.tcsetattr (KeyboardFd, termios.TCSADRAIN, KeyboardSaved)
+	KeyboardFd = -1
+	KeyboardSaved = None
+#--------------------------------------------------------------
+def keyboardMode ():
+	''' follow the input mode: raw keys for key and joy mode, lines for string input (terminals only, msvcrt reads keys without this) '''
+	if ((msvcrt is None) and (InputModeString == (KeyboardFd >= 0))):
+		if (InputModeString):
+			keyboardStop ()
+		else:
+			keyboardStart ()
+#--------------------------------------------------------------
+def keyboardReady ():
+	''' keys have arrived on the terminal '''
+	try:
+		Data = os.read (KeyboardFd, 64)
+	except OSError:
+		Data = b''
+	if (len(Data) == 0):			# end of input
+		keyboardStop ()
+		commandQueue ("end")
+		return
+	keysInput (keysDecode (Data))
+	if (AsyncMainEvent is not None):
+		AsyncMainEvent.set()
+#--------------------------------------------------------------
+def keysWindows ():
+	''' read the keys which have been pressed from the Windows console (msvcrt), put their commands into the command queue '''
+	while (msvcrt.kbhit()):
+		Char1 = msvcrt.getch()
+		Char2 = ''
+		if ((Char1[0] in [0, 224]) and msvcrt.kbhit()):			# second character when an arrow key, a function key ... is pressed
+			Char2 = msvcrt.getch()
+		keysInput ([keyName (Char1, Char2)])
+#--------------------------------------------------------------
+def mainWait (Timeout):
+	''' threaded engine: wait until a key arrives, wakeMain is called or Timeout (None = no timeout) has passed '''
+	for Key, Mask in MainSelector.select (Timeout):
+		if (Key.fileobj is WakeReader):
+			try:
+				while (len (WakeReader.recv (4096)) > 0):
+					pass
+			except BlockingIOError:
+				pass
+		else:
+			Key.data ()
+#--------------------------------------------------------------
+def keySend (msg):
+	''' key action: a command like "takeoff" or "flip f" '''
+	return (msg)
+#--------------------------------------------------------------
+def keyMove (Direction, Factor = 1):
+	''' key action "move direction [factor]": move Dist (or turn Angle) * Factor in key mode, move the simulated stick by Factor * 10% in joy mode 
+	(up and down move the target of the altitude hold by Factor * 10 cm instead) '''
+	global HoldTarget
+	Axis, Sign, Unit = KeyMoves[Direction]
+	if (InputModeJoy and Hold and (Axis == 2) and (HoldTarget >= 0)):		# the hold has the vertical stick, up and down move its target
+		HoldTarget = max (20, HoldTarget + round (Sign * 10 * Factor))
+		debug (3, "hold at " + str(HoldTarget) + " cm")
+		return ('')
+	if (InputModeJoy):
+		return (rcMove (Axis, round (Sign * 10 * Factor)))
+	if (Unit == "dist"):
+		return (Direction + ' ' + str (max (20, min (500, round (Dist * Factor)))))
+	return (Direction + ' ' + str (max (1, min (3600, round (Angle * Factor)))))
+#--------------------------------------------------------------
+def keyHalt ():
+	''' key action "halt": stop and hover '''
+	if (InputModeJoy):
+		rcCenter ()
+		return (rcStick ())
+	return ('stop')
+#--------------------------------------------------------------
+def keyScale (What, Factor):
+	''' key action "scale dist|ang factor": multiply Dist or Angle by factor '''
+	global Dist
+	global Angle
+	if (What == "dist"):
+		Dist = max (20, min (500, round (Dist * Factor)))
+		return ("dist " + str(Dist))
+	Angle = max (5, min (3600, round (Angle * Factor)))
+	return ("ang " + str(Angle))
+#--------------------------------------------------------------
+def keyMode (Mode):
+	''' key action "mode joy|key|string": switch the input mode '''
+	global InputModeString
+	global InputModeJoy
+	InputModeString = (Mode == "string")
+	InputModeJoy    = (Mode == "joy")
+	if (InputModeJoy):
+		rcStart ()
+	else:
+		rcStop ()
+	debug (2, Mode + " mode")
+	return ('')
+#--------------------------------------------------------------
+KeyActions = {					# action: (function, types of the arguments (choices or a conversion), number of arguments needed), see keyBind
+	"move": (keyMove, ["|".join (KeyMoves), float], 1), "halt": (keyHalt, [], 0), "scale": (keyScale, ["dist|ang", float], 2), "mode": (keyMode, ["joy|key|string"], 1),
+	}
+#--------------------------------------------------------------
+def keyBind (Name, Action):
+	''' bind key Name to Action (see KeyActions, anything else is a command), "none" removes the binding. Returns an error message, '' if fine '''
+	Words = Action.split()
+	if (len(Words) == 0):
+		return ("no action for key " + Name)
+	if (Words == ["none"]):
+		KeyTable.pop (Name, None)
+		return ('')
+	if (Words[0] not in KeyActions):
+		Error = scriptCheck (Words)
+		if (Error == ''):
+			KeyTable[Name] = (keySend, (" ".join (Words),))
+		return (Error)
+	Function, Types, Needed = KeyActions[Words[0]]
+	Args = Words[1:]
+	if ((len(Args) < Needed) or (len(Args) > len(Types))):
+		return (Words[0] + ": wrong number of arguments")
+	Values = []
+	for Arg, Type in zip (Args, Types):
+		if (isinstance (Type, str)):
+			if (Arg not in Type.split ('|')):
+				return (Words[0] + ": " + Arg + " is not one of " + Type)
+			Values.append (Arg)
+		else:
+			try:
+				Values.append (Type (Arg))
+			except ValueError:
+				return (Words[0] + ": " + Arg + " is not a number")
+	KeyTable[Name] = (Function, tuple (Values))
+	return ('')
+#--------------------------------------------------------------
+def keysLoad (Lines, FileName):
+	''' bind keys from Lines like "f5 flip f" (key name, action), a word starting with # starts a comment. Returns False if there were errors '''
+	Errors = 0
+	for Number, Line in enumerate (Lines, 1):
+		Splitted = Line.split()
+		if ((len(Splitted) == 0) or Splitted[0].startswith ("#")):
+			continue
+		Action = []
+		for Word in Splitted[1:]:
+			if (Word.startswith ("#")):
+				break
+			Action.append (Word)
+		Error = keyBind (Splitted[0], " ".join (Action))
+		if (Error != ''):
+			debug (1, FileName + ":" + str(Number) + ": " + Error)
+			Errors = Errors + 1
+	return (Errors == 0)
+#--------------------------------------------------------------
+def keysRead (FileName):
+	''' bind keys from a file, see keysLoad '''
+	try:
+		with open (FileName, "r") as FileHandle:
+			return (keysLoad (FileHandle, FileName))
+	except OSError as e:
+		debug (1, str(e))
+		return (False)
+#--------------------------------------------------------------
+def keysPrint ():
+	''' print the key bindings '''
+	for Name, (Function, Args) in sorted (KeyTable.items()):
+		Action = [Name for Name, Entry in KeyActions.items() if (Entry[0] == Function)]
+		debug (1, Name + "\t" + " ".join (Action + [str(Arg) for Arg in Args]))
+
+#--------------------------------------------------------------
+def cmdEnd (Splitted, msg):
+	''' end: end tellTello '''
 	global Running
-	global SockBasic
-	global SockState
-	global TelloReady
+	debug (1, 'ending tellTello')
+	Running = False
+#--------------------------------------------------------------
+def cmdHelp (Splitted, msg):
+	''' help, h, ?, e: print the help '''
+	help(Parser)
+#--------------------------------------------------------------
+def cmdHealth (Splitted, msg):
+	''' health: print some status values and how old they are '''
+	for Line in healthLines ():
+		debug (1, Line)
+#--------------------------------------------------------------
+def cmdRtt (Splitted, msg):
+	''' rtt: round trip times per command '''
+	rttPrint ()
+#--------------------------------------------------------------
+def cmdQueue (Splitted, msg):
+	''' queue: depth and waiting times of the command queue '''
+	queuePrint ()
+#--------------------------------------------------------------
+def cmdProfile (Splitted, msg):
+	''' profile start|stop|dump [file] '''
+	if (len(Splitted) < 2):
+		debug (1, "profiling " + ("on" if ProfileOn else "off") + ", threads: " + ", ".join (Profilers))
+	elif (Splitted[1] == 'start'):
+		profileSet (True)
+	elif (Splitted[1] == 'stop'):
+		profileSet (False)
+	elif (Splitted[1] == 'dump'):
+		profileDump (Splitted[2] if (len(Splitted) > 2) else ProfileFile)
+	else:
+		debug (1, "profile start, stop or dump [file]")
+#--------------------------------------------------------------
+def cmdStats (Splitted, msg):
+	''' stats [n]: print the statistics now or every n seconds '''
+	global StatsPeriod
+	if (len(Splitted) > 1):
+		try:
+			StatsPeriod = float(Splitted[1])
+		except ValueError:
+			debug (1, "error in stats statement")
+		if (StatsPeriod > 0):
+			timerSchedule ("stats", StatsPeriod, statsTick)
+		else:
+			timerCancel ("stats")
+	else:
+		statsPrint ()
+#--------------------------------------------------------------
+def cmdSwarm (Splitted, msg):
+	''' swarm [watch n]: status of the Tellos, or which one to watch '''
+	global SwarmWatch
+	if ((len(Splitted) > 2) and (Splitted[1] == 'watch')):
+		try:
+			SwarmWatch = int(Splitted[2])
+		except ValueError:
+			debug (1, "error in swarm statement")
+	elif (len(Swarm) > 0):
+		swarmPrint ()
+	else:
+		debug (1, "not in swarm mode, see --swarm")
+#--------------------------------------------------------------
+def cmdRcRate (Splitted, msg):
+	''' rcrate n: rc commands per second in joy mode '''
+	global RcRate
+	try:
+		RcRate = float(Splitted[1])
+		if (InputModeJoy):
+			rcStart ()
+	except Exception:
+		debug (1, "rc rate = " + str(RcRate) + " Hz")
+#--------------------------------------------------------------
+def cmdExpo (Splitted, msg):
+	''' expo e [axis], rate r [axis]: the curve of one axis or of all of them '''
+	try:
+		Axes = [RcAxes.index (Splitted[2])] if (len(Splitted) > 2) else range (0, 4)
+		Value = float (Splitted[1])
+	except Exception:
+		for Line in stickLines ():
+			debug (1, Line)
+		return
+	for Axis in Axes:
+		if (Splitted[0] == "expo"):
+			RcExpo[Axis] = max (0, min (1, Value))
+		else:
+			RcRates[Axis] = max (0, min (100, Value))
+		RcCurves[Axis] = rcCurve (RcExpo[Axis], RcRates[Axis])
+	if (InputModeJoy):
+		Command = rcStick ()
+		if (len(Command) > 0):
+			sendCommand (Command)
+#--------------------------------------------------------------
+def cmdRamp (Splitted, msg):
+	''' ramp n, decay n: % per second the sticks move to where the keys put them, and back to the center '''
+	global RcRamp
+	global RcDecay
+	try:
+		if (Splitted[0] == "ramp"):
+			RcRamp = max (0, float (Splitted[1]))
+		else:
+			RcDecay = max (0, float (Splitted[1]))
+		stickSteps ()
+	except Exception:
+		pass
+	for Line in stickLines ():
+		debug (1, Line)
+#--------------------------------------------------------------
+def cmdState (Splitted, msg):
+	''' state [n]: print n state strings '''
 	global NumFrames
-	global Commands
-	global Offline
+	if (len(Splitted) > 1):
+		NumFrames = int(Splitted[1])
+	else:
+		NumFrames = 1
+#--------------------------------------------------------------
+def cmdDist (Splitted, msg):
+	''' dist n: distance of the move keys '''
+	global Dist
+	Dist = int(Splitted[1])
+#--------------------------------------------------------------
+def cmdAng (Splitted, msg):
+	''' ang n: angle of the turn keys '''
+	global Angle
+	Angle = int(Splitted[1])
+#--------------------------------------------------------------
+def cmdKey (Splitted, msg):
+	''' key: enter key mode '''
+	global InputModeString
+	global InputModeJoy
+	InputModeString = False
+	InputModeJoy    = False
+	rcStop ()
+	debug (2, "Use keys to control Tello - t,l,w/a/s/d, cursor keys, ESC to end key mode")
+#--------------------------------------------------------------
+def cmdJoy (Splitted, msg):
+	''' joy: enter joystick mode '''
+	global InputModeString
+	global InputModeJoy
+	InputModeString = False
+	InputModeJoy    = True
+	rcCenter ()
+	rcStart ()
+	debug (2, "Use keys to control Tello - t,l,w/a/s/d, cursor keys, ESC to end key mode")
+#--------------------------------------------------------------
+def cmdReady (Splitted, msg):
+	''' ready: start motors and enter joystick mode '''
+	commandInsert (["rc -100 -100 -100 100", "joy"])
+	rcCenter ()
+#--------------------------------------------------------------
+def cmdHold (Splitted, msg):
+	''' hold on [cm] | off | pid kp ki kd: altitude hold in joy mode '''
+	global HoldGains
+	if (len(Splitted) == 1):
+		for Line in holdLines ():
+			debug (1, Line)
+	elif (Splitted[1] == "on"):
+		if (not InputModeJoy):
+			cmdJoy (Splitted, msg)
+		holdStart (round (float (Splitted[2])) if (len(Splitted) > 2) else None)
+	elif (Splitted[1] == "off"):
+		if (Hold):
+			holdStop ()
+			Command = rcStick ()
+			if (len(Command) > 0):
+				sendCommand (Command)
+	elif ((Splitted[1] == "pid") and (len(Splitted) == 5)):
+		HoldGains = [float (Gain) for Gain in Splitted[2:5]]
+	else:
+		debug (1, "error in hold statement")
+#--------------------------------------------------------------
+def cmdWatch (Splitted, msg):
+	''' watch a b c: select the state values (or expressions of them) to watch '''
 	global WhichWatch
+	Error = watchCheck (Splitted[1:])
+	if (Error != ''):
+		debug (1, "error: " + Error)
+		return
+	WhichWatch = Splitted[1:]
+	stateKeys ()
+#--------------------------------------------------------------
+def cmdWhen (Splitted, msg):
+	''' when cond [hyst h] [once] do command, when off n|name|all, when: rules on the state frames '''
+	if (len(Splitted) == 1):
+		for Line in whenLines ():
+			debug (1, Line)
+	elif ((Splitted[1] == "off") and (len(Splitted) == 3)):
+		debug (2, str(whenRemove (Splitted[2])) + " rules removed")
+	else:
+		Error = whenAdd (Splitted)
+		if (Error != ''):
+			debug (1, "error: " + Error)
+#--------------------------------------------------------------
+def cmdWatchPeriod (Splitted, msg):
+	''' watchperiod [n], wp [n]: print a state frame every n seconds, toggle without n '''
 	global WatchPeriod
-	global DebugLevel
-	global tello_address
+	try:
+		WatchPeriod = float(Splitted[1])
+	except Exception:
+		if (WatchPeriod > 0): 
+			WatchPeriod =  -1
+		else:
+			WatchPeriod =  1
+	if (WatchPeriod > 0):
+		timerSchedule ("watch", 0, watchTick)
+	else:
+		timerCancel ("watch")
+	debug (3, "wach period = " + str (WatchPeriod))
+#--------------------------------------------------------------
+def cmdWatchWrite (Splitted, msg):
+	''' ww: print the watch rows in csv format '''
+	print ('')
+	for Line in watchLines ():
+		debug (1, Line)
+	print ('')
+#--------------------------------------------------------------
+def cmdWatchClear (Splitted, msg):
+	''' wc: clear the watch rows '''
+	global WatchCount
+	WatchCount = 0
+#--------------------------------------------------------------
+def cmdRecord (Splitted, msg):
+	''' record [file [z]|off] '''
+	if (len(Splitted) < 2):
+		if (Recording):
+			debug (1, "recording to " + RecorderFileName)
+		else:
+			debug (1, "not recording")
+	elif (Splitted[1] == 'off'):
+		recorderStop ()
+	else:
+		recorderStart (Splitted[1], (len(Splitted) > 2) and (Splitted[2] == 'z'))
+#--------------------------------------------------------------
+def cmdReplay (Splitted, msg):
+	''' replay file [speed] '''
+	if (Replaying):
+		debug (1, "a replay is running")
+	elif (not Offline):					# the state frames of the Tello would be written into StateBuffer at the same time
+		debug (1, "replay works offline only (or with --replay)")
+	elif (len(Splitted) > 1):
+		try:
+			Speed = float (Splitted[2]) if (len(Splitted) > 2) else 1
+			threading.Thread(target=recvStateReplay, args=(Splitted[1], Speed)).start()
+		except ValueError:
+			debug (1, "error in replay statement")
+	else:
+		debug (1, "error: no filename given")
+#--------------------------------------------------------------
+def cmdLog (Splitted, msg):
+	''' log [file|off] '''
+	if (len(Splitted) < 2):
+		if (LogThread is not None):
+			debug (1, "logging to " + LogFileName)
+		else:
+			debug (1, "not logging")
+	elif (Splitted[1] == 'off'):
+		logStop ()
+	else:
+		logStart (Splitted[1])
+#--------------------------------------------------------------
+def cmdSleep (Splitted, msg):
+	''' sleep n: pause the command queue for n seconds '''
 	global SleepTime
-	global TelloInfo
-	global Watchlist
+	try:
+		SleepTimeDiff = float(Splitted[1])
+		debug (3, "sleeping = " + str (SleepTimeDiff))
+		SleepTime = SleepTimeDiff + time.time()
+		timerSchedule ("sleep", SleepTimeDiff, wakeUp)
+		debug (5, "will wake up at " + str(SleepTime))
+	except Exception:
+		SleepTime =  -1
+		debug (1, "error in sleep statement")
+#--------------------------------------------------------------
+def cmdDebug (Splitted, msg):
+	''' debug [n]: set the debug level '''
+	global DebugLevel
+	if (len(Splitted) > 1):
+		DebugLevel = int(Splitted[1])
+	else:
+		DebugLevel = 1
+#--------------------------------------------------------------
+def cmdOsCommand (Splitted, msg):
+	''' oscommand cmd: run cmd in a new window '''
+	msg = msg[10:]						# remove keyword and first blank from cmd
+	os.system("start cmd /k " + msg) # windows-specific! 
+#--------------------------------------------------------------
+def cmdVideo (Splitted, msg):
+	''' video [on|off|play [program]|record file|record off|stats]: receive the video stream, play it (default: ffplay), record it '''
+	Action = Splitted[1] if (len(Splitted) > 1) else 'play'
+	if (Action == 'off'):
+		commandInsert (["streamoff"])
+		videoStop ()
+	elif (Action == 'stats'):
+		for Line in videoLines ():
+			debug (1, Line)
+	elif (Action == 'record'):
+		if (len(Splitted) < 3):
+			debug (1, "error: no filename given")
+		elif (Splitted[2] == 'off'):
+			videoSinkStop ("record")
+		elif (videoStart ()):
+			videoRecord (Splitted[2])
+	elif (Action in ['on', 'play']):
+		if (SockVideo is None):
+			if (not videoStart ()):
+				return
+			commandInsert (["streamon"])
+		if (Action == 'play'):
+			videoPlay (Splitted[2:] if (len(Splitted) > 2) else VideoPlayer)
+	else:
+		debug (1, "video on, off, play [program], record file, record off or stats")
+#--------------------------------------------------------------
+def cmdKeys (Splitted, msg):
+	''' keys [file]: print the key bindings or load bindings from a file '''
+	if (len(Splitted) > 1):
+		keysRead (Splitted[1])
+	else:
+		keysPrint ()
+#--------------------------------------------------------------
+def cmdScript (Splitted, msg):
+	''' script file: run a script '''
+	if (len(Splitted) > 1):
+		if (not scriptRead (Splitted[1], 'i')):
+			debug (1, "unable to load " + Splitted[1])
+	else:
+		debug (1, "error: no filename given")
 
-	Rc = [0,0,0,0]
-	InputModeString = True
-	InputModeJoy    = False
-	Dist = 40
-	Angle = 90
+#--------------------------------------------------------------
+Keywords = {					# tellTello keyword: handler (Splitted, msg), everything else is sent to Tello, see processMessage
+	"end": cmdEnd, "help": cmdHelp, "h": cmdHelp, "?": cmdHelp, "e": cmdHelp, "health": cmdHealth, "rtt": cmdRtt, "queue": cmdQueue,
+	"profile": cmdProfile, "stats": cmdStats, "swarm": cmdSwarm, "rcrate": cmdRcRate, "expo": cmdExpo, "rate": cmdExpo, "ramp": cmdRamp, "decay": cmdRamp, "state": cmdState, "dist": cmdDist, "ang": cmdAng,
+	"key": cmdKey, "joy": cmdJoy, "ready": cmdReady, "hold": cmdHold, "watch": cmdWatch, "when": cmdWhen, "watchperiod": cmdWatchPeriod, "wp": cmdWatchPeriod,
+	"ww": cmdWatchWrite, "wc": cmdWatchClear, "record": cmdRecord, "replay": cmdReplay, "log": cmdLog, "sleep": cmdSleep,
+	"debug": cmdDebug, "oscommand": cmdOsCommand, "video": cmdVideo, "script": cmdScript, "keys": cmdKeys,
+	}
 
-	parser = argparse.ArgumentParser(description = "tellTello - a console program for the Ryze Robotics Tello quadrocopter", epilog="enter \"help\" command for more information")
-	parser.add_argument("--ip", type=str, default='192.168.10.1', help="ip address, default=192.168.10.1")
-	parser.add_argument("-s", "--script", type=str, default="", help="script to execute")
-	parser.add_argument("-w", "--watch", type=str, default='', help="list of watch expressions like \"mid x y z\"")
-	parser.add_argument("-o", "--offline", type=str, default='No', help="test this program without being connected to a Tello")
-	parser.add_argument("-d", "--debug", type=int, default='1', help="debug level ... 0=no debug messages, higher number for more messages")
-	args = parser.parse_args()
+#--------------------------------------------------------------
+def processMessage (msg):
+	''' execute msg (a tellTello keyword or an SDK command) or fetch the next one from the command queue. Urgent commands are sent first. 
+	Returns the message which still has to be executed, e.g. because Tello is not ready yet '''
+	global InputTime
+	global CommandCurrent
 	
-	DebugLevel = args.debug
+	Urgent = commandUrgent ()
+	if (len(Urgent) > 0):				# emergency, stop and rc don't wait for anything
+		if (Urgent.split()[-1] == 'emergency'):
+			msg = ''
+			CommandCurrent = None
+		sendCommand (Urgent)
+		return (msg)
+	
+	if (len(msg) == 0):
+		msg = commandNext ()
+		if (len(msg) > 0):
+			msg = msg.replace ('\n', ''); # trim newline-character at end of line, otherwise the command is not recognized 
+			debug (2, msg)
+	
+	# remove comments
+	Hash = msg.find("#")
+	if (Hash != -1):
+		msg = msg[0:Hash]
 
-	if (args.offline == 'No'):
-		Offline = False
+
+	if (len (msg) > 0):
+		Splitted = msg.split()
+		keyword = Splitted[0]
+		Handler = Keywords.get (keyword)
+		if (Handler is not None):
+			Handler (Splitted, msg)
+			InputTime = 0				# internal keyword, nothing to measure
+			msg = ''
+			wakeMain()					# no answer will come, the next line of a script can follow at once
+		elif (queryServe (msg)):		# fresh answer in the cache, no need to ask Tello
+			InputTime = 0
+			msg = ''
+			wakeMain()
+		elif (TelloReady):				# Send data
+			if (msg == 'takeoff'):				# center simulated sticks before takeoff 
+				rcCenter ()
+			sendCommand (msg)
+			msg = ''
 	
-	IpAddress = args.ip
-	tello_address = (IpAddress, 8889)
+	if ((len(msg) == 0) and (CommandCurrent is not None)):
+		commandDone (*CommandCurrent)
+		CommandCurrent = None
+	return (msg)
+
+#--------------------------------------------------------------
+def mainThreads (args):
+	''' the threaded engine: one thread per socket plus the timer, the main loop polls the keyboard '''
+	global Running
+	global SockBasic
+	global SockState
+	global InputTime
+	global InputSource
+	global MainSelector
+	global WakeReader
+	global WakeWriter
 
-	debug (1, "waiting for " + IpAddress)
 	if (not Offline):
 	
+		debug (1, "waiting for " + IpAddress)
 		waitForConnection (IpAddress)
 		
 		# --- basic communication --------------
 		# Create a UDP socket
 		portBasic = 8889
 		locaddrBasic = (host,portBasic) 
-		SockBasic = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		SockBasic = udpSocket (locaddrBasic)
 		SockBasic.settimeout (1)
-		SockBasic.bind(locaddrBasic)
 
 		recvThreadBasic = threading.Thread(target=recvBasic)
 		recvThreadBasic.start()
@@ -535,9 +3811,8 @@ def main():
 		# Create a UDP socket
 		portState = 8890
 		locaddrState = (host,portState) 
-		SockState = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		SockState = udpSocket (('0.0.0.0', portState))
 		SockState.settimeout (1)
-		SockState.bind(('0.0.0.0', portState))
 
 		recvThreadState = threading.Thread(target=recvState)
 		recvThreadState.start()
@@ -550,10 +3825,256 @@ def main():
 	timerTask = threading.Thread(target=timerFunc)
 	timerTask.start()
 
-	TimeSend = 0
-	TelloReady = True
+	MainSelector = selectors.DefaultSelector()
+	WakeReader, WakeWriter = socket.socketpair()
+	WakeReader.setblocking (False)
+	WakeWriter.setblocking (False)
+	MainSelector.register (WakeReader, selectors.EVENT_READ)
+	msg = ''
+	Reading = False						# inputReader waits for a line
+	try:
+		while Running: 
+			Waiting = True
+			OldMsg = msg
+			OldLen = commandsWaiting ()
+			keyboardMode ()
+			if (InputModeString):
+				if ((not Reading) and TelloReady and (commandsWaiting () == 0) and (len(msg) == 0)):		# only prompt when no command is waiting
+					Reading = True
+					threading.Thread (target = inputReader, args = (None, ">"), daemon = True).start()
+				if (len(InputLines) > 0):		# rules and timers go on while the prompt waits, see inputReader
+					Reading = False
+					commandQueue (InputLines.popleft())
+					InputTime = time.perf_counter()
+					InputSource = "string"
+					Waiting = False
+			elif (msvcrt is not None): 		# keys go into the command queue, see commandQueue for their priority 
+				keysWindows ()
 
+			msg = processMessage (msg)
+			ThreadCpu["main"] = time.thread_time()
+			profileCheck ("main")
+			if (Running and Waiting and (msg == OldMsg) and (commandsWaiting () == OldLen)):		# nothing has happened, wait for an answer, a timer, a key, a line or wakeMain
+				mainWait (KeyPollPeriod if ((not InputModeString) and (msvcrt is not None)) else None)
+	except KeyboardInterrupt:
+		Running = False
+		timerWake()
+		raise
+	finally:
+		keyboardStop ()
+		videoStop ()
+		MainSelector.close()
+		MainSelector = None
+		WakeWriter.close()
+		WakeReader.close()
+		WakeWriter = None
 
+	timerWake()
+	TimeShutdown = 3
+	debug (2, "Will shut down in " + str(TimeShutdown) + " seconds")
+	time.sleep (TimeShutdown) # give recvBasic task some time to end 
+	if (not Offline):
+		SockBasic.close()  
+		SockState.close()
+
+#--------------------------------------------------------------
+class BasicProtocol (asyncio.DatagramProtocol):
+	''' answers to commands (port 8889) for the asyncio engine, see recvBasic '''
+	
+	def datagram_received (self, data, addr):
+		StatsCount[StatAnswers] += 1
+		StatsCount[StatAnswerBytes] += len(data)
+		DataDecoded = ''
+		try:
+			DataDecoded = data.decode(encoding="utf-8")
+		except Exception as e:
+			debug (1, str(e))
+		if (len(Swarm) > 0):
+			swarmAnswer (addr, DataDecoded)
+		else:
+			interpreteAnswer (DataDecoded)
+	
+	def error_received (self, exc):
+		debug (1, '\n------------------- Exception: ' + str(exc) + '\n')
+
+#--------------------------------------------------------------
+class StateProtocol (asyncio.DatagramProtocol):
+	''' state frames (port 8890) for the asyncio engine, see recvState '''
+	
+	def datagram_received (self, data, addr):
+		if (len(Swarm) > 0):
+			swarmState (addr, data)
+		else:
+			stateReceived (stateLoad (data))
+	
+	def error_received (self, exc):
+		debug (1, '\n------------------- Exception: ' + str(exc) + '\n')
+
+#--------------------------------------------------------------
+async def dummyTask():
+	''' for offline testing with the asyncio engine, see recvBasicDummy and recvStateDummy '''
+	global TelloReady
+	
+	while (Running):
+		await asyncio.sleep (1)
+		TelloReady = True
+		wakeMain()
+		if (not Replaying):
+			stateReceived (stateLoad (StateDummy))
+
+#--------------------------------------------------------------
+def inputReader (Future, Prompt):
+	''' read one line from the console, so that the main loop goes on while the prompt waits (commands of rules, timers). Runs in a daemon thread, 
+	so a pending input() never delays the shutdown. Future is None for the threaded engine: the line goes to InputLines '''
+	try:
+		Line = input (Prompt)
+	except (EOFError, KeyboardInterrupt):
+		Line = 'end'
+	if (Future is None):
+		InputLines.append (Line)
+		wakeMain()
+		return
+	try:
+		AsyncLoop.call_soon_threadsafe (inputDone, Future, Line)
+	except Exception:
+		pass						# engine has already ended
+
+#--------------------------------------------------------------
+def inputDone (Future, Line):
+	''' hand a line from inputReader over to mainAsync '''
+	global InputTime
+	global InputSource
+	
+	InputTime = time.perf_counter()
+	InputSource = "string"
+	Future.set_result (Line)
+	AsyncMainEvent.set()
+
+#--------------------------------------------------------------
+async def mainAsync (args):
+	''' the asyncio engine: both sockets, the timer and the console input on one event loop '''
+	global AsyncLoop
+	global AsyncTimerEvent
+	global AsyncMainEvent
+	global TransportBasic
+	global Running
+	global InputTime
+	global InputSource
+	
+	AsyncLoop = asyncio.get_running_loop()
+	AsyncTimerEvent = asyncio.Event()
+	AsyncMainEvent = asyncio.Event()
+	
+	TransportState = None
+	Tasks = [asyncio.ensure_future (timerTask())]
+	if (not Offline):
+		if (len(Swarm) > 0):
+			debug (1, "waiting for " + ", ".join ([Drone["ip"] for Drone in Swarm]))
+			await asyncio.gather (*[AsyncLoop.run_in_executor (None, waitForConnection, Drone["ip"]) for Drone in Swarm])
+		else:
+			debug (1, "waiting for " + IpAddress)
+			await AsyncLoop.run_in_executor (None, waitForConnection, IpAddress)
+		TransportBasic, Protocol = await AsyncLoop.create_datagram_endpoint (BasicProtocol, sock = udpSocket ((host, 8889)))
+		TransportState, Protocol = await AsyncLoop.create_datagram_endpoint (StateProtocol, sock = udpSocket (('0.0.0.0', 8890)))
+	else:
+		Tasks.append (asyncio.ensure_future (dummyTask()))
+	
+	msg = ''
+	Input = None				# future of the pending console input
+	try:
+		while Running:
+			AsyncMainEvent.clear()
+			Timeout = None
+			keyboardMode ()
+			if (InputModeString):
+				if ((Input is None) and TelloReady and (commandsWaiting () == 0) and (len(msg) == 0)):
+					Input = AsyncLoop.create_future()
+					threading.Thread (target = inputReader, args = (Input, ">"), daemon = True).start()
+				if ((Input is not None) and Input.done()):
+					commandQueue (Input.result())
+					Input = None
+			elif (msvcrt is not None):			# the Windows console can't be waited for, see keyboardStart for terminals
+				Timeout = KeyPollPeriod
+				keysWindows ()
+			
+			OldMsg = msg
+			OldLen = commandsWaiting ()
+			msg = processMessage (msg)
+			ThreadCpu["main"] = time.thread_time()
+			profileCheck ("main")
+			if (Running and (msg == OldMsg) and (commandsWaiting () == OldLen)):		# nothing has happened, wait for an answer, a timer or an input
+				try:
+					await asyncio.wait_for (AsyncMainEvent.wait(), Timeout)
+				except asyncio.TimeoutError:
+					pass
+	finally:
+		Running = False
+		keyboardStop ()
+		videoStop ()
+		for Task in Tasks:
+			Task.cancel()
+		if (TransportBasic is not None):
+			TransportBasic.close()
+		if (TransportState is not None):
+			TransportState.close()
+		AsyncLoop = None
+
+#--------------------------------------------------------------
+def main():
+	''' the main program of tellTello '''
+	global Running
+	global Offline
+	global WhichWatch
+	global DebugLevel
+	global tello_address
+	global IpAddress
+	global Parser
+	global CsvDelimiter
+	global CsvDecimal
+	global LogFlush
+	global RcRate
+	global StatsPeriod
+	global ProfileFile
+	global LogSize
+	global LogTime
+	global VideoCapacity
+
+	Parser = argparse.ArgumentParser(description = "tellTello - a console program for the Ryze Robotics Tello quadrocopter", epilog="enter \"help\" command for more information")
+	Parser.add_argument("--ip", type=str, default='192.168.10.1', help="ip address, default=192.168.10.1")
+	Parser.add_argument("-s", "--script", type=str, default="", help="script to execute")
+	Parser.add_argument("-w", "--watch", type=str, default='', help="list of watch expressions like \"mid x y z\"")
+	Parser.add_argument("-o", "--offline", type=str, default='No', help="test this program without being connected to a Tello")
+	Parser.add_argument("-d", "--debug", type=int, default='1', help="debug level ... 0=no debug messages, higher number for more messages")
+	Parser.add_argument("--watchsize", type=int, default=WatchCapacity, help="number of watch rows to keep (older ones are dropped), default=" + str(WatchCapacity))
+	Parser.add_argument("-l", "--log", type=str, default='', help="write the watch rows to this csv file while flying")
+	Parser.add_argument("--logflush", type=float, default=LogFlush, help="seconds between two writes to the log file, default=" + str(LogFlush))
+	Parser.add_argument("--logsize", type=int, default=0, help="start a new log file when it has reached this number of kB")
+	Parser.add_argument("--logtime", type=float, default=0, help="start a new log file after this number of minutes")
+	Parser.add_argument("--delimiter", type=str, default=CsvDelimiter, help="field delimiter of the csv output, default=" + CsvDelimiter)
+	Parser.add_argument("--decimal", type=str, default=CsvDecimal, help="decimal point of the csv output, default=" + CsvDecimal)
+	Parser.add_argument("-r", "--record", type=str, default='', help="record all state frames, commands and answers to this binary file")
+	Parser.add_argument("-z", "--compress", action="store_true", help="compress the recording")
+	Parser.add_argument("--replay", type=str, default='', help="feed the state frames of a recording, a csv watch log or a file of raw state strings through watch, log and recorder, then end (no Tello needed)")
+	Parser.add_argument("--speed", type=float, default=1, help="speed of the replay, e.g. 1 (default) = real time, 10 = 10 times faster, 0 = as fast as possible")
+	Parser.add_argument("--rcrate", type=float, default=RcRate, help="rc commands per second in joystick mode, 0 = send every key at once, default=" + str(RcRate))
+	Parser.add_argument("--profile", type=str, default='', help="profile all threads from the start, write the result to this pstats file at the end")
+	Parser.add_argument("--stats", type=float, default=0, help="print the statistics (see command stats) every n seconds")
+	Parser.add_argument("--videobuffer", type=int, default=VideoCapacity // 1024, help="kB of the video ring, default=" + str(VideoCapacity // 1024))
+	Parser.add_argument("-k", "--keys", type=str, default='', help="file with key bindings like \"f5 flip f\" (see command keys), added to the default bindings")
+	Parser.add_argument("--swarm", type=str, default='', help="swarm mode: comma-separated ip addresses of the Tellos, e.g. 192.168.1.11,192.168.1.12 (uses the asyncio engine)")
+	Parser.add_argument("-e", "--engine", type=str, default='threads', choices=['threads', 'asyncio'], help="threads (default) or asyncio (one event loop for sockets, timer and input)")
+	args = Parser.parse_args()
+	
+	DebugLevel = args.debug
+
+	if (args.offline == 'No'):
+		Offline = False
+	
+	IpAddress = args.ip
+	tello_address = (IpAddress, 8889)
+	if (args.swarm != ''):
+		swarmStart (args.swarm.split (','))
+		args.engine = 'asyncio'			# one event loop for all Tellos
 
 	print ('\r\n\r\nTello Python3 Demo.\r\n')
 
@@ -561,313 +4082,69 @@ def main():
 	debug (1, 'state n ... print status string n times \r\n')
 	debug (1, 'end -- quit demo.\r\n')
 
-	msg = ''
-	Commands = ['command','sdk?']
+	WhichWatch = args.watch.split()
+	Error = watchCheck (WhichWatch)
+	if (Error != ''):
+		debug (1, "error: " + Error)
+		sys.exit()
+	stateKeys ()
+	watchInit (args.watchsize)
+	CsvDelimiter = args.delimiter
+	CsvDecimal = args.decimal
+	LogFlush = args.logflush
+	RcRate = args.rcrate
+	StatsPeriod = args.stats
+	VideoCapacity = max (64, args.videobuffer) * 1024
+	keysLoad (KeyBindingsDefault.splitlines(), "default key bindings")
+	if (args.keys != ''):
+		if (not keysRead (args.keys)):
+			sys.exit()
+	if (args.profile != ''):
+		ProfileFile = args.profile
+		profileSet (True)
+	if (StatsPeriod > 0):
+		timerSchedule ("stats", StatsPeriod, statsTick)
+	LogSize = args.logsize * 1024
+	LogTime = args.logtime * 60
+	if (args.log != ''):
+		if (not logStart (args.log)):
+			sys.exit()
+	if (args.record != ''):
+		if (not recorderStart (args.record, args.compress)):
+			sys.exit()
+	commandQueue ('command', "normal")
+	commandQueue ('sdk?', "normal")
 	if (args.script != ""):
 		if (not scriptRead (args.script, 'a')):
 			sys.exit()
 			
-	InputModeString = True
-
-	while Running: 
-		
-			if (TelloReady and InputModeString and (len(Commands) == 0) and (len(msg) == 0)):		# +++: only prompt for msg when we do not have a command in the list, but fetch the command only if no key input has arrived
-				try:
-					msg = input(">");
-				except KeyboardInterrupt:
-					msg = 'end'
-					Running = False
-					raise
-
-			
-			if (not InputModeString): 		# keys have higher priority than Commands 
-				if (msvcrt.kbhit()):
-					Char1 = msvcrt.getch()
-					Char2 = ''
-					if (msvcrt.kbhit()):			# second character when an arrow key, a function key ... is pressed
-						Char2 = msvcrt.getch()
-					
-					if   (chr(Char1[0]) == 'c'):
-						msg = 'command'
-					elif (chr(Char1[0]) == 't'):
-						Rc = [0,0,0,0]
-						msg = 'takeoff'
-					elif (chr(Char1[0]) == 'l'):
-						msg = 'land'
-					elif (chr(Char1[0]) == '8'):
-						if (InputModeJoy):
-							Rc[2] = Rc[2] + 10
-							msg = rcCommand (Rc)
-						else:
-							msg = 'up ' + str (Dist)
-					elif (chr(Char1[0]) == '2'):
-						if (InputModeJoy):
-							Rc[2] = Rc[2] - 10
-							msg = rcCommand (Rc)
-						else:
-							msg = 'down ' + str (Dist)
-					elif (chr(Char1[0]) == '4'):
-						if (InputModeJoy):
-							Rc[3] = Rc[3] - 10
-							msg = rcCommand (Rc)
-						else:
-							msg = 'ccw ' + str (Angle)
-					elif (chr(Char1[0]) == '6'):
-						if (InputModeJoy):
-							Rc[3] = Rc[3] + 10
-							msg = rcCommand (Rc)
-						else:
-							msg = 'cw ' + str (Angle)
-					elif (chr(Char1[0]) in ['5','h','H',' ']): # halt
-						if (InputModeJoy):
-							Rc = [0,0,0,0]
-							sendCommand (rcCommand (Rc))
-						else:
-							sendCommand ('stop')
-						msg = ''
-					elif (chr(Char1[0]) == 'w'):
-						if (InputModeJoy):
-							Rc[2] = Rc[2] + 10
-							msg = rcCommand (Rc)
-						else:
-							msg = 'up ' + str (Dist)
-					elif (chr(Char1[0]) == 's'):
-						if (InputModeJoy):
-							Rc[2] = Rc[2] - 10
-							msg = rcCommand(Rc)
-						else:
-							msg = 'down ' + str (Dist)
-					elif (chr(Char1[0]) == 'a'):
-						if (InputModeJoy):
-							Rc[3] = Rc[3] - 10
-							msg = rcCommand(Rc)
-						else:
-							msg = 'ccw ' + str (Angle)
-					elif (chr(Char1[0]) == 'd'):
-						if (InputModeJoy):
-							Rc[3] = Rc[3] + 10
-							msg = rcCommand(Rc)
-						else:
-							msg = 'cw ' + str (Angle)
-					elif (chr(Char1[0]) == 'p'):		# the PANIC! button ... send immediately (don't wait for TelloReady)
-						sendCommand ('emergency')
-						msg = ''
-					elif (chr(Char1[0]) == '-'):
-						Dist = round(Dist / 2)
-						if (Dist < 20):
-							Dist = 20
-						msg = "dist " + str(Dist)
-					elif (chr(Char1[0]) == '+'):
-						Dist = Dist * 2
-						if (Dist > 500):
-							Dist = 500
-						msg = "dist " + str(Dist)
-					elif (chr(Char1[0]) == '/'):
-						Angle = round(Angle / 2)
-						if (Angle < 5):
-							Angle = 5
-						msg = "ang " + str(Angle)
-					elif (chr(Char1[0]) == '*'):
-						Angle = Angle * 2
-						if (Angle > 3600):
-							Angle = 3600
-						msg = "ang " + str(Angle)
-					elif (chr(Char1[0]) == '?'):
-						# help()
-						# parser.print_help()
-						# msg = ''
-						msg = "help"
-					elif (chr(Char1[0]) == 'v'):
-						msg = 'video'
-					elif (chr(Char1[0]) == 'j'):
-						msg = ''
-						InputModeString = False
-						InputModeJoy    = True
-						debug (2, "joysitck mode")
-					elif (chr(Char1[0]) == 'k'):
-						msg = ''
-						InputModeString = False
-						InputModeJoy    = False
-						debug (2, "key mode")
-					elif (Char1[0] == 27):
-						msg = ''
-						InputModeString = True
-						InputModeJoy    = False
-						debug (2, "string mode")
-					elif (Char1[0] == 224):
-						if   (Char2[0] == 72):		# up arrow
-							if (InputModeJoy):
-								Rc[1] = Rc[1] + 10
-								msg = rcCommand (Rc)
-							else:
-								msg = 'forward ' + str (Dist)
-						elif (Char2[0] == 80):		# down arrow
-							if (InputModeJoy):
-								Rc[1] = Rc[1] - 10
-								msg = rcCommand (Rc)
-							else:
-								msg = 'back ' + str (Dist)
-						elif (Char2[0] == 75):		# left arrow
-							if (InputModeJoy):
-								Rc[0] = Rc[0] - 10  # ++++ + oder - ????
-								msg = rcCommand (Rc)
-							else:
-								msg = 'left ' + str (Dist)
-						elif (Char2[0] == 77):		# right arrow
-							if (InputModeJoy):
-								Rc[0] = Rc[0] + 10  # ++++ + oder - ????
-								msg = rcCommand (Rc)
-							else:
-								msg = 'right ' + str (Dist)
-					elif (Char1[0] == 0):
-						if   (Char2[0] == 59):		# F1
-							# help()
-							# msg = ''
-							msg = "help"
-						elif (Char2[0] == 60):		# F2
-							msg = "state 1"
-
-					debug (4, "---" + msg)
-					
-
-			# remove comments
-			Hash = msg.find("#")
-			if (Hash != -1):
-				msg = msg[0:Hash]
-
-
-			if (len (msg) > 0):
-				Splitted = msg.split()
-				keyword = Splitted[0]
-				
-				if    (keyword == 'end'):
-					debug (1, 'ending tellTello')
-					Running = False
-					msg = ''
-				elif (keyword in ['help', 'h', '?', 'e']):
-					help(parser)
-					# parser.print_help()
-					msg = ''
-				elif (keyword == 'health'):
-					print (TelloInfo)
-					msg = ''
-				elif (keyword == 'state'):
-					if (len(Splitted) > 1):
-						NumFrames = int(Splitted[1])
-					else:
-						NumFrames = 1
-					msg = ''
-				elif (keyword == 'dist'):
-					Dist = int(Splitted[1])
-					msg = ''
-				elif (keyword == 'ang'):
-					Angle = int(Splitted[1])
-					msg = ''
-				elif (keyword == 'key'):
-					InputModeString = False
-					InputModeJoy    = False
-					debug (2, "Use keys to control Tello - t,l,w/a/s/d, cursor keys, ESC to end key mode")
-					msg = ''
-				elif (keyword == 'joy'):
-					InputModeString = False
-					InputModeJoy    = True
-					Rc = [0,0,0,0]
-					debug (2, "Use keys to control Tello - t,l,w/a/s/d, cursor keys, ESC to end key mode")
-					msg = ''
-				elif (keyword == 'ready'):
-					Commands = ["rc -100 -100 -100 100", "joy"] + Commands
-					Rc = [0,0,0,0]
-					msg = ''
-				elif (keyword == 'watch'):
-					Watches = msg.split()
-					Watches.pop(0)
-					WhichWatch = Watches
-					msg = ''
-				elif (keyword in ['watchperiod', 'wp']):
-					try:
-						WatchPeriod = float(Splitted[1])
-					except Exception:
-						if (WatchPeriod > 0): 
-							WatchPeriod =  -1
-						else:
-							WatchPeriod =  1
-					debug (3, "wach period = " + str (WatchPeriod))
-					msg = ''
-				elif (keyword == 'ww'):
-					print ('')
-					for Line in Watchlist:
-						debug (1, Line)
-					print ('')
-					msg = ''
-				elif (keyword == 'wc'):
-					Watchlist = []
-					msg = ''
-				elif (keyword == 'sleep'):
-					try:
-						SleepTimeDiff = float(Splitted[1])
-					except Exception:
-						SleepTime =  -1
-						debug (1, "error in sleep statement")
-					debug (3, "sleeping = " + str (SleepTimeDiff))
-					SleepTime = SleepTimeDiff + time.time()
-					debug (5, "will wake up at " + str(SleepTime))
-					msg = ''
-				elif (keyword =='debug'):
-					if (len(Splitted) > 1):
-						DebugLevel = int(Splitted[1])
-					else:
-						DebugLevel = 1
-					msg = ''
-				elif (keyword =='oscommand'):
-					msg = msg[10:]						# remove keyword and first blank from cmd
-					os.system("start cmd /k " + msg) # windows-specific! 
-					msg = ''
-				elif (keyword =='video'):
-					Commands = ["streamon", "oscommand FFmpeg -i udp://192.168.10.1:11111 -f sdl \"tellTello Video Window\""] + Commands
-					# Commands = ["streamon", "oscommand ffplay -probesize 5000000 -i udp://0.0.0.0:11111 -framerate 35"] + Commands
-					msg = ''
-				elif (keyword =='script'):
-					if (len(Splitted) > 1):
-						if (not scriptRead (Splitted[1], 'i')):
-							debug (1, "unable to load " + Splitted[1])
-					else:
-						debug (1, "error: no filename given")
-					msg = ''
-				else:
-					# Send data
-					if (TelloReady):
-						if (msg == 'takeoff'):				# center simulated sticks before takeoff 
-							Rc = [0,0,0,0]
-						sendCommand (msg)
-						msg = ''
-			
-			else:				# no message, let's see if we have a command in the list 
-				if ((len(Commands) > 0) and (SleepTime < 0)):
-					msg = Commands.pop(0)
-					msg = msg.replace ('\n', ''); # trim newline-character at end of line, otherwise the command is not recognized 
-					debug (2, msg)
-			# except KeyboardInterrupt:
-				# Running = False
-				# print ('\n ctrl-break \n')
-				# break
-			
-
-	TimeShutdown = 3
-	debug (2, "Will shut down in " + str(TimeShutdown) + " seconds")
-	time.sleep (TimeShutdown) # give recvBasic task some time to end 
-	if (args.offline == 'No'):
-		SockBasic.close()  
-		SockState.close()
+	try:
+		if (args.replay != ''):			# batch mode, no engine needed
+			recvStateReplay (args.replay, args.speed)
+		elif (args.engine == 'asyncio'):
+			try:
+				asyncio.run (mainAsync (args))
+			except KeyboardInterrupt:
+				Running = False
+		else:
+			mainThreads (args)
+	finally:
+		logStop ()				# don't lose the log or the recording, not even with ctrl-C
+		recorderStop ()
+		if (args.profile != ''):
+			profileDump (ProfileFile)
+		profileEnd ("main")
 	
 	print ('')
-	for Line in Watchlist:
+	for Line in watchLines ():
 		debug (1, Line)
 	print ('')
 	
+	for Line in inputLatencyLines ():
+		debug (2, Line)
 	debug (2, "Thank you for using tellTello")
 
 #--------------------------------------------------------------------------
 
 if __name__ == '__main__':
 	main() 
-
@@ -0,0 +1,356 @@
+# Tello simulator for tellTello, by Martin Piehslinger
+
+'''
+A local stand-in for one or more Tellos, to test tellTello's communication without hardware.
+
+Listens for commands on <ip>:8889, answers them like a Tello (with configurable delays) and sends
+state strings to port 8890 of whoever has sent the first command (after streamon, a video stream to its
+port 11111). Packet loss, reordering and latency can be added to everything the simulator sends.
+
+example (two consoles):
+    python telloSim.py --ip 127.0.0.2 --rate 50 --loss 0.01
+    python tellTello.py --ip 127.0.0.2
+
+--count n simulates n Tellos on consecutive addresses (127.0.0.2, 127.0.0.3, ...)
+
+On Linux, all addresses 127.x.x.x are loopback addresses. On Windows, they are as well.
+'''
+
+import threading
+import socket
+import time
+import random
+import heapq
+import os
+import argparse
+
+#-----------------------------------------------------------------------------------
+def debug (Level, Message, end = '\n'):
+	''' print message, depending upon debug-level which is chosen by the user '''
+	global DebugLevel
+
+	if (Level <= DebugLevel):
+		print (Message, end = end)
+#-----------------------------------------------------------------------------------
+def deliver (Sock, Data, Address):
+	''' send Data to Address after the simulated latency, unless the packet gets lost. Packets may overtake each other (reorder) '''
+	global Sequence
+	global Dropped
+
+	if (random.random() < Loss):
+		Dropped = Dropped + 1
+		return
+	Delay = Latency + random.uniform (0, Jitter)
+	if (random.random() < Reorder):
+		Delay = Delay + ReorderDelay				# the next packets will overtake this one
+	with SendCondition:
+		Sequence = Sequence + 1
+		heapq.heappush (SendQueue, (time.monotonic() + Delay, Sequence, Sock, Data, Address))
+		SendCondition.notify()
+#-----------------------------------------------------------------------------------
+def sender ():
+	''' send the packets of SendQueue when they are due '''
+	global Sent
+
+	debug (3, "sender started")
+	while (Running):
+		Packet = None
+		with SendCondition:
+			if (len(SendQueue) == 0):
+				SendCondition.wait (1)
+			else:
+				Wait = SendQueue[0][0] - time.monotonic()
+				if (Wait > 0):
+					SendCondition.wait (Wait)
+				else:
+					Packet = heapq.heappop (SendQueue)
+		if (Packet is not None):
+			try:
+				Packet[2].sendto (Packet[3], Packet[4])
+				Sent = Sent + 1
+			except Exception as e:
+				debug (1, str(e))
+	debug (3, "sender ended")
+#-----------------------------------------------------------------------------------
+def newDrone (Number, IpAddress):
+	''' create the state of a simulated Tello and bind its command socket '''
+	Sock = socket.socket (socket.AF_INET, socket.SOCK_DGRAM)
+	Sock.setsockopt (socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)	# tellTello binds the same port on all addresses
+	Sock.settimeout (1)
+	Sock.bind ((IpAddress, 8889))
+
+	return ({"number": Number, "ip": IpAddress, "sock": Sock, "client": None,
+		"flying": False, "busy": 0, "motor": 0, "bat": 100 - Number, "h": 0, "target": 0,
+		"yaw": 0, "rc": [0,0,0,0], "commands": 0, "video": False, "frames": 0})
+#-----------------------------------------------------------------------------------
+def answer (Drone, Command):
+	''' the answer of the simulated Tello to Command and how long it takes to execute it. Returns (Answer, Duration), Answer is None for rc '''
+	Splitted = Command.split()
+	if (len(Splitted) == 0):
+		return ('error', 0)
+	Keyword = Splitted[0]
+	try:
+		Value = abs (int (Splitted[1])) if (len(Splitted) > 1) else 0
+	except ValueError:
+		return ('error', 0)
+
+	if (Keyword == 'rc'):
+		try:
+			Drone["rc"] = [int(Stick) for Stick in Splitted[1:5]]
+		except ValueError:
+			pass
+		return (None, 0)
+	if (Keyword in Queries):
+		return (Queries[Keyword] (Drone), 0)
+	if (Keyword in ['streamon', 'streamoff']):
+		Drone["video"] = (Keyword == 'streamon')
+		return ('ok', 0)
+	if (Keyword in ['command', 'speed', 'stop', 'mon', 'moff']):
+		return ('ok', 0)
+	if (Keyword == 'emergency'):
+		Drone["flying"] = False
+		Drone["target"] = 0
+		Drone["h"] = 0
+		return ('ok', 0)
+	if (Keyword == 'takeoff'):
+		Drone["flying"] = True
+		Drone["target"] = 80
+		return ('ok', TakeoffTime)
+	if (Keyword == 'land'):
+		Drone["target"] = 0
+		return ('ok', TakeoffTime)
+	if (not Drone["flying"]):
+		return ('error Not joystick', 0)		# what a Tello says to moves on the ground
+	if (Keyword in ['up', 'down']):
+		Drone["target"] = max (20, Drone["target"] + (Value if (Keyword == 'up') else -Value))
+		return ('ok', Value / MoveSpeed)
+	if (Keyword in ['forward', 'back', 'left', 'right']):
+		return ('ok', Value / MoveSpeed)
+	if (Keyword in ['cw', 'ccw']):
+		Drone["yaw"] = (Drone["yaw"] + (Value if (Keyword == 'cw') else -Value) + 180) % 360 - 180
+		return ('ok', Value / TurnSpeed)
+	if (Keyword in ['flip', 'go', 'curve', 'jump']):
+		return ('ok', 1)
+	return ('unknown command: ' + Keyword, 0)
+#-----------------------------------------------------------------------------------
+def recvCommands (Drone):
+	''' receive the commands for one simulated Tello and schedule the answers. Commands are executed one after the other '''
+	debug (3, "Tello " + Drone["ip"] + " listening")
+	while (Running):
+		try:
+			Data, Client = Drone["sock"].recvfrom (1518)
+		except socket.timeout:
+			continue
+		except Exception as e:
+			debug (1, str(e))
+			break
+		Command = Data.decode (encoding="utf-8", errors="replace").strip()
+		Drone["client"] = Client
+		Drone["commands"] = Drone["commands"] + 1
+		debug (2, Drone["ip"] + " < " + Command)
+
+		Answer, Duration = answer (Drone, Command)
+		if (Answer is not None):
+			Now = time.monotonic()
+			Drone["busy"] = max (Now, Drone["busy"]) + Delay + Duration
+			threading.Timer (Drone["busy"] - Now, deliver, args = (Drone["sock"], Answer.encode(encoding="utf-8"), Client)).start()
+			debug (2, Drone["ip"] + " > " + Answer + " in " + str(round (Drone["busy"] - Now, 3)) + " s")
+	debug (3, "Tello " + Drone["ip"] + " ended")
+#-----------------------------------------------------------------------------------
+def stateString (Drone):
+	''' the state string of a simulated Tello, in SDK 2.0 format '''
+	Noise = random.uniform (-3, 3)
+	return ("mid:-1;x:0;y:0;z:0;mpry:0,0,0;pitch:0;roll:0;yaw:" + str(Drone["yaw"]) +
+		";vgx:" + str(Drone["rc"][1] // 10) + ";vgy:" + str(Drone["rc"][0] // 10) + ";vgz:" + str(-Drone["rc"][2] // 10) +
+		";templ:" + str(50 + int(Drone["motor"]) // 60) + ";temph:" + str(53 + int(Drone["motor"]) // 60) +
+		";tof:" + str(int(Drone["h"]) + 10) + ";h:" + str(int(Drone["h"])) + ";bat:" + str(Drone["bat"]) +
+		";baro:" + str(round (38.28 + Drone["h"] / 100 + Noise / 100, 2)) + ";time:" + str(int(Drone["motor"])) +
+		";agx:" + str(round (Noise, 2)) + ";agy:" + str(round (-Noise, 2)) + ";agz:-1000.00;\r\n")
+#-----------------------------------------------------------------------------------
+def sendState ():
+	''' send a state string of every simulated Tello Rate times per second, update the simulated flight '''
+	global StateFrames
+
+	debug (3, "state task started")
+	Period = 1 / Rate
+	Next = time.monotonic()
+	while (Running):
+		for Drone in Drones:
+			if (Drone["flying"]):
+				Drone["motor"] = Drone["motor"] + Period
+				Drone["bat"] = max (0, 100 - Drone["number"] - int(Drone["motor"]) // 60)
+				Drone["target"] = max (0, min (3000, Drone["target"] + (Drone["rc"][2] - Drift) * Period))
+				Drone["h"] = Drone["h"] + (Drone["target"] - Drone["h"]) * min (1, 2 * Period)	# approach the target height
+				if ((Drone["target"] == 0) and (Drone["h"] < 1)):
+					Drone["flying"] = False
+					Drone["h"] = 0
+			if (Drone["client"] is not None):
+				deliver (Drone["sock"], stateString (Drone).encode(encoding="utf-8"), (Drone["client"][0], 8890))	# from the address of this Tello, for swarm mode
+				StateFrames = StateFrames + 1
+		Next = Next + Period
+		Wait = Next - time.monotonic()
+		if (Wait > 0):
+			time.sleep (Wait)
+		else:
+			Next = time.monotonic()					# we are late, don't try to catch up
+	debug (3, "state task ended")
+
+#-----------------------------------------------------------------------------------
+def videoContent (Length):
+	''' random bytes without zeros, so that they contain no start code '''
+	return (os.urandom (Length).replace (b"\x00", b"\x01"))
+#-----------------------------------------------------------------------------------
+def videoFrame (Drone):
+	''' the next frame of the video stream of a simulated Tello: H.264 NALs with random content, SPS, PPS and an IDR every Gop frames '''
+	Drone["frames"] = Drone["frames"] + 1
+	if (Drone["frames"] % Gop == 1):
+		Frame = b"\x00\x00\x00\x01\x67" + videoContent (10) + b"\x00\x00\x00\x01\x68" + videoContent (4) + b"\x00\x00\x00\x01\x65" + videoContent (KeyframeSize)
+	else:
+		Frame = b"\x00\x00\x00\x01\x41" + videoContent (random.randint (FrameSize // 2, FrameSize * 3 // 2))
+	if (len(Frame) % VideoPacket == 0):
+		Frame = Frame + b"\x01"			# the last packet of a frame is short
+	return (Frame)
+#-----------------------------------------------------------------------------------
+def sendVideo ():
+	''' send the video stream of every simulated Tello after streamon, Fps frames per second in packets of up to 1460 bytes '''
+	global VideoPackets
+
+	debug (3, "video task started")
+	Period = 1 / Fps
+	Next = time.monotonic()
+	while (Running):
+		for Drone in Drones:
+			if (Drone["video"] and (Drone["client"] is not None)):
+				Frame = videoFrame (Drone)
+				for Start in range (0, len(Frame), VideoPacket):
+					deliver (Drone["sock"], Frame[Start:Start + VideoPacket], (Drone["client"][0], 11111))
+					VideoPackets = VideoPackets + 1
+		Next = Next + Period
+		Wait = Next - time.monotonic()
+		if (Wait > 0):
+			time.sleep (Wait)
+		else:
+			Next = time.monotonic()
+	debug (3, "video task ended")
+
+#-----------------------------------------------------------------------------------
+'''global variables'''
+Running = True
+DebugLevel = 1
+Drones = []
+SendQueue = []				# heap of (time, sequence, socket, data, address), see deliver
+SendCondition = threading.Condition()
+Sequence = 0
+Sent = 0
+Dropped = 0
+StateFrames = 0
+Loss = 0
+Reorder = 0
+ReorderDelay = 0.05			# a reordered packet is sent this much later, so the next packets overtake it
+Latency = 0
+Jitter = 0
+Delay = 0.005
+MoveSpeed = 100				# cm/s
+TurnSpeed = 90				# degrees/s
+TakeoffTime = 3
+Rate = 10
+Drift = 0					# cm/s the simulated Tellos sink while flying (a Tello which doesn't hold its height well)
+Fps = 30					# video frames per second
+Gop = 30					# a keyframe every Gop frames
+KeyframeSize = 15000		# bytes
+FrameSize = 2500			# bytes, on average
+VideoPacket = 1460
+VideoPackets = 0
+Queries = {
+	"battery?": lambda Drone: str(Drone["bat"]),
+	"wifi?":    lambda Drone: "90",
+	"sdk?":     lambda Drone: "20",
+	"sn?":      lambda Drone: "0TQDG0SIM" + str(Drone["number"]).zfill(5),
+	"speed?":   lambda Drone: "100.0",
+	"time?":    lambda Drone: str(int(Drone["motor"])) + "s",
+	"height?":  lambda Drone: str(int(Drone["h"]) // 10) + "dm",
+	"temp?":    lambda Drone: "50~53C",
+	"baro?":    lambda Drone: str(round (38.28 + Drone["h"] / 100, 2)),
+	"tof?":     lambda Drone: str(int(Drone["h"]) * 10 + 100) + "mm",
+	"attitude?":lambda Drone: "pitch:0;roll:0;yaw:" + str(Drone["yaw"]) + ";",
+	}
+
+#-----------------------------------------------------------------------------------
+def main():
+	''' the main program of telloSim '''
+	global Running
+	global DebugLevel
+	global Drones
+	global Loss
+	global Reorder
+	global Latency
+	global Jitter
+	global Delay
+	global MoveSpeed
+	global TurnSpeed
+	global TakeoffTime
+	global Rate
+	global Drift
+	global Fps
+	global Gop
+
+	Parser = argparse.ArgumentParser(description = "telloSim - a simulated Tello for testing tellTello without hardware")
+	Parser.add_argument("--ip", type=str, default='127.0.0.2', help="address to listen on, default=127.0.0.2")
+	Parser.add_argument("-n", "--count", type=int, default=1, help="number of simulated Tellos, on consecutive addresses")
+	Parser.add_argument("-r", "--rate", type=float, default=Rate, help="state frames per second, default=" + str(Rate))
+	Parser.add_argument("--delay", type=float, default=Delay, help="seconds until a command is answered, default=" + str(Delay))
+	Parser.add_argument("--movespeed", type=float, default=MoveSpeed, help="cm/s for up, down, forward ..., default=" + str(MoveSpeed))
+	Parser.add_argument("--turnspeed", type=float, default=TurnSpeed, help="degrees/s for cw and ccw, default=" + str(TurnSpeed))
+	Parser.add_argument("--takeofftime", type=float, default=TakeoffTime, help="seconds for takeoff and land, default=" + str(TakeoffTime))
+	Parser.add_argument("--loss", type=float, default=0, help="probability that a packet gets lost, like 0.01")
+	Parser.add_argument("--reorder", type=float, default=0, help="probability that a packet is overtaken by the following ones")
+	Parser.add_argument("--latency", type=float, default=0, help="seconds added to every packet")
+	Parser.add_argument("--jitter", type=float, default=0, help="up to this number of seconds is added randomly to every packet")
+	Parser.add_argument("--drift", type=float, default=Drift, help="cm/s the Tellos sink while flying, to try the altitude hold of tellTello")
+	Parser.add_argument("--fps", type=float, default=Fps, help="video frames per second after streamon, default=" + str(Fps))
+	Parser.add_argument("--gop", type=int, default=Gop, help="a video keyframe every n frames, default=" + str(Gop))
+	Parser.add_argument("-d", "--debug", type=int, default=1, help="debug level ... 0=no debug messages, 2=show commands and answers")
+	args = Parser.parse_args()
+
+	DebugLevel = args.debug
+	Rate = args.rate
+	Delay = args.delay
+	MoveSpeed = args.movespeed
+	TurnSpeed = args.turnspeed
+	TakeoffTime = args.takeofftime
+	Loss = args.loss
+	Reorder = args.reorder
+	Latency = args.latency
+	Jitter = args.jitter
+	Fps = args.fps
+	Gop = args.gop
+	Drift = args.drift
+
+	Address = [int(Part) for Part in args.ip.split('.')]
+	for Number in range (0, args.count):
+		IpAddress = '.'.join ([str(Part) for Part in Address[:3]] + [str(Address[3] + Number)])
+		Drones.append (newDrone (Number, IpAddress))
+
+	Threads = [threading.Thread(target=sender), threading.Thread(target=sendState), threading.Thread(target=sendVideo)]
+	for Drone in Drones:
+		Threads.append (threading.Thread(target=recvCommands, args=(Drone,)))
+	for Thread in Threads:
+		Thread.start()
+	debug (1, "simulating " + str(len(Drones)) + " Tello(s) on " + ", ".join ([Drone["ip"] for Drone in Drones]) + ", ctrl-C to end")
+
+	try:
+		while (Running):
+			time.sleep (1)
+	except KeyboardInterrupt:
+		Running = False
+	for Thread in Threads:
+		Thread.join()
+	for Drone in Drones:
+		Drone["sock"].close()
+	debug (1, str(sum ([Drone["commands"] for Drone in Drones])) + " commands received, " + str(StateFrames) + " state frames, " +
+		str(VideoPackets) + " video packets, " + str(Sent) + " packets sent, " + str(Dropped) + " dropped")
+
+#--------------------------------------------------------------------------
+
+if __name__ == '__main__':
+	main()
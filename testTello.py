@@ -0,0 +1,199 @@
+# tests for tellTello, by Martin Piehslinger
+
+'''
+Checks of tellTello which need no Tello, some of them against telloSim.py on a loopback address.
+Prints ok or what went wrong per test, the exit code is 1 if a test has failed:
+
+    python testTello.py
+    python testTello.py --test rule record
+
+rule    ... a rule fires and its command is sent while nobody types anything, in both engines
+profile ... profile start and dump reach every thread, and no profiler is left behind at the end
+record  ... commands and answers longer than a record come back whole from a recording, also across blocks
+query   ... queries answered from the state frames look like the answers of telloSim (height? in dm, tof? in mm ...)
+watch   ... an expression can't take the name of a state key, whose column it would share
+'''
+
+import tellTello
+import telloSim
+import threading
+import subprocess
+import tempfile
+import shutil
+import sys
+import os
+import time
+import argparse
+
+#-----------------------------------------------------------------------------------
+def here (FileName):
+	''' FileName in the directory of testTello '''
+	return (os.path.join (os.path.dirname (os.path.abspath (__file__)), FileName))
+#-----------------------------------------------------------------------------------
+def simulator (IpAddress):
+	''' start telloSim on IpAddress. Returns the process and a list which collects (time, line) of what it prints '''
+	Simulator = subprocess.Popen ([sys.executable, "-u", here ("telloSim.py"), "--ip", IpAddress, "-d", "2", "--delay", "0"],
+		stdout = subprocess.PIPE, stderr = subprocess.STDOUT, text = True)
+	Lines = []
+	def collect ():
+		for Line in Simulator.stdout:
+			Lines.append ((time.time(), Line.strip()))
+	threading.Thread (target = collect, daemon = True).start()
+	time.sleep (1)						# let telloSim bind its socket
+	return (Simulator, Lines)
+#-----------------------------------------------------------------------------------
+def testRule (IpAddress):
+	''' a script adds a rule which is true at once, then tellTello waits for console input which never comes. The command of
+	the rule has to reach telloSim anyway '''
+	Errors = []
+	with tempfile.NamedTemporaryFile ("w", suffix = ".txt", delete = False) as Script:
+		Script.write ("when bat<200 once do takeoff\n")
+	try:
+		for Engine in ["threads", "asyncio"]:
+			Simulator, Lines = simulator (IpAddress)
+			Tello = subprocess.Popen ([sys.executable, here ("tellTello.py"), "--ip", IpAddress, "-e", Engine, "-s", Script.name],
+				stdin = subprocess.PIPE, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL, text = True)
+			try:
+				End = time.time() + 10
+				while ((time.time() < End) and (not any ([Line.endswith ("< takeoff") for Time, Line in Lines]))):
+					time.sleep (0.05)
+				if (not any ([Line.endswith ("< takeoff") for Time, Line in Lines])):
+					Errors.append (Engine + ": the command of the rule has not been sent without console input")
+				Tello.stdin.write ("end\n")
+				Tello.stdin.flush()
+				Tello.wait (10)
+			finally:
+				if (Tello.poll() is None):
+					Tello.kill()
+				Simulator.terminate()
+				Simulator.wait()
+	finally:
+		os.remove (Script.name)
+	return (Errors)
+#-----------------------------------------------------------------------------------
+def testProfile ():
+	''' profile start, profile dump and end offline, with log and recorder running. profile dump switches profiling on again, so
+	the threads have to take their profilers out themselves when they end '''
+	Errors = []
+	Folder = tempfile.mkdtemp()
+	try:
+		for Engine in ["threads", "asyncio"]:
+			Tello = subprocess.Popen ([sys.executable, here ("tellTello.py"), "-o", "yes", "-e", Engine, "-l", os.path.join (Folder, "log.csv"),
+				"-r", os.path.join (Folder, "flight.rec")], stdin = subprocess.PIPE, stdout = subprocess.PIPE, stderr = subprocess.STDOUT, text = True)
+			try:
+				for Line, Wait in [("", 2), ("profile start", 3), ("profile dump " + os.path.join (Folder, "flight.prof"), 3), ("end", 0)]:
+					time.sleep (Wait)
+					Tello.stdin.write (Line + "\n")
+					Tello.stdin.flush()
+				Output = Tello.communicate (timeout = 20)[0]
+			finally:
+				if (Tello.poll() is None):
+					Tello.kill()
+			Written = [Line for Line in Output.splitlines() if (" written to " in Line)]
+			if (len(Written) == 0):
+				Errors.append (Engine + ": no profile written")
+			elif (Engine == "threads"):
+				for Name in ["main", "timer", "recvBasic", "recvState", "log", "recorder"]:
+					if (Name not in Written[0]):
+						Errors.append (Engine + ": " + Name + " has not been profiled")
+			if ("Exception ignored" in Output):
+				Errors.append (Engine + ": a profiler has been left installed")
+	finally:
+		shutil.rmtree (Folder)
+	return (Errors)
+
+#-----------------------------------------------------------------------------------
+def testRecord ():
+	''' record commands and answers which are longer than a record, with and without compression and with blocks of 3 records,
+	so a long text goes on in the next block. Read them back with recorderTexts (if numpy is there) and replayFrames '''
+	Errors = []
+	Folder = tempfile.mkdtemp()
+	BlockSize = tellTello.RecorderBlockSize
+	try:
+		for Compress in [False, True]:
+			for tellTello.RecorderBlockSize in [BlockSize, 3]:
+				Name = ("compressed" if Compress else "uncompressed") + ", " + str(tellTello.RecorderBlockSize) + " records per block"
+				FileName = os.path.join (Folder, "flight.rec")
+				tellTello.recorderStart (FileName, Compress)
+				Slot = 4 * len(tellTello.RecorderFields)
+				Long = "when h>" + "9" * Slot + " do forward 20 # " + "ö" * Slot
+				Commands = [(1.0, "takeoff"), (2.0, Long), (3.0, Long[:Slot]), (4.0, Long)]
+				for Time, Command in Commands:
+					tellTello.recorderAdd (tellTello.RecordCommand, Time, Command)
+					tellTello.recorderAdd (tellTello.RecordAnswer, Time + 0.5, "error " + Command)
+				tellTello.recorderStop ()
+				if (tellTello.numpy is not None):
+					Header, Records = tellTello.recorderRead (FileName)
+					if (tellTello.recorderTexts (Header, Records, tellTello.RecordCommand) != Commands):
+						Errors.append (Name + ": recorderTexts has not given the commands back")
+					if (tellTello.recorderTexts (Header, Records, tellTello.RecordAnswer) != [(Time + 0.5, "error " + Command) for Time, Command in Commands]):
+						Errors.append (Name + ": recorderTexts has not given the answers back")
+				if ([(Time, Text) for Type, Time, Text in tellTello.replayFrames (FileName)] != Commands):
+					Errors.append (Name + ": replayFrames has not given the commands back")
+	finally:
+		tellTello.RecorderBlockSize = BlockSize
+		shutil.rmtree (Folder)
+	return (Errors)
+
+#-----------------------------------------------------------------------------------
+def testQuery ():
+	''' feed a state frame of telloSim to tellTello, then compare every query of QueryState with the answer telloSim gives to it.
+	baro? is left out, telloSim adds noise to the baro of its state frames '''
+	Errors = []
+	Drone = {"number": 0, "bat": 87, "h": 57, "yaw": 30, "motor": 12, "rc": [0, 0, 0, 0]}
+	WhichWatch = tellTello.WhichWatch
+	try:
+		tellTello.WhichWatch = sorted (set ([Key for Keys, Format in tellTello.QueryState.values() for Key in Keys]))
+		tellTello.stateKeys ()
+		tellTello.stateReceived (tellTello.stateLoad (telloSim.stateString (Drone)))
+		for Query in tellTello.QueryState:
+			if ((Query == "baro?") or (Query not in telloSim.Queries)):
+				continue
+			Answer = tellTello.queryAnswer (Query)
+			if (Answer is None):
+				Errors.append (Query + " has not been answered from the state frame")
+			elif (Answer[0] != telloSim.Queries[Query] (Drone)):
+				Errors.append (Query + " answered " + Answer[0] + " instead of " + telloSim.Queries[Query] (Drone))
+	finally:
+		tellTello.WhichWatch = WhichWatch
+		tellTello.stateKeys ()
+	return (Errors)
+
+#-----------------------------------------------------------------------------------
+def testWatch ():
+	''' h=bat*2 would share its column with the state key h, so watchItem rejects it. Other names and plain keys are fine '''
+	Errors = []
+	for Item in ["h=bat*2", "bat=h+1"]:
+		if (tellTello.watchCheck ([Item]) == ''):
+			Errors.append (Item + " has been accepted")
+	for Item in ["h", "hh=h*2", "h*2", "speed=sqrt(vgx**2+vgy**2)"]:
+		Error = tellTello.watchCheck ([Item])
+		if (Error != ''):
+			Errors.append (Item + ": " + Error)
+	return (Errors)
+
+#-----------------------------------------------------------------------------------
+def main():
+	''' the main program of testTello '''
+	Tests = {"rule": lambda args: testRule (args.ip), "profile": lambda args: testProfile (),
+		"record": lambda args: testRecord (), "query": lambda args: testQuery (),
+		"watch": lambda args: testWatch ()}
+	Parser = argparse.ArgumentParser(description = "testTello - checks of tellTello, with telloSim where a Tello is needed")
+	Parser.add_argument("-t", "--test", type=str, nargs='+', choices=list(Tests), default=list(Tests), help="tests to run, default=all")
+	Parser.add_argument("--ip", type=str, default='127.0.0.2', help="address of telloSim, default=127.0.0.2")
+	args = Parser.parse_args()
+
+	tellTello.DebugLevel = 0
+	Failed = 0
+	for Name in args.test:
+		Errors = Tests[Name] (args)
+		print (Name + ": " + ("ok" if (len(Errors) == 0) else "FAILED"))
+		for Error in Errors:
+			print ("    " + Error)
+		Failed = Failed + (len(Errors) > 0)
+	sys.exit (1 if (Failed > 0) else 0)
+
+#--------------------------------------------------------------------------
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,136 @@
+# cut video recordings of tellTello, by Martin Piehslinger
+
+'''
+Cut a time window or a snapshot out of a video recording of tellTello (video record flight.h264), using the keyframe
+index (flight.h264.idx) that tellTello writes along with it. Only the part of the video which is needed is read,
+so this is instant even for recordings of several hours.
+
+    python videoCut.py flight.h264 --start 120 --end 150 -o part.h264
+    python videoCut.py flight.h264 --at 1700000123.5 -o snapshot.jpg
+    python videoCut.py flight.h264 --list
+
+Times are seconds since the start of the recording, or time stamps (time.time(), like the time column of a watch log
+or the received column of a flight recording), so a moment seen in the telemetry can be found in the video.
+A window starts at the keyframe before --start and ends at the keyframe after --end.
+Outputs which don't end with .h264 or .264 (like .mp4 or .jpg) are written by ffmpeg.
+'''
+
+import tellTello
+import bisect
+import subprocess
+import sys
+import os
+import time
+import argparse
+
+#-----------------------------------------------------------------------------------
+def flightTime (Header, Time):
+	''' a time given by the user as time stamp: small numbers are seconds since the start of the recording '''
+	if (Time < 1e9):
+		return (Header["started"] + Time)
+	return (Time)
+#-----------------------------------------------------------------------------------
+def window (Index, Size, Start, End):
+	''' byte offsets (first, last) of the video from the keyframe at or before Start to the first keyframe after End (or the end of the file) '''
+	Times = [Entry[0] for Entry in Index]
+	First = max (0, bisect.bisect_right (Times, Start) - 1)
+	Last = bisect.bisect_right (Times, End)
+	return (Index[First][1], Index[Last][1] if (Last < len(Index)) else Size)
+#-----------------------------------------------------------------------------------
+def readPart (FileName, First, Last):
+	''' read bytes First .. Last of FileName, without touching the rest '''
+	with open (FileName, "rb") as File:
+		File.seek (First)
+		return (File.read (Last - First))
+#-----------------------------------------------------------------------------------
+def snapshot (Data, GopStart, GopEnd, Time):
+	''' the part of a group of pictures (Data, from a keyframe received at GopStart to the next one at GopEnd) which ends with the frame
+	received at about Time. Frames between keyframes have no time stamps, they are assumed to be evenly spaced '''
+	Frames = []									# end of each frame in Data
+	Position = 0
+	while (True):
+		Found = Data.find (b"\x00\x00\x01", Position)
+		if (Found < 0):
+			break
+		if ((Found + 3 < len(Data)) and ((Data[Found + 3] & 0x1f) in [1, 5])):
+			if (len(Frames) > 0):
+				Frames[-1] = Found
+			Frames.append (len(Data))
+		Position = Found + 3
+	if ((len(Frames) == 0) or (GopEnd <= GopStart)):
+		return (Data)
+	Frame = int ((Time - GopStart) / (GopEnd - GopStart) * len(Frames))
+	return (Data[:Frames[max (0, min (Frame, len(Frames) - 1))]])
+#-----------------------------------------------------------------------------------
+def write (Data, FileName, LastFrame):
+	''' write H.264 Data to FileName, raw or through ffmpeg. LastFrame = True: only the last frame (for images) '''
+	if (FileName.lower().endswith ((".h264", ".264"))):
+		with open (FileName, "wb") as File:
+			File.write (Data)
+		return (True)
+	Command = ["ffmpeg", "-y", "-loglevel", "error", "-f", "h264", "-i", "-"]
+	if (LastFrame):
+		Command = Command + ["-update", "1", FileName]
+	else:
+		Command = Command + ["-c", "copy", FileName]
+	try:
+		Result = subprocess.run (Command, input = Data)
+	except OSError as e:
+		print (str(e))
+		print ("Error: ffmpeg is needed for " + FileName + ", write a .h264 file instead")
+		return (False)
+	return (Result.returncode == 0)
+
+#-----------------------------------------------------------------------------------
+def main():
+	''' the main program of videoCut '''
+	Parser = argparse.ArgumentParser(description = "videoCut - cut time windows and snapshots out of tellTello's video recordings, using their keyframe index")
+	Parser.add_argument("video", type=str, help="video recording (.h264), the index (.h264.idx) has to be next to it")
+	Parser.add_argument("-o", "--output", type=str, default='', help="output file, .h264 or anything ffmpeg can write (.mp4, .jpg ...)")
+	Parser.add_argument("--start", type=float, default=None, help="start of the window (seconds since the start of the recording, or a time stamp)")
+	Parser.add_argument("--end", type=float, default=None, help="end of the window, default=start + 10 s")
+	Parser.add_argument("--at", type=float, default=None, help="snapshot: the frame at this time")
+	Parser.add_argument("--list", action="store_true", help="list the keyframes")
+	args = Parser.parse_args()
+
+	Header, Index = tellTello.videoIndexRead (args.video)
+	if ((Header is None) or (len(Index) == 0)):
+		print ("Error: no keyframes in the index of " + args.video)
+		sys.exit (1)
+	Size = os.path.getsize (args.video)
+	Started = Header["started"]
+
+	if (args.list):
+		for Number, (Time, Offset) in enumerate (Index):
+			print (str(Number) + "\t" + str(round (Time - Started, 3)) + " s\t" + time.strftime ("%H:%M:%S", time.localtime (Time)) + "\t" + str(Offset))
+		return
+	if (args.output == ''):
+		print ("Error: no output file given (-o)")
+		sys.exit (1)
+
+	if (args.at is not None):
+		Time = flightTime (Header, args.at)
+		First, Last = window (Index, Size, Time, Time)
+		Number = max (0, bisect.bisect_right ([Entry[0] for Entry in Index], Time) - 1)
+		GopEnd = Index[Number + 1][0] if (Number + 1 < len(Index)) else Time
+		Data = snapshot (readPart (args.video, First, Last), Index[Number][0], GopEnd, Time)
+		LastFrame = True
+	elif (args.start is not None):
+		Start = flightTime (Header, args.start)
+		End = flightTime (Header, args.end) if (args.end is not None) else Start + 10
+		First, Last = window (Index, Size, Start, End)
+		Data = readPart (args.video, First, Last)
+		LastFrame = False
+	else:
+		print ("Error: give --start (and --end), --at or --list")
+		sys.exit (1)
+
+	if (write (Data, args.output, LastFrame)):
+		print (args.output + ": " + str(len(Data)) + " bytes from " + args.video + " (bytes " + str(First) + " .. " + str(First + len(Data)) + ")")
+	else:
+		sys.exit (1)
+
+#--------------------------------------------------------------------------
+
+if __name__ == '__main__':
+	main()